@@ -1,11 +1,21 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import cv2
-import base64
-import tempfile
+"""
+The old food-only service (POST /scan/foods), kept for clients that still call it. Scans run
+on the shared food pipeline in backend/services, the same one behind /analyze-food; this app
+only keeps the old route and response shape ({"text": str, "raw_output": dict}).
+"""
+import asyncio
 import os
-from services.gemini import analyze_food
+import sys
+
+# backend/ holds the shared `services` package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi import FastAPI, UploadFile, File  # noqa: E402
+from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
+from pydantic import BaseModel  # noqa: E402
+from services import camera  # noqa: E402
+from services.gemini import analyze_food  # noqa: E402
+from services.images import ScanImage  # noqa: E402
 
 app = FastAPI()
 
@@ -30,29 +40,15 @@ async def analyze_meds_endpoint(file: UploadFile = File(None), capture: bool = F
     """
 
     if capture:
-        # Capture a frame using OpenCV
-        cap = cv2.VideoCapture(0)
-        ret, frame = cap.read()
-        cap.release()
-        if not ret:
+        picked = await asyncio.get_running_loop().run_in_executor(None, camera.get_camera().grab)
+        if picked is None:
             return {"text": "Camera error", "raw_output": {}}
-        
-        # Save temp file
-        tmp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg").name
-        cv2.imwrite(tmp_path, frame)
-        image_path = tmp_path
+        scan = ScanImage.from_frame(picked[0])
     else:
-        # Save uploaded file
-        contents = await file.read()
-        tmp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg").name
-        with open(tmp_path, "wb") as f:
-            f.write(contents)
-        image_path = tmp_path
-
-    # Call Gemini analysis service
-    result = await analyze_food(image_path)
+        scan = ScanImage(await file.read())
 
-    # cleanup
-    os.remove(image_path)
+    result = await analyze_food(scan)
 
-    return result
\ No newline at end of file
+    # The old response carried the answer as one string
+    text = result.get("text") or {}
+    return {"text": text.get("error") or text.get("plain") or "", "raw_output": result.get("raw_output") or {}}
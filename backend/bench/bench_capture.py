@@ -0,0 +1,84 @@
+"""
+Benchmark for the capture=true path, using SyntheticSource so no camera is needed.
+
+Compares the old per-request flow (open the device, read one frame, release it, encode a
+JPEG) against CameraService.grab() from a shared ring that is kept filled in the background,
+and checks that the ring hands out the sharpest recent frame rather than the first one.
+
+    cd backend
+    python bench/bench_capture.py [--scans 50] [--open-delay-ms 300] [--fps 30]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.camera import CameraService, SyntheticSource, sharpness  # noqa: E402
+from services.images import ScanImage  # noqa: E402
+
+
+def _summary(name: str, latencies, scores):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+    print(
+        f"{name:<14} p50={1000 * statistics.median(latencies):7.1f} ms  p95={1000 * p95:7.1f} ms  "
+        f"sharpness avg={statistics.mean(scores):8.1f} min={min(scores):8.1f}"
+    )
+
+
+def per_request(args):
+    latencies, scores = [], []
+    for i in range(args.scans):
+        started = time.perf_counter()
+        source = SyntheticSource(args.width, args.height, fps=args.fps, open_delay=args.open_delay_ms / 1000.0, seed=i)
+        frame = source.read()
+        source.close()
+        ScanImage.from_frame(frame)
+        latencies.append(time.perf_counter() - started)
+        scores.append(sharpness(frame))
+    _summary("per-request", latencies, scores)
+
+
+def ring(args):
+    service = CameraService(
+        lambda: SyntheticSource(args.width, args.height, fps=args.fps, open_delay=args.open_delay_ms / 1000.0),
+        name=f"nutrilens-camera-bench-{os.getpid()}",
+        slots=args.slots,
+        mode="own",
+    )
+    service.start()
+    service.grab()  # the device opens once, outside the measured scans
+    latencies, scores = [], []
+    try:
+        for _ in range(args.scans):
+            # Scans arrive spread out, as at a kiosk, so the ring has moved on in between
+            time.sleep(args.interval_ms / 1000.0)
+            started = time.perf_counter()
+            frame, info = service.grab()
+            ScanImage.from_frame(frame)
+            latencies.append(time.perf_counter() - started)
+            scores.append(info["sharpness"])
+    finally:
+        service.stop()
+    _summary("shared ring", latencies, scores)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scans", type=int, default=50)
+    ap.add_argument("--open-delay-ms", type=float, default=300.0, help="simulated device open time")
+    ap.add_argument("--fps", type=float, default=30.0)
+    ap.add_argument("--width", type=int, default=1280)
+    ap.add_argument("--height", type=int, default=720)
+    ap.add_argument("--slots", type=int, default=8)
+    ap.add_argument("--interval-ms", type=float, default=100.0, help="gap between scans in the ring run")
+    args = ap.parse_args()
+    per_request(args)
+    ring(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark for the drug-name index (services/drug_names.py): build time, lookups per
+second for exact names, OCR-misread names (folded, no edits), names one or two real edits
+away and words that aren't drugs, then how well it corrects a noisy copy of the whole
+vocabulary and how often other label words (from the extractor's corpus) are pulled onto a
+drug name.
+
+    cd backend
+    python bench/bench_drug_names.py [--iterations 20000] [--seed 3]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.drug_names import DEFAULT_VOCAB_PATH, DrugIndex, fold  # noqa: E402
+from services.extractor import DEFAULT_CORPUS_PATH  # noqa: E402
+
+QUERIES = (
+    ("exact", "atorvastatin"),
+    ("exact brand", "Lipitor"),
+    ("exact multi-word", "insulin glargine"),
+    ("ocr misread", "Amoxici11in"),
+    ("ocr misread", "SERTRA1INE"),
+    ("one edit", "amoxicilin"),
+    ("swap", "atrovastatin"),
+    ("two edits", "levothyroxne sodum"),
+    ("not a drug", "tablets"),
+    ("not a drug", "pharmacy"),
+)
+SWAPS = (("l", "1"), ("i", "1"), ("o", "0"), ("s", "5"), ("b", "8"), ("m", "rn"))
+
+
+def noisy(name: str, rng: random.Random) -> str:
+    # An OCR misread plus, half the time, one real edit
+    out = name
+    for src, dst in SWAPS:
+        if src in out and rng.random() < 0.3:
+            out = out.replace(src, dst, 1)
+    if len(out) > 7 and rng.random() < 0.5:
+        i = rng.randrange(1, len(out) - 1)
+        out = rng.choice((out[:i] + out[i + 1:], out[:i] + rng.choice("aeiourn") + out[i + 1:]))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--iterations", type=int, default=20000)
+    ap.add_argument("--vocab", default=DEFAULT_VOCAB_PATH)
+    ap.add_argument("--seed", type=int, default=3)
+    args = ap.parse_args()
+
+    started = time.perf_counter()
+    index = DrugIndex.from_csv(args.vocab)
+    stats = index.stats()
+    print(f"built index of {stats['names']} names ({stats['delete_entries']} delete keys) "
+          f"in {1000 * (time.perf_counter() - started):.1f} ms")
+
+    for kind, query in QUERIES:
+        found = index.lookup(query)
+        n = max(1, args.iterations // len(QUERIES))
+        started = time.perf_counter()
+        for _ in range(n):
+            index.lookup(query)
+        per_call = (time.perf_counter() - started) / n
+        match = f"{found[0]} (d={found[3]})" if found else "-"
+        print(f"{kind:<17} {query:<20} -> {match:<24} {1e6 * per_call:6.1f} us  {1 / per_call:>10,.0f}/s")
+
+    rng = random.Random(args.seed)
+    names = [name for name, _, _ in index.names]
+    right = wrong = missed = 0
+    for name in names:
+        found = index.lookup(noisy(name, rng))
+        if found is None:
+            missed += 1
+        elif fold(found[0]) == fold(name) or found[1] == index.lookup(name)[1]:
+            right += 1
+        else:
+            wrong += 1
+    print(f"\nnoisy vocabulary ({len(names)} names): {right} corrected, {wrong} wrong drug, {missed} not found")
+
+    with open(DEFAULT_CORPUS_PATH, encoding="utf-8") as f:
+        text = re.sub(r"\[(?:name|generic) [^\]]*\]", " ", f.read())
+    words = {w for w in re.findall(r"[A-Za-z][A-Za-z0-9'-]{2,}", text)}
+    # Words that fold to a drug name exactly are real mentions ("allergic to penicillin")
+    false_hits = sorted(w for w in words if (index.lookup(w) or (0, 0, 0, 0))[3] > 0)
+    print(f"other label words fuzzily matched to a drug: {len(false_hits)} of {len(words)}"
+          + (f" ({', '.join(false_hits[:10])})" if false_hits else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark for the local label extractor (services/extractor.py) against the regex parser:
+per-label latency in-process, throughput through the worker pool with single requests
+micro-batched versus sent one at a time, and field accuracy on the real OCR samples (the
+hand-annotated first labels of the corpus; the shipped weights have seen them, so
+--holdout-real retrains without them first for an honest number).
+
+    cd backend
+    python bench/bench_extractor.py [--iterations 200] [--requests 400] [--workers 2] [--holdout-real]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.extractor import (  # noqa: E402
+    DEFAULT_WEIGHTS_PATH,
+    LabelExtractor,
+    LocalExtractor,
+    evaluate,
+    read_corpus,
+    train,
+)
+from services.label_parser import heuristic_parse  # noqa: E402
+
+REAL_LABELS = 12
+
+
+def per_label_us(fn, texts, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            fn(text)
+    return 1e6 * (time.perf_counter() - started) / (iterations * len(texts))
+
+
+async def pool_throughput(texts, requests: int, workers: int, batch_size: int) -> float:
+    extractor = LocalExtractor(workers=workers, batch_size=batch_size).start()
+    try:
+        await extractor.extract(texts[0])
+        started = time.perf_counter()
+        await asyncio.gather(*(extractor.extract(texts[i % len(texts)]) for i in range(requests)))
+        return requests / (time.perf_counter() - started)
+    finally:
+        extractor.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--iterations", type=int, default=200)
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--weights", default=DEFAULT_WEIGHTS_PATH)
+    ap.add_argument("--holdout-real", action="store_true", help="retrain on the synthetic labels only before scoring")
+    args = ap.parse_args()
+
+    corpus = read_corpus()
+    real = corpus[:REAL_LABELS]
+    texts = ["\n".join(text for _, text, _ in label) for label in real]
+
+    started = time.perf_counter()
+    model = LabelExtractor.from_file(args.weights)
+    print(f"loaded weights in {1000 * (time.perf_counter() - started):.1f} ms")
+    print(f"{len(texts)} real labels, {args.iterations} iterations")
+    print(f"  regex parser      {per_label_us(heuristic_parse, texts, args.iterations):9.1f} us/label")
+    print(f"  local extractor   {per_label_us(model.extract, texts, args.iterations):9.1f} us/label")
+
+    print(f"\nworker pool ({args.workers} workers, {args.requests} concurrent single requests)")
+    for batch_size in (1, 16):
+        rate = asyncio.run(pool_throughput(texts, args.requests, args.workers, batch_size))
+        print(f"  batch size {batch_size:>2}     {rate:9,.0f} labels/s")
+
+    if args.holdout_real:
+        model = train(corpus[REAL_LABELS:])
+    print("\nexact-match field accuracy on the real labels" + (" (held out)" if args.holdout_real else ""))
+    scores = {"regex parser": evaluate(heuristic_parse, real), "local extractor": evaluate(model.extract, real)}
+    fields = list(scores["regex parser"])
+    print("  " + " " * 16 + "".join(f"{f[:12]:>13}" for f in fields))
+    for name, score in scores.items():
+        print(f"  {name:<16}" + "".join(f"{score[f]:>13.2f}" for f in fields))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Micro-benchmark for the medication label parser.
+
+Compares the compiled, table-driven parser in services/label_parser.py against the original
+inline heuristic (kept here verbatim as the baseline), then grows the rule set with synthetic
+keywords to show how parse time scales with rule count.
+
+    cd backend
+    python bench/bench_label_parser.py [--iterations 2000] [--corpus bench/corpus/ocr_samples.txt]
+"""
+import argparse
+import copy
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.label_parser import LabelParser, default_parser  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "corpus", "ocr_samples.txt")
+
+
+def legacy_heuristic_parse(text: str):
+    # The parser as it was originally inlined in analyze_meds
+    out = {
+        "medicationName": "",
+        "genericName": "",
+        "dosage": "",
+        "frequency": "",
+        "instructions": [],
+        "warnings": [],
+        "sideEffects": [],
+        "plainLanguage": "",
+    }
+    if not text:
+        return out
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    if not lines:
+        return out
+    out["medicationName"] = lines[0]
+    dose_rx = re.search(r"(\d+\s?(mg|ml|mcg|g)\b|\d+\s?units)", text, re.I)
+    if dose_rx:
+        out["dosage"] = dose_rx.group(0)
+    freq_rx = re.search(r"(once daily|twice daily|every \d+ (hours|hrs)|daily|every day|at bedtime|as needed|prn|weekly|monthly)", text, re.I)
+    if freq_rx:
+        out["frequency"] = freq_rx.group(0)
+    instr = []
+    for l in lines[1:8]:
+        if re.match(r"^\d+\.|^-|^•|^\*", l) or len(l.split()) > 3:
+            instr.append(l)
+    out["instructions"] = instr
+    for l in lines:
+        if re.search(r"(warning|caution|avoid|do not|risk|contraindicat)", l, re.I):
+            out["warnings"].append(l)
+        if re.search(r"(side effect|nausea|dizziness|headache|rash|allergic)", l, re.I):
+            out["sideEffects"].append(l)
+    out["plainLanguage"] = " ".join(lines[:2])
+    return out
+
+
+def naive_parse(rules: dict, text: str):
+    # Rule-per-search baseline: one re.search per keyword per line, the way the rule set
+    # would grow if keywords kept being appended to the inline code
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    out = {"warnings": [], "sideEffects": []}
+    for field in out:
+        for l in lines:
+            if any(re.search(re.escape(k), l, re.I) for k in rules[field]["keywords"]):
+                out[field].append(l)
+    return out
+
+
+def load_corpus(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [s.strip() for s in f.read().split("\n---\n") if s.strip()]
+
+
+def timeit(fn, samples, iterations: int) -> float:
+    """
+    Return microseconds per parse.
+    """
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for s in samples:
+            fn(s)
+    elapsed = time.perf_counter() - started
+    return 1e6 * elapsed / (iterations * len(samples))
+
+
+def synthetic_rules(base: dict, extra: int) -> dict:
+    rules = copy.deepcopy(base)
+    for i in range(extra):
+        rules["warnings"]["keywords"].append(f"warnkw{i:05d}")
+        rules["sideEffects"]["keywords"].append(f"sidekw{i:05d}")
+        rules["frequency"]["keywords"].append(f"freqkw{i:05d}")
+    return rules
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", default=DEFAULT_CORPUS)
+    ap.add_argument("--iterations", type=int, default=2000)
+    args = ap.parse_args()
+
+    samples = load_corpus(args.corpus)
+    parser = default_parser()
+    print(f"corpus: {len(samples)} samples, {args.iterations} iterations")
+    print(f"  legacy inline parser   {timeit(legacy_heuristic_parse, samples, args.iterations):8.2f} us/parse")
+    print(f"  compiled table parser  {timeit(parser.parse, samples, args.iterations):8.2f} us/parse")
+
+    print("\nscaling with rule count (keywords added per family):")
+    print(f"  {'extra':>6}  {'compiled us':>12}  {'naive us':>10}")
+    iterations = max(1, args.iterations // 20)
+    for extra in (0, 100, 1000, 5000):
+        rules = synthetic_rules(parser.rules, extra)
+        scaled = LabelParser(rules)
+        compiled_us = timeit(scaled.parse, samples, iterations)
+        naive_us = timeit(lambda s: naive_parse(rules, s), samples, max(1, iterations // 10)) if extra <= 1000 else float("nan")
+        print(f"  {extra:>6}  {compiled_us:>12.2f}  {naive_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Micro-benchmark for the nutrition table: load time and name lookups per second for the
+kinds of names the model returns (exact, plural, misspelled, "X with Y", unknown).
+
+    cd backend
+    python bench/bench_nutrition.py [--iterations 20000] [--table services/data/nutrition.csv]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.nutrition import DEFAULT_TABLE_PATH, NutritionTable  # noqa: E402
+
+QUERIES = (
+    "banana",
+    "Bananas",
+    "grilled chicken breast",
+    "spaghetti with tomato sauce",
+    "bowl of oatmeal with blueberries",
+    "roasted brocoli",
+    "greek yoghurt",
+    "2 slices of pepperoni pizza",
+    "chicken tikka masala",
+    "dragonfruit",
+)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--iterations", type=int, default=20000)
+    ap.add_argument("--table", default=DEFAULT_TABLE_PATH)
+    args = ap.parse_args()
+
+    started = time.perf_counter()
+    table = NutritionTable.from_csv(args.table)
+    print(f"loaded {len(table)} foods in {1000 * (time.perf_counter() - started):.1f} ms")
+
+    for query in QUERIES:
+        found = table.match(query)
+        n = max(1, args.iterations // len(QUERIES))
+        started = time.perf_counter()
+        for _ in range(n):
+            table.match(query)
+        per_call = (time.perf_counter() - started) / n
+        match = f"{table.names[found[0]]} ({found[1]:.2f})" if found else "-"
+        print(f"{query:<34} -> {match:<28} {1e6 * per_call:6.1f} us  {1 / per_call:>10,.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""
+Builds services/data/label_corpus.txt, the labelled corpus the local extractor
+(services/extractor.py) is trained and evaluated on.
+
+Most of it is synthetic: pharmacy labels assembled from a table of drugs, strengths, forms and
+the instruction / warning / side-effect phrasings seen on real labels, put through the kinds of
+OCR damage we get from the camera (0/O, 1/l, 5/S and rn/m swaps, upper-cased labels, header
+lines above the drug name). The real samples from bench/corpus/ocr_samples.txt are included
+as hand-annotated labels. The output is deterministic for a given --seed.
+
+    cd backend
+    python bench/make_label_corpus.py [--labels 600] [--seed 7]
+    python -m services.extractor train
+"""
+import argparse
+import os
+import random
+
+OUT = os.path.join(os.path.dirname(__file__), "..", "services", "data", "label_corpus.txt")
+
+# (brand, generic, strengths, form)
+DRUGS = [
+    ("Amoxil", "amoxicillin", ["250 mg", "500 mg", "875 mg", "250 mg/5 mL"], "capsule"),
+    ("Zestril", "lisinopril", ["5 mg", "10 mg", "20 mg", "40 mg"], "tablet"),
+    ("Advil", "ibuprofen", ["200 mg", "400 mg", "600 mg", "800 mg"], "tablet"),
+    ("Glucophage", "metformin", ["500 mg", "850 mg", "1000 mg"], "tablet"),
+    ("Lantus", "insulin glargine", ["100 units/mL"], "injection"),
+    ("Zyrtec", "cetirizine", ["5 mg", "10 mg"], "tablet"),
+    ("Lipitor", "atorvastatin", ["10 mg", "20 mg", "40 mg", "80 mg"], "tablet"),
+    ("Deltasone", "prednisone", ["5 mg", "10 mg", "20 mg"], "tablet"),
+    ("ProAir", "albuterol", ["90 mcg/actuation"], "inhaler"),
+    ("Zoloft", "sertraline", ["25 mg", "50 mg", "100 mg"], "tablet"),
+    ("Norvasc", "amlodipine", ["2.5 mg", "5 mg", "10 mg"], "tablet"),
+    ("Synthroid", "levothyroxine", ["25 mcg", "50 mcg", "75 mcg", "100 mcg"], "tablet"),
+    ("Prilosec", "omeprazole", ["10 mg", "20 mg", "40 mg"], "capsule"),
+    ("Neurontin", "gabapentin", ["100 mg", "300 mg", "600 mg"], "capsule"),
+    ("Cozaar", "losartan", ["25 mg", "50 mg", "100 mg"], "tablet"),
+    ("Zocor", "simvastatin", ["10 mg", "20 mg", "40 mg"], "tablet"),
+    ("Lopressor", "metoprolol tartrate", ["25 mg", "50 mg", "100 mg"], "tablet"),
+    ("Toprol XL", "metoprolol succinate", ["25 mg", "50 mg"], "tablet"),
+    ("Microzide", "hydrochlorothiazide", ["12.5 mg", "25 mg"], "capsule"),
+    ("Lasix", "furosemide", ["20 mg", "40 mg", "80 mg"], "tablet"),
+    ("Coumadin", "warfarin", ["1 mg", "2 mg", "5 mg"], "tablet"),
+    ("Plavix", "clopidogrel", ["75 mg"], "tablet"),
+    ("Eliquis", "apixaban", ["2.5 mg", "5 mg"], "tablet"),
+    ("Flomax", "tamsulosin", ["0.4 mg"], "capsule"),
+    ("Lexapro", "escitalopram", ["5 mg", "10 mg", "20 mg"], "tablet"),
+    ("Prozac", "fluoxetine", ["10 mg", "20 mg", "40 mg"], "capsule"),
+    ("Wellbutrin XL", "bupropion", ["150 mg", "300 mg"], "tablet"),
+    ("Desyrel", "trazodone", ["50 mg", "100 mg"], "tablet"),
+    ("Xanax", "alprazolam", ["0.25 mg", "0.5 mg", "1 mg"], "tablet"),
+    ("Ambien", "zolpidem", ["5 mg", "10 mg"], "tablet"),
+    ("Ultram", "tramadol", ["50 mg"], "tablet"),
+    ("Tylenol", "acetaminophen", ["325 mg", "500 mg", "160 mg/5 mL"], "tablet"),
+    ("Aleve", "naproxen", ["220 mg", "250 mg", "500 mg"], "tablet"),
+    ("Keflex", "cephalexin", ["250 mg", "500 mg"], "capsule"),
+    ("Zithromax", "azithromycin", ["250 mg", "500 mg", "200 mg/5 mL"], "tablet"),
+    ("Cipro", "ciprofloxacin", ["250 mg", "500 mg"], "tablet"),
+    ("Bactrim DS", "sulfamethoxazole/trimethoprim", ["800/160 mg"], "tablet"),
+    ("Vibramycin", "doxycycline", ["50 mg", "100 mg"], "capsule"),
+    ("Flonase", "fluticasone", ["50 mcg/spray"], "nasal spray"),
+    ("Singulair", "montelukast", ["4 mg", "5 mg", "10 mg"], "tablet"),
+    ("Claritin", "loratadine", ["10 mg"], "tablet"),
+    ("Benadryl", "diphenhydramine", ["25 mg", "12.5 mg/5 mL"], "capsule"),
+    ("Pepcid", "famotidine", ["10 mg", "20 mg", "40 mg"], "tablet"),
+    ("Protonix", "pantoprazole", ["20 mg", "40 mg"], "tablet"),
+    ("Zofran", "ondansetron", ["4 mg", "8 mg"], "tablet"),
+    ("Flexeril", "cyclobenzaprine", ["5 mg", "10 mg"], "tablet"),
+    ("Mobic", "meloxicam", ["7.5 mg", "15 mg"], "tablet"),
+    ("Januvia", "sitagliptin", ["25 mg", "50 mg", "100 mg"], "tablet"),
+    ("Jardiance", "empagliflozin", ["10 mg", "25 mg"], "tablet"),
+    ("Humalog", "insulin lispro", ["100 units/mL"], "injection"),
+    ("Crestor", "rosuvastatin", ["5 mg", "10 mg", "20 mg"], "tablet"),
+    ("Coreg", "carvedilol", ["3.125 mg", "6.25 mg", "12.5 mg", "25 mg"], "tablet"),
+    ("Aldactone", "spironolactone", ["25 mg", "50 mg"], "tablet"),
+    ("Klor-Con", "potassium chloride", ["10 mEq", "20 mEq"], "tablet"),
+    ("Valtrex", "valacyclovir", ["500 mg", "1 g"], "tablet"),
+    ("Diflucan", "fluconazole", ["150 mg"], "tablet"),
+    ("Medrol", "methylprednisolone", ["4 mg"], "tablet"),
+    ("Depakote", "divalproex", ["250 mg", "500 mg"], "tablet"),
+    ("Lamictal", "lamotrigine", ["25 mg", "100 mg"], "tablet"),
+    ("Seroquel", "quetiapine", ["25 mg", "50 mg", "100 mg"], "tablet"),
+    ("Vitamin D3", "cholecalciferol", ["1000 IU", "2000 IU", "50000 IU"], "softgel"),
+    ("Fosamax", "alendronate", ["70 mg"], "tablet"),
+    ("Allegra", "fexofenadine", ["60 mg", "180 mg"], "tablet"),
+    ("Imitrex", "sumatriptan", ["25 mg", "50 mg", "100 mg"], "tablet"),
+]
+
+SALTS = {
+    "metformin": ["HCL", "HCL ER"],
+    "cetirizine": ["HCL"],
+    "sertraline": ["HCL"],
+    "bupropion": ["HCL"],
+    "diphenhydramine": ["HCL"],
+    "cyclobenzaprine": ["HCL"],
+    "amlodipine": ["besylate"],
+    "losartan": ["potassium"],
+    "levothyroxine": ["sodium"],
+    "alendronate": ["sodium"],
+    "escitalopram": ["oxalate"],
+}
+
+FORM_WORDS = {
+    "tablet": ["tablet", "tablets", "tab", "tabs"],
+    "capsule": ["capsule", "capsules", "cap", "caps"],
+    "softgel": ["softgel", "softgels"],
+    "injection": ["injection", "pen", "vial"],
+    "inhaler": ["inhaler", "HFA"],
+    "nasal spray": ["nasal spray", "spray"],
+}
+
+ACTIONS = {
+    "tablet": ("Take", "tablet", "by mouth"),
+    "capsule": ("Take", "capsule", "by mouth"),
+    "softgel": ("Take", "softgel", "by mouth"),
+    "injection": ("Inject", "units", "subcutaneously"),
+    "inhaler": ("Inhale", "puffs", "by mouth"),
+    "nasal spray": ("Use", "sprays", "in each nostril"),
+}
+
+FREQUENCIES = [
+    "once daily", "twice daily", "three times daily", "four times daily", "once a day", "twice a day",
+    "three times a day", "daily", "every day", "every morning", "every evening", "every other day",
+    "at bedtime", "every 4 hours", "every 6 hours", "every 8 hours", "every 12 hours", "every 8 hrs",
+    "every 4 to 6 hours", "every 6 to 8 hours", "2 times a day", "3 times per day", "once weekly",
+    "weekly", "as needed", "every 4 hours as needed", "BID", "TID", "QID", "QHS",
+]
+AMOUNTS = ["1", "2", "one", "two", "1/2", "half a"]
+TAILS = ["", "", "", " with food", " with water", " for 10 days", " for pain", " for allergies",
+         " as needed for pain", " until gone", " with a full glass of water", " for 7 days",
+         " while symptoms persist", " as needed for wheezing", " as directed", " if needed for sleep"]
+
+INSTRUCTION_EXTRAS = [
+    "until all medication is taken.", "Take with food.", "Shake well before use.", "Refrigerate.",
+    "Swallow whole.", "Take on an empty stomach.", "Finish all of this medication.",
+    "Discard after 14 days.", "Store at room temperature.", "Prime before first use.",
+    "Rinse mouth after use.", "Take 30 minutes before breakfast.", "Dissolve in water before taking.",
+]
+WARNINGS = [
+    "WARNING: Do not take if allergic to {allergen}.", "Caution: may cause dizziness when standing up",
+    "Avoid alcohol.", "Keep out of reach of children.", "DO NOT CRUSH OR CHEW", "Do not freeze.",
+    "Avoid grapefruit juice", "May cause drowsiness. Avoid alcohol.", "Do not stop taking suddenly.",
+    "Do not drive until you know how this affects you.", "Not for use in children under 12.",
+    "Avoid prolonged sun exposure.", "Do not take with other products containing {generic}.",
+    "Risk of bleeding; tell your doctor before surgery", "Caution: federal law prohibits transfer of this drug.",
+    "Do not use if pregnant or breastfeeding.", "Avoid potassium supplements unless directed",
+]
+ALLERGENS = ["penicillin", "sulfa drugs", "aspirin", "this medicine", "NSAIDs"]
+SIDE_EFFECTS = [
+    "nausea", "diarrhea", "dizziness", "headache", "rash", "vomiting", "constipation", "dry mouth",
+    "cough", "muscle pain", "itching", "swelling", "stomach upset", "trouble sleeping", "fatigue",
+]
+SIDE_TEMPLATES = [
+    "May cause {a} or {b}.", "Side effects: {a}, {b}", "Common side effects include {a}, {b} and {c}",
+    "Report {a} or {b} to your doctor", "Side effect: {a}", "May cause {a}.", "Call your doctor if {a} occurs",
+]
+OTHER_LINES = [
+    "Qty: {qty}  Refills: {refills}", "Rx# {rx}  Dr. {initial}. {surname}", "Rx# {rx}",
+    "Patient: {first} {surname}", "Filled: {date}", "Discard after: {date}", "{pharmacy} PHARMACY",
+    "{pharmacy} Pharmacy  {phone}", "Refills: {refills}", "Dr. {initial}. {surname}", "NDC {ndc}",
+    "Mfr: {mfr}", "Qty {qty}", "Pain reliever / fever reducer", "Directions", "Warnings", "Use by {date}",
+]
+PHARMACIES = ["CVS", "WALGREENS", "RITE AID", "KROGER", "COSTCO", "WALMART", "MAIN STREET", "HEB"]
+SURNAMES = ["Smith", "Patel", "Garcia", "Nguyen", "Johnson", "Lee", "Brown", "Khan", "Rossi", "Okafor"]
+FIRST = ["JOHN", "MARIA", "WEI", "AISHA", "ROBERT", "ANA", "SAM", "PRIYA"]
+MFRS = ["Teva", "Mylan", "Sandoz", "Aurobindo", "Lupin", "Apotex", "Zydus", "Cipla"]
+
+# Swaps the OCR engine makes on blurry or glossy labels
+OCR_SWAPS = [("l", "1"), ("O", "0"), ("o", "0"), ("S", "5"), ("I", "1"), ("i", "1"), ("B", "8"),
+             ("rn", "m"), ("m", "rn"), ("e", "c"), ("a", "4"), ("g", "9")]
+
+# The real OCR captures from bench/corpus/ocr_samples.txt, annotated by hand
+REAL = """\
+NAME [name AMOXICILLIN] [dose 500 MG] CAPSULES
+INSTR Take 1 capsule by mouth [freq three times daily]
+INSTR until all medication is taken.
+OTHER Qty: 30  Refills: 0
+WARN WARNING: Do not take if allergic to penicillin.
+SIDE May cause nausea or diarrhea.
+OTHER Rx# 1234567  Dr. A. Smith
+---
+NAME [name LISINOPRIL] [dose 10mg] TABLET
+INSTR TAKE ONE TABLET BY MOUTH [freq ONCE DAILY]
+WARN Caution: may cause dizziness when standing up
+WARN Avoid potassium supplements unless directed
+SIDE Side effects: headache, cough
+---
+NAME [name Ibuprofen] Tablets USP, [dose 200 mg]
+OTHER Pain reliever / fever reducer
+OTHER Directions
+INSTR - adults: take 1 tablet [freq every 4 to 6 hours] while symptoms persist
+WARN - do not take more than 6 tablets in 24 hours
+OTHER Warnings
+WARN Allergy alert: ibuprofen may cause a severe allergic reaction
+WARN Stomach bleeding warning: risk is higher if you are age 60 or older
+WARN Keep out of reach of children.
+---
+NAME [name METFORMIN HCL ER] [dose 750MG]
+INSTR TAKE 2 TABLETS BY MOUTH WITH EVENING MEAL
+WARN DO NOT CRUSH OR CHEW
+SIDE Common side effects include nausea, vomiting and diarrhea
+---
+NAME [name Insulin Glargine] [dose 100 units/mL]
+INSTR Inject 20 units subcutaneously [freq at bedtime]
+WARN Do not freeze. Discard 28 days after opening.
+WARN Risk of hypoglycemia; watch for dizziness or sweating
+---
+NAME [name CETIRIZINE HCL] [dose 10 MG]
+INSTR Take 1 tablet [freq daily] as needed for allergies
+WARN May cause drowsiness. Avoid alcohol.
+---
+NAME [name Amoxici11in] [dose 25O mg/5mL] susp
+INSTR Sh4ke well before use
+INSTR Give 5 mL by mouth [freq every 8 hrs] for 10 days
+INSTR Refrigerate. Discard after 14 days
+---
+NAME [name ATORVASTATIN] [dose 20 MG] TAB
+INSTR TAKE 1 TABLET BY MOUTH [freq AT BEDTIME]
+WARN Avoid grapefruit juice
+SIDE Report muscle pain or weakness
+---
+NAME [name PREDNISONE] [dose 5MG] TABLETS
+INSTR 1. Take 4 tablets [freq daily] for 3 days
+INSTR 2. Then take 2 tablets daily for 3 days
+INSTR 3. Then take 1 tablet daily for 3 days
+WARN Take with food. Do not stop suddenly.
+---
+NAME [name Albuterol] HFA [dose 90 mcg/actuation]
+INSTR Inhale 2 puffs [freq every 4 hours] as needed for wheezing
+INSTR Shake well. Prime before first use.
+SIDE Side effect: nervousness, shakiness, headache
+---
+NAME [name SERTRALINE] [dose 50 MG]
+INSTR take one tablet by mouth [freq every morning]
+SIDE may cause drowsiness or dry mouth
+WARN contraindicated with MAO inhibitors
+---
+NAME [name Vitamin D3] [dose 2000 IU] softgels
+INSTR Take 1 softgel [freq weekly] with a meal
+"""
+
+
+def ocr_noise(text: str, rng: random.Random, rate: float) -> str:
+    if rate <= 0:
+        return text
+    out, i = [], 0
+    while i < len(text):
+        for src, dst in OCR_SWAPS:
+            if text.startswith(src, i) and rng.random() < rate:
+                out.append(dst)
+                i += len(src)
+                break
+        else:
+            out.append(text[i])
+            i += 1
+    return "".join(out)
+
+
+def render(segments, rng: random.Random, rate: float, upper: bool) -> str:
+    # segments: [(text, span type or None)] -> corpus markup
+    parts = []
+    for text, kind in segments:
+        text = text.upper() if upper else text
+        text = ocr_noise(text, rng, rate)
+        parts.append(f"[{kind} {text}]" if kind else text)
+    return "".join(parts)
+
+
+def fill(template: str, rng: random.Random, generic: str = "") -> str:
+    return template.format(
+        qty=rng.choice([14, 20, 28, 30, 60, 90, 100]), refills=rng.randint(0, 5), rx=rng.randint(1000000, 9999999),
+        initial=rng.choice("ABCDJKMRS"), surname=rng.choice(SURNAMES), first=rng.choice(FIRST),
+        date=f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/20{rng.randint(24, 27)}",
+        pharmacy=rng.choice(PHARMACIES), phone=f"555-{rng.randint(1000, 9999)}",
+        ndc=f"{rng.randint(10000, 99999)}-{rng.randint(100, 999)}-{rng.randint(10, 99)}",
+        mfr=rng.choice(MFRS), allergen=rng.choice(ALLERGENS), generic=generic,
+    )
+
+
+def dose_text(strength: str, rng: random.Random) -> str:
+    style = rng.random()
+    if style < 0.25:
+        return strength.replace(" ", "")
+    if style < 0.35:
+        return strength.replace(" ", "").upper()
+    if style < 0.45 and "/" in strength:
+        head, _, tail = strength.partition("/")
+        return head + "/" + tail.replace(" ", "")
+    return strength
+
+
+def name_line(brand: str, generic: str, strength: str, form: str, rng: random.Random):
+    dose = (dose_text(strength, rng), "dose")
+    form_word = rng.choice(FORM_WORDS[form])
+    name = generic
+    if generic in SALTS and rng.random() < 0.5:
+        name = f"{generic} {rng.choice(SALTS[generic])}"
+    pick = rng.random()
+    if pick < 0.35:
+        return [(name.upper(), "name"), (" ", None), dose, (" " + form_word.upper(), None)]
+    if pick < 0.5:
+        return [(name.title(), "name"), (" ", None), dose]
+    if pick < 0.65:
+        return [(brand, "name"), (" (", None), (generic, "generic"), (") ", None), dose, (" " + form_word, None)]
+    if pick < 0.75:
+        return [(brand, "name"), (" ", None), dose, (" " + form_word.title(), None)]
+    if pick < 0.85:
+        return [(generic.title(), "name"), (f" {form_word.title()} USP, ", None), dose]
+    if pick < 0.93:
+        return [(brand.upper(), "name"), (" ", None), dose, (" / ", None), (generic.upper(), "generic")]
+    return [(generic.title(), "name"), (" ", None), dose, (f" {form_word} (generic for ", None), (brand, "generic"), (")", None)]
+
+
+def instruction_line(form: str, rng: random.Random):
+    verb, unit, route = ACTIONS[form]
+    amount = rng.choice(AMOUNTS) if unit not in ("units",) else str(rng.choice([5, 10, 12, 20, 30]))
+    plural = unit if unit.endswith("s") or amount in ("1", "one", "1/2", "half a") else unit + "s"
+    freq = rng.choice(FREQUENCIES)
+    lead = rng.choice(["", "", "", "- ", "1. ", "* ", "- adults: "])
+    before = f"{lead}{verb if not lead.endswith(': ') else verb.lower()} {amount} {plural} {route} "
+    tail = rng.choice(TAILS)
+    if rng.random() < 0.2:
+        # Frequency ahead of the route ("Take 1 tablet daily by mouth")
+        before = f"{lead}{verb} {amount} {plural} "
+        tail = f" {route}{tail}"
+    return [(before, None), (freq, "freq"), (tail, None)]
+
+
+def make_label(rng: random.Random, drugs):
+    brand, generic, strengths, form = rng.choice(drugs)
+    strength = rng.choice(strengths)
+    upper = rng.random() < 0.3
+    rate = rng.choice([0.0, 0.0, 0.02, 0.05, 0.1])
+    lines = []
+    if rng.random() < 0.3:
+        for _ in range(rng.randint(1, 2)):
+            lines.append(("OTHER", [(fill(rng.choice(OTHER_LINES), rng), None)]))
+    lines.append(("NAME", name_line(brand, generic, strength, form, rng)))
+    body = [("INSTR", instruction_line(form, rng))]
+    for _ in range(rng.randint(0, 2)):
+        body.append(("INSTR", [(rng.choice(INSTRUCTION_EXTRAS), None)]))
+    for _ in range(rng.randint(0, 2)):
+        body.append(("WARN", [(fill(rng.choice(WARNINGS), rng, generic), None)]))
+    if rng.random() < 0.6:
+        a, b, c = rng.sample(SIDE_EFFECTS, 3)
+        body.append(("SIDE", [(rng.choice(SIDE_TEMPLATES).format(a=a, b=b, c=c), None)]))
+    for _ in range(rng.randint(0, 3)):
+        body.append(("OTHER", [(fill(rng.choice(OTHER_LINES), rng), None)]))
+    # Instructions come first; the rest of a label is in no particular order
+    rest = body[1:]
+    rng.shuffle(rest)
+    lines.extend([body[0]] + rest)
+    return [f"{role} {render(segments, rng, rate, upper)}" for role, segments in lines]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--labels", type=int, default=600)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", default=OUT)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    blocks = ["\n".join(make_label(rng, DRUGS)) for _ in range(args.labels)]
+    with open(args.out, "w", encoding="utf-8") as f:
+        f.write("# Labelled medication labels for services/extractor.py; generated by bench/make_label_corpus.py.\n")
+        f.write("# One label per block, blocks separated by ---. Each line is \"<ROLE> <text>\", ROLE one of\n")
+        f.write("# NAME INSTR WARN SIDE OTHER; spans are marked [name ...] [generic ...] [dose ...] [freq ...].\n")
+        f.write("# The first block group is the hand-annotated real OCR samples.\n")
+        f.write(REAL)
+        for block in blocks:
+            f.write("---\n" + block + "\n")
+    print(f"wrote {len(blocks)} synthetic + {REAL.count('---') + 1} real labels to {os.path.normpath(args.out)}")
+
+
+if __name__ == "__main__":
+    main()
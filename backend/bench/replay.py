@@ -0,0 +1,399 @@
+"""
+Offline replay benchmark for the scan API.
+
+Starts a stub Gemini server (bench/stub_gemini.py) and the FastAPI app under uvicorn pointed
+at it, replays a corpus of label and food images at a fixed concurrency, and reports
+throughput and p50/p95/p99 latency per endpoint and per pipeline path. No network needed;
+OCR and preprocessing run for real, so results reflect this machine's CPU.
+
+    cd backend
+    python bench/replay.py --requests 400 --concurrency 16 --latency-ms 900
+    python bench/replay.py --mix meds=3,meds_stream=1,food=1 --json out.json
+    python bench/replay.py --baseline out.json --max-regression 0.15   # exit 1 on p95 regression
+
+The corpus directory holds meds/ and food/ subdirectories of images (default: bench/corpus,
+falling back to the images in example/). Pass --url to replay against a server that is
+already running instead (its Gemini endpoint is then up to you).
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import stub_gemini  # noqa: E402
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "corpus")
+
+# endpoint name -> (HTTP path, corpus kind, images per request, streamed)
+ENDPOINTS = {
+    "meds": ("/analyze-meds", "meds", 1, False),
+    "food": ("/analyze-food", "food", 1, False),
+    "meds_stream": ("/analyze-meds/stream", "meds", 1, True),
+    "food_stream": ("/analyze-food/stream", "food", 1, True),
+    "meds_batch": ("/analyze-meds/batch", "meds", 4, False),
+    "food_batch": ("/analyze-food/batch", "food", 4, False),
+}
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def load_corpus(path: str) -> Dict[str, List[Tuple[str, bytes]]]:
+    corpus: Dict[str, List[Tuple[str, bytes]]] = {"meds": [], "food": []}
+    for kind in corpus:
+        for name in sorted(glob.glob(os.path.join(path, kind, "*"))):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(name, "rb") as f:
+                    corpus[kind].append((os.path.basename(name), f.read()))
+    if not corpus["meds"] or not corpus["food"]:
+        # Fall back to the sample images shipped with the repo
+        examples = os.path.join(BACKEND_DIR, "example")
+        defaults = {"meds": ["20150126_Prescription-Label.jpg"], "food": ["banana.jpeg"]}
+        for kind, names in defaults.items():
+            if not corpus[kind]:
+                for name in names:
+                    with open(os.path.join(examples, name), "rb") as f:
+                        corpus[kind].append((name, f.read()))
+    return corpus
+
+
+def vary(data: bytes, salt: int) -> bytes:
+    """
+    Make an image byte-distinct without changing its pixels (trailing bytes after the end
+    marker are ignored by JPEG/PNG decoders), so replays aren't collapsed by caches or dedupe.
+    """
+    return data + b"\0" * 8 + salt.to_bytes(8, "big")
+
+
+def multipart(field: str, files: List[Tuple[str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, data in files:
+        mime = "image/png" if name.lower().endswith(".png") else "image/jpeg"
+        parts.append(
+            (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+                f"Content-Type: {mime}\r\n\r\n"
+            ).encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+async def http_request(host: str, port: int, method: str, path: str, body: bytes = b"", headers: Optional[dict] = None):
+    """
+    Minimal HTTP/1.1 client (one connection per request). Returns (status, headers, body,
+    seconds to first body byte). Handles Content-Length, chunked and read-to-EOF bodies.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}:{port}", "Connection: close", f"Content-Length: {len(body)}"]
+        for k, v in (headers or {}).items():
+            lines.append(f"{k}: {v}")
+        started = time.perf_counter()
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        first_byte = time.perf_counter() - started
+        status = int(status_line.split()[1]) if status_line else 0
+        resp_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            resp_headers[k.strip().lower()] = v.strip()
+
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b"".join(chunks)
+        elif "content-length" in resp_headers:
+            data = await reader.readexactly(int(resp_headers["content-length"]))
+        else:
+            data = await reader.read()
+        return status, resp_headers, data, first_byte
+    finally:
+        writer.close()
+
+
+def served_path(endpoint: str, status: int, headers: dict, data: bytes) -> str:
+    if status != 200:
+        return f"http_{status}"
+    if headers.get("x-scan-path"):
+        return headers["x-scan-path"]
+    streamed = ENDPOINTS[endpoint][3]
+    try:
+        if streamed:
+            path = "unknown"
+            for block in data.decode("utf-8").split("\n\n"):
+                event = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+                if event.get("event") == "result":
+                    path = json.loads(event["data"]).get("path", "multimodal")
+                elif event.get("event") == "done" and json.loads(event["data"]).get("cached"):
+                    path = "cache"
+            return path
+        payload = json.loads(data)
+        if "results" in payload:
+            return "batch"
+        return payload.get("path", "multimodal")
+    except Exception:
+        return "unparsed"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples: List[dict], wall: float) -> dict:
+    def block(rows):
+        latencies = [r["seconds"] for r in rows]
+        ok = [r for r in rows if r["status"] == 200]
+        return {
+            "requests": len(rows),
+            "errors": len(rows) - len(ok),
+            "rps": round(len(rows) / wall, 2) if wall else 0.0,
+            "p50_ms": round(1000 * percentile(latencies, 0.50), 1),
+            "p95_ms": round(1000 * percentile(latencies, 0.95), 1),
+            "p99_ms": round(1000 * percentile(latencies, 0.99), 1),
+            "ttfb_p50_ms": round(1000 * percentile([r["ttfb"] for r in rows], 0.50), 1),
+        }
+
+    by_endpoint: Dict[str, list] = {}
+    by_path: Dict[str, list] = {}
+    for row in samples:
+        by_endpoint.setdefault(row["endpoint"], []).append(row)
+        by_path.setdefault(f"{row['endpoint']}/{row['path']}", []).append(row)
+    return {
+        "wall_s": round(wall, 2),
+        "total": block(samples),
+        "endpoints": {k: block(v) for k, v in sorted(by_endpoint.items())},
+        "paths": {k: block(v) for k, v in sorted(by_path.items())},
+    }
+
+
+def print_report(report: dict):
+    header = f"  {'':<32} {'reqs':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+
+    def row(name, b):
+        print(f"  {name:<32} {b['requests']:>6} {b['errors']:>5} {b['rps']:>8.2f} {b['p50_ms']:>9.1f} {b['p95_ms']:>9.1f} {b['p99_ms']:>9.1f}")
+
+    print(f"\nwall time {report['wall_s']}s")
+    print(header)
+    row("total", report["total"])
+    print("\nper endpoint:")
+    for name, b in report["endpoints"].items():
+        row(name, b)
+    print("\nper pipeline path:")
+    for name, b in report["paths"].items():
+        row(name, b)
+    if report.get("stub_calls"):
+        print("\nstub Gemini calls:", ", ".join(f"{k}={v}" for k, v in sorted(report["stub_calls"].items())))
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+async def replay(url: str, corpus, mix, total: int, concurrency: int, seed: int, distinct: bool) -> dict:
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    rng = random.Random(seed)
+    names, weights = zip(*mix)
+    plan = [rng.choices(names, weights)[0] for _ in range(total)]
+    samples: List[dict] = []
+    queue: asyncio.Queue = asyncio.Queue()
+    for i, endpoint in enumerate(plan):
+        queue.put_nowait((i, endpoint))
+
+    async def worker():
+        while True:
+            try:
+                i, endpoint = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            path, kind, count, _ = ENDPOINTS[endpoint]
+            files = []
+            for j in range(count):
+                name, data = corpus[kind][(i + j) % len(corpus[kind])]
+                files.append((name, vary(data, i * 16 + j) if distinct else data))
+            body, content_type = multipart("files" if count > 1 else "file", files)
+            started = time.perf_counter()
+            try:
+                status, headers, data, ttfb = await http_request(host, port, "POST", path, body, {"Content-Type": content_type})
+            except Exception:
+                status, headers, data, ttfb = 0, {}, b"", 0.0
+            seconds = time.perf_counter() - started
+            samples.append({
+                "endpoint": endpoint,
+                "status": status,
+                "path": served_path(endpoint, status, headers, data) if status else "connection_error",
+                "seconds": seconds,
+                "ttfb": ttfb,
+            })
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(samples, time.perf_counter() - started)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(stub_port: int, port: int, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "API_KEY": "stub",
+        "GEMINI_TRANSPORT": "rest",
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{stub_port}",
+        # Replays would otherwise be answered from the result cache
+        "RESULT_CACHE_SIZE": "0",
+    })
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+async def wait_ready(url: str, proc: Optional[subprocess.Popen], timeout: float = 60.0):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"app exited with status {proc.returncode} during start-up")
+        try:
+            status, _, _, _ = await http_request(parts.hostname, parts.port or 80, "GET", "/pools/stats")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.25)
+    raise SystemExit("app did not become ready in time")
+
+
+def check_regression(report: dict, baseline_path: str, max_regression: float) -> List[str]:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    failures = []
+    for name, current in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before or not before.get("p95_ms"):
+            continue
+        change = (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+        if change > max_regression:
+            failures.append(f"{name}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms (+{100 * change:.0f}%)")
+        before_rps, current_rps = before.get("rps") or 0, current["rps"]
+        if before_rps and (before_rps - current_rps) / before_rps > max_regression:
+            failures.append(f"{name}: throughput {before_rps} -> {current_rps} rps")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", default=DEFAULT_CORPUS)
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--warmup", type=int, default=8, help="requests sent (and discarded) before measuring")
+    ap.add_argument("--mix", default="meds=4,food=2,meds_stream=1,food_stream=1,meds_batch=1")
+    ap.add_argument("--same-bytes", action="store_true", help="replay identical bytes (lets caches and dedupe kick in)")
+    ap.add_argument("--url", help="replay against an already running app instead of starting one")
+    ap.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra env for the started app")
+    ap.add_argument("--json", help="write the report here")
+    ap.add_argument("--baseline", help="report from an earlier run to compare against")
+    ap.add_argument("--max-regression", type=float, default=0.15, help="allowed p95/throughput regression vs --baseline")
+    stub_gemini.add_arguments(ap)
+    args = ap.parse_args()
+    seed = args.seed if args.seed is not None else 1234
+
+    corpus = load_corpus(args.corpus)
+    mix = parse_mix(args.mix)
+    stub_config = stub_gemini.config_from_args(args)
+    stub = proc = None
+    if args.url:
+        url = args.url.rstrip("/")
+    else:
+        stub = stub_gemini.serve(stub_config)
+        port = free_port()
+        extra_env = dict(item.split("=", 1) for item in args.env)
+        proc = start_app(stub.server_address[1], port, extra_env)
+        url = f"http://127.0.0.1:{port}"
+
+    try:
+        asyncio.run(wait_ready(url, proc))
+        print(f"replaying {args.requests} requests at concurrency {args.concurrency} against {url}")
+        print(f"corpus: {len(corpus['meds'])} meds / {len(corpus['food'])} food images; mix {args.mix}")
+        if args.warmup:
+            asyncio.run(replay(url, corpus, mix, args.warmup, min(args.concurrency, args.warmup), seed + 1, not args.same_bytes))
+        stub_config.calls.clear()
+        report = asyncio.run(replay(url, corpus, mix, args.requests, args.concurrency, seed, not args.same_bytes))
+        report["config"] = {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "latency_ms": args.latency_ms,
+            "latency_sigma": args.latency_sigma,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+        }
+        report["stub_calls"] = dict(stub_config.calls) if stub is not None else None
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if stub is not None:
+            stub.shutdown()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        failures = check_regression(report, args.baseline, args.max_regression)
+        if failures:
+            print("\nregressions vs baseline:")
+            for line in failures:
+                print("  " + line)
+            sys.exit(1)
+        print(f"\nno regression beyond {100 * args.max_regression:.0f}% vs {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
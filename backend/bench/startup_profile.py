@@ -0,0 +1,82 @@
+"""
+Cold-start profile for the API.
+
+1. Import time: runs `python -X importtime -c "import main"` and lists the slowest top-level
+   imports. Importing the app should not pull in the Gemini SDK, OpenCV or PIL; those load
+   in the lifespan warm-up (services/startup.py).
+2. Time to ready (--serve): starts uvicorn with STARTUP_WARM=1 and =0, measures how long
+   until /pools/stats answers, and prints the worker's own startup steps from it.
+
+    cd backend
+    python bench/startup_profile.py [--top 15] [--serve]
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from replay import BACKEND_DIR, free_port, http_request, start_app, wait_ready  # noqa: E402
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_profile(top: int):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.splitlines()[-1] if proc.stderr else "import failed")
+        return
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m and len(m.group(3)) == 1:
+            # One space of indent: imported directly by main or by a top-level package
+            rows.append((int(m.group(2)), m.group(4)))
+    total = sum(us for us, _ in rows)
+    print(f"import main: {total / 1000:.0f} ms across {len(rows)} top-level imports")
+    for us, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    for heavy in ("google.generativeai", "cv2", "PIL.Image"):
+        if re.search(rf"\| +{re.escape(heavy)}$", proc.stderr, re.M):
+            print(f"  note: {heavy} is imported with the app")
+
+
+async def time_to_ready(warm: str):
+    port = free_port()
+    started = time.perf_counter()
+    # The stub port is never opened: startup must not depend on reaching Gemini
+    proc = start_app(free_port(), port, {"STARTUP_WARM": warm})
+    try:
+        await wait_ready(f"http://127.0.0.1:{port}", proc)
+        ready = time.perf_counter() - started
+        _, _, _, body = await http_request("127.0.0.1", port, "GET", "/pools/stats")
+        profile = json.loads(body).get("startup", {})
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    print(f"STARTUP_WARM={warm}: ready after {1000 * ready:.0f} ms (worker reports {profile.get('ready_ms')} ms)")
+    for step in profile.get("steps", []):
+        print(f"  {step['ms']:8.1f} ms  {step['step']}" + (f"  ({step['error']})" if step.get("error") else ""))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    ap.add_argument("--serve", action="store_true", help="also start the app and time readiness")
+    args = ap.parse_args()
+    import_profile(args.top)
+    if args.serve:
+        for warm in ("1", "0"):
+            asyncio.run(time_to_ready(warm))
+
+
+if __name__ == "__main__":
+    main()
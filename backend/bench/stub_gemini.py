@@ -0,0 +1,261 @@
+"""
+Local stand-in for the Gemini REST API, for benchmarks that must run without network access.
+
+Speaks just enough of the v1beta REST surface for google-generativeai with transport="rest":
+  GET  /v1beta/models                              model list (NotFound fallback path)
+  POST /v1beta/models/{model}:generateContent      one JSON response
+  POST /v1beta/models/{model}:streamGenerateContent  JSON array (alt=json) or SSE (alt=sse)
+
+Replies are canned but shaped like the real thing: a meds JSON object (or an array of them
+for multi-image prompts), or the food items JSON. Latency is lognormal around `--latency-ms`, and a
+configurable share of calls fail with 500 / 429 / 404 so retry and fallback paths get exercised.
+
+    cd backend
+    python bench/stub_gemini.py --port 8765 --latency-ms 900 --error-rate 0.02
+    GEMINI_TRANSPORT=rest GEMINI_API_ENDPOINT=http://127.0.0.1:8765 API_KEY=stub uvicorn main:app
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+MEDS_REPLY = {
+    "medicationName": "Amoxicillin",
+    "genericName": "amoxicillin trihydrate",
+    "dosage": "500 mg",
+    "frequency": "every 8 hours",
+    "instructions": ["Take one capsule by mouth every 8 hours", "Finish all medication"],
+    "warnings": ["Do not take if allergic to penicillin"],
+    "sideEffects": ["nausea", "rash"],
+    "plainLanguage": "An antibiotic. Take one capsule three times a day until it is gone.",
+}
+
+FOOD_REPLY = {"items": [{"name": "banana", "portion": "1 medium", "grams": 118}]}
+
+MODELS = ["models/gemini-1.5-flash", "models/gemini-1.5-pro", "models/gemini-pro", "models/text-bison-001"]
+
+_BATCH_RX = re.compile(r"You are given (\d+) images")
+
+
+class StubConfig:
+    def __init__(
+        self,
+        latency_ms: float = 800.0,
+        sigma: float = 0.35,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        not_found_rate: float = 0.0,
+        stream_chunks: int = 6,
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.not_found_rate = not_found_rate
+        self.stream_chunks = max(1, stream_chunks)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def delay(self) -> float:
+        # Lognormal: median `latency_ms`, long right tail like a real model API
+        with self.lock:
+            z = self.random.gauss(0.0, 1.0)
+        return self.latency_ms * math.exp(self.sigma * z) / 1000.0
+
+    def failure(self) -> Optional[int]:
+        with self.lock:
+            r = self.random.random()
+        for status, rate in ((500, self.error_rate), (429, self.rate_limit_rate), (404, self.not_found_rate)):
+            if r < rate:
+                return status
+            r -= rate
+        return None
+
+    def count(self, key: str):
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+
+def _prompt_text(body: dict) -> str:
+    texts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+    return "\n".join(texts)
+
+
+def _image_count(body: dict) -> int:
+    return sum(
+        1 for content in body.get("contents", []) for part in content.get("parts", [])
+        if "inlineData" in part or "inline_data" in part
+    )
+
+
+def reply_text(body: dict) -> str:
+    prompt = _prompt_text(body)
+    batch = _BATCH_RX.search(prompt)
+    if batch:
+        n = int(batch.group(1))
+        if "medication" in prompt:
+            return json.dumps([MEDS_REPLY] * n)
+        return json.dumps([FOOD_REPLY] * n)
+    if "medication" in prompt:
+        return "```json\n" + json.dumps(MEDS_REPLY, indent=2) + "\n```"
+    return json.dumps(FOOD_REPLY)
+
+
+def _candidate(text: str, finish: bool = True) -> dict:
+    out = {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "index": 0,
+        }],
+        "usageMetadata": {"promptTokenCount": 258, "candidatesTokenCount": max(1, len(text) // 4)},
+    }
+    if finish:
+        out["candidates"][0]["finishReason"] = "STOP"
+    return out
+
+
+def _split(text: str, n: int):
+    size = max(1, math.ceil(len(text) / n))
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config: StubConfig = StubConfig()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int):
+        reasons = {500: "INTERNAL", 429: "RESOURCE_EXHAUSTED", 404: "NOT_FOUND"}
+        self._send_json(status, {"error": {"code": status, "message": "stubbed failure", "status": reasons[status]}})
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path.rstrip("/").endswith("/models"):
+            self.config.count("list_models")
+            self._send_json(200, {"models": [{"name": name, "supportedGenerationMethods": ["generateContent"]} for name in MODELS]})
+            return
+        self._send_json(404, {"error": {"code": 404, "message": "unknown path", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = {}
+
+        if path.endswith(":generateContent"):
+            method = "generate"
+        elif path.endswith(":streamGenerateContent"):
+            method = "stream"
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "unknown path", "status": "NOT_FOUND"}})
+            return
+        kind = "text" if not _image_count(body) else ("batch" if _image_count(body) > 1 else "image")
+        self.config.count(f"{method}_{kind}")
+
+        time.sleep(self.config.delay())
+        status = self.config.failure()
+        if status is not None:
+            self.config.count(f"error_{status}")
+            self._error(status)
+            return
+
+        text = reply_text(body)
+        if method == "generate":
+            self._send_json(200, _candidate(text))
+            return
+
+        pieces = _split(text, self.config.stream_chunks)
+        sse = "alt=sse" in query
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        gap = self.config.delay() / (4 * len(pieces))
+        for i, piece in enumerate(pieces):
+            payload = json.dumps(_candidate(piece, finish=i == len(pieces) - 1))
+            if sse:
+                chunk = f"data: {payload}\r\n\r\n"
+            else:
+                chunk = ("[" if i == 0 else ",") + payload + ("]" if i == len(pieces) - 1 else "")
+            self._chunk(chunk.encode("utf-8"))
+            time.sleep(gap)
+        self._chunk(b"")
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def serve(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Start the stub in a background thread. Returns the server; its port is server.server_address[1].
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-gemini", daemon=True).start()
+    return server
+
+
+def add_arguments(ap: argparse.ArgumentParser):
+    ap.add_argument("--latency-ms", type=float, default=800.0, help="median stub latency per call")
+    ap.add_argument("--latency-sigma", type=float, default=0.35, help="lognormal spread (0 = constant latency)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of calls failing with 500")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of calls failing with 429")
+    ap.add_argument("--not-found-rate", type=float, default=0.0, help="share of calls failing with 404")
+    ap.add_argument("--stream-chunks", type=int, default=6, help="chunks per streamed reply")
+    ap.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(
+        latency_ms=args.latency_ms,
+        sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        not_found_rate=args.not_found_rate,
+        stream_chunks=args.stream_chunks,
+        seed=args.seed,
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    add_arguments(ap)
+    args = ap.parse_args()
+    server = serve(config_from_args(args), args.host, args.port)
+    print(f"stub Gemini listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Standalone camera owner for kiosks: keeps the device open and the shared frame ring filled,
+so API workers started with CAMERA_MODE=attach serve capture=true scans from it without
+touching the device (only one process can hold a camera).
+
+    cd backend
+    python capture.py --device 0
+    CAMERA_MODE=attach uvicorn main:app --workers 4
+"""
+import argparse
+import os
+import signal
+import threading
+import time
+
+from services.camera import CameraService
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--device", default=None, help='OpenCV device index or URL, or "synthetic" (default CAMERA_DEVICE or 0)')
+    ap.add_argument("--report-interval", type=float, default=30.0, help="seconds between status lines (0 for none)")
+    args = ap.parse_args()
+    if args.device is not None:
+        os.environ["CAMERA_DEVICE"] = args.device
+
+    service = CameraService.from_env()
+    service.mode = "own"
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    service.start()
+    print(f"capturing from {os.getenv('CAMERA_DEVICE', '0')} into shared memory segment {service.name!r}")
+    next_report = time.monotonic() + args.report_interval
+    while not stop.wait(1.0):
+        # Reopens the device once its retry backoff has passed if it failed (no-op otherwise)
+        service.start()
+        if args.report_interval and time.monotonic() >= next_report:
+            next_report += args.report_interval
+            stats = service.stats()
+            print(f"frames={stats['frames_written']} read_errors={stats['read_errors']} shape={stats['shape']} error={stats['error']}")
+    service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,95 @@
-from fastapi import FastAPI, UploadFile, File
+import time
+
+# Import time of the app and its dependencies; the first entry in the startup profile
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import vcv2
-import tempfile
+import asyncio
+import orjson
 import os
-from services.gemini import analyze_food, analyze_meds
+from services.gemini import (
+    analyze_food,
+    analyze_food_batch,
+    analyze_meds,
+    analyze_meds_batch,
+    stream_food,
+    stream_meds,
+)
+from services.cache import ResultCache, is_cacheable
+from services.coalesce import SingleFlight
+from services.images import ScanImage
+from services.executor import pool_stats, shutdown_pools
+from services.ocr import get_engine
+from services.extractor import get_extractor
+from services.pipeline import get_pipeline_engine
+from services import camera, clients, drug_names, metrics, preprocess, resilience, routing, startup
+from services.jobs import KINDS as JOB_KINDS, CallbackRejected, JobQueueFull, JobRunner, JobStore, check_callback_url, default_handlers, post_callback
+from services.schemas import ScanResult
+from services.scheduler import ClientGone, DeadlineExceeded, Overloaded, Scheduler, run_with_deadline
+
+startup.profile.record("import app", time.perf_counter() - _import_started)
+
+# Results keyed by image content, so repeat scans of the same label skip Gemini entirely.
+# Opened in the lifespan (it may touch a SQLite file), not at import.
+result_cache: Optional[ResultCache] = None
+
+# Admission control: bounded queue, deadlines, priorities, OCR-only answers under overload
+scheduler = Scheduler.from_env()
+
+# Identical scans in flight at the same time (double taps, retries) run the pipeline once
+inflight = SingleFlight.from_env()
+
+# Background job mode (POST /jobs/...): created on first use, or at startup when JOBS_DB is set
+job_store: Optional[JobStore] = None
+job_runner: Optional[JobRunner] = None
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+
+# Upper bound on images per batch request
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "20"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup: open the result cache, then import and initialise everything heavy
+    (services/startup.py) so the first scan after a deploy doesn't pay for it, then the
+    camera and any queued jobs. Shutdown: stop workers and pools.
+    """
+    global result_cache
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    result_cache = ResultCache.from_env()
+    startup.profile.record("result_cache", time.perf_counter() - started)
+
+    await startup.warm_up()
+    # Open the Gemini connection in the background; don't hold up startup on the network
+    loop.run_in_executor(None, clients.warm)
+    if os.getenv("CAMERA_ENABLED") == "1":
+        # Kiosks: open the device now so the first capture=true scan doesn't wait for exposure
+        await loop.run_in_executor(None, startup.profile.run, [("camera", camera.get_camera().start)])
+    if os.getenv("JOBS_DB"):
+        # With an explicit queue file there may be jobs left from before a restart
+        _jobs()
+    startup.profile.ready()
+
+    yield
+
+    if job_runner is not None:
+        await job_runner.stop()
+    if camera.camera_started():
+        camera.get_camera().stop()
+    get_engine().shutdown()
+    shutdown_pools()
+
 
-app = FastAPI()
+# Responses are serialized with orjson; endpoints hand back plain dicts shaped by ScanResult
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # CORS so Next.js (localhost:3000) can talk to FastAPI (localhost:8000)
 app.add_middleware(
@@ -17,84 +100,564 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-class AnalyzeResponse(BaseModel):
-    text: dict
-    raw_output: dict
+def _jobs() -> JobStore:
+    """
+    Open the job queue, and start this process's job workers (JOBS_WORKERS, default 2; set 0
+    when separate `python worker.py` processes do the processing).
+    """
+    global job_store, job_runner
+    if job_store is None:
+        job_store = JobStore.from_env()
+    if job_runner is None and JOBS_WORKERS > 0:
+        job_runner = JobRunner(job_store, default_handlers(result_cache), concurrency=JOBS_WORKERS)
+        job_runner.start()
+    return job_store
+
+
+# Response schemas, for the OpenAPI docs (bodies are built by ScanResult and not re-validated)
+class MedicationFields(BaseModel):
+    medicationName: str = ""
+    genericName: str = ""
+    dosage: str = ""
+    frequency: str = ""
+    instructions: List[str] = []
+    warnings: List[str] = []
+    sideEffects: List[str] = []
+    plainLanguage: str = ""
+
+
+class FoodItem(BaseModel):
+    name: str
+    food: Optional[str] = None
+    match: Optional[float] = None
+    portion: str = ""
+    grams: Optional[float] = None
+    grams_from: Optional[str] = None
+    nutrients: Optional[Dict[str, float]] = None
+
+
+class FoodFields(BaseModel):
+    items: List[FoodItem]
+    totals: Dict[str, float]
+    plain: str = ""
 
 
-@app.post("/analyze-food", response_model=AnalyzeResponse)
-async def analyze_food_endpoint(file: UploadFile = File(None), capture: bool = False):
+class ScanResponse(BaseModel):
+    text: Union[MedicationFields, FoodFields, Dict[str, str]]
+    path: str
+    degraded: bool = False
+    cached: bool = False
+    raw_output: Optional[dict] = None
+    diagnostics: Optional[dict] = None
+
+
+class BatchResponse(BaseModel):
+    results: List[Union[ScanResponse, MedicationFields, dict]]
+
+
+def _shape(result, kind: str, diagnostics: bool = False, cached: bool = False, format: str = "full"):
     """
-    Either take an uploaded image file from Next.js,
-    OR capture a photo directly with OpenCV if `capture=true`.
+    Turn an analyzer result into the response body: the compact ScanResult by default, with
+    raw output and stage timings only when `diagnostics=true`; or just the fields for json_only.
     """
+    if format == "json_only":
+        return _apply_format(result, format, diagnostics)
+    return ScanResult.from_analyzer(result, kind, verbose=diagnostics, cached=cached).to_dict()
 
-    if capture:
-        # Capture a frame using OpenCV
-        cap = cv2.VideoCapture(0)
-        ret, frame = cap.read()
-        cap.release()
-        if not ret:
-            return {"text": "Camera error", "raw_output": {}}
-        
-        # Save temp file
-        tmp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg").name
-        cv2.imwrite(tmp_path, frame)
-        image_path = tmp_path
-    else:
-        # Save uploaded file
-        contents = await file.read()
-        tmp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg").name
-        with open(tmp_path, "wb") as f:
-            f.write(contents)
-        image_path = tmp_path
 
-    # Call Gemini analysis service
-    result = await analyze_food(image_path)
+def _camera_error() -> ORJSONResponse:
+    # Sent as-is so response_model can't coerce it into an empty MedicationFields with a 200
+    return ORJSONResponse({"text": {"error": "Camera error"}, "path": "error"}, status_code=503)
 
-    # cleanup
-    os.remove(image_path)
 
-    return result
+def _deadline_ms(request: Request, deadline_ms: Optional[int]) -> Optional[int]:
+    if deadline_ms is None and request.headers.get("x-request-deadline-ms", "").isdigit():
+        deadline_ms = int(request.headers["x-request-deadline-ms"])
+    return deadline_ms
 
 
-@app.post("/analyze-meds")
-async def analyze_meds_endpoint(file: UploadFile = File(None), capture: bool = False, format: str = "full"):
+async def _admit(request: Request, priority: str, deadline_ms: Optional[int]):
     """
-    Analyze a medication label image. If `format=json_only` is provided, return only the
-    parsed medication object when available; otherwise return the full analyzer result.
+    Take a scheduler slot or fail fast: 503 + Retry-After when the queue is saturated, 504 when
+    the deadline passes while queued, 499 when the client has already gone away.
+    The deadline comes from `deadline_ms` or the X-Request-Deadline-Ms header.
     """
+    deadline_ms = _deadline_ms(request, deadline_ms)
+    try:
+        return await scheduler.acquire(
+            priority=priority,
+            deadline=deadline_ms / 1000 if deadline_ms else None,
+            is_disconnected=request.is_disconnected,
+        )
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientGone as e:
+        raise HTTPException(status_code=499, detail=str(e))
+
+
+async def _run_admitted(request: Request, ticket, coro):
+    # Run the scan under the ticket's deadline and release the slot however it ends
+    try:
+        return await run_with_deadline(coro, ticket, request.is_disconnected)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientGone as e:
+        raise HTTPException(status_code=499, detail=str(e))
+    finally:
+        scheduler.release(ticket)
+
+
+async def _capture_frame():
+    # Sharpest recent frame from the long-running capture service; the device stays open between scans
+    picked = await asyncio.get_running_loop().run_in_executor(None, camera.get_camera().grab)
+    if picked is None:
+        return None
+    return ScanImage.from_frame(picked[0])
 
+
+async def _read_scan(file: UploadFile, capture: bool):
+    """
+    Either take an uploaded image file from Next.js,
+    OR capture a photo directly with OpenCV if `capture=true`.
+    Nothing is written to disk; the bytes are handed straight to the analyzer.
+    """
     if capture:
-        # Capture a frame using OpenCV
-        cap = cv2.VideoCapture(0)
-        ret, frame = cap.read()
-        cap.release()
-        if not ret:
-            return {"error": "Camera error"}
-        tmp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg").name
-        cv2.imwrite(tmp_path, frame)
-        image_path = tmp_path
-    else:
-        contents = await file.read()
-        tmp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg").name
-        with open(tmp_path, "wb") as f:
-            f.write(contents)
-        image_path = tmp_path
+        return await _capture_frame()
+    contents = await file.read()
+    return ScanImage(contents, file.content_type if (file.content_type or "").startswith("image/") else None)
+
+
+async def _scan_once(request: Request, namespace: str, lookup, analyze, priority: str, deadline_ms: Optional[int]):
+    """
+    Run a cache miss through admission and `analyze(ticket)`, and cache the result.
+    If the same image is already being scanned (in this worker, or another one with
+    COALESCE_DIR), wait for that scan instead. Returns (result, served path).
+    """
+    cache_key, phash, _ = lookup
+    # The deadline counts from arrival, so time spent waiting on an identical scan uses it up
+    deadline_ms = _deadline_ms(request, deadline_ms)
+    deadline_at = time.monotonic() + (deadline_ms / 1000 if deadline_ms else scheduler.default_deadline)
 
-    result = await analyze_meds(image_path)
+    async def run():
+        remaining_ms = int(1000 * (deadline_at - time.monotonic()))
+        if remaining_ms <= 0:
+            raise HTTPException(status_code=504, detail="deadline passed while waiting for an identical scan")
+        ticket = await _admit(request, priority, remaining_ms)
+        result = await _run_admitted(request, ticket, analyze(ticket))
+        if is_cacheable(result):
+            await result_cache.store_async(cache_key, result, namespace, phash)
+        return result
 
-    # cleanup
+    # Keyed by content and endpoint only: `format` and `diagnostics` are applied per request afterwards
     try:
-        os.remove(image_path)
-    except Exception:
-        pass
+        result, shared = await inflight.run(cache_key, run, deadline_at, request.is_disconnected)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientGone as e:
+        raise HTTPException(status_code=499, detail=str(e))
+    return result, "coalesced" if shared else metrics.served_path(result)
 
+
+def _apply_format(result, format: str, diagnostics: bool = False):
     if format == "json_only":
-        # If analyzer returned a parsed object under `text`, return it; otherwise return an error with diagnostics
+        # If analyzer returned a parsed object under `text`, return it; otherwise return an error (with diagnostics if asked)
         parsed = result.get("text") if isinstance(result, dict) else None
         if parsed and isinstance(parsed, dict) and any(k in parsed for k in ("medicationName", "dosage", "instructions")):
             return parsed
-        return {"error": "no parsed medication data", "diagnostics": result}
+        if diagnostics:
+            return {"error": "no parsed medication data", "diagnostics": result}
+        return {"error": "no parsed medication data"}
 
     return result
+
+
+async def _cached_batch(request: Request, files: List[UploadFile], namespace: str, analyze_batch, priority: str, deadline_ms: Optional[int]):
+    """
+    Serve what we can from the result cache and send only the misses through `analyze_batch`
+    (which is called with `degraded=` when the scheduler is overloaded).
+    Returns (results in upload order, indices that were served from the cache).
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="no files uploaded")
+    if len(files) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"at most {BATCH_MAX_IMAGES} images per batch")
+
+    started = time.perf_counter()
+    scans = [await _read_scan(f, capture=False) for f in files]
+    lookups = await asyncio.gather(*(result_cache.lookup_async(scan, namespace) for scan in scans))
+    results = [cached for _, _, cached in lookups]
+    missing = [i for i, cached in enumerate(results) if cached is None]
+    hits = set(range(len(results))) - set(missing)
+    if missing:
+        ticket = await _admit(request, priority, deadline_ms)
+        fresh = await _run_admitted(request, ticket, analyze_batch([scans[i] for i in missing], degraded=ticket.degraded))
+        for i, result in zip(missing, fresh):
+            results[i] = result
+            cache_key, phash, _ = lookups[i]
+            if is_cacheable(result):
+                await result_cache.store_async(cache_key, result, namespace, phash)
+    metrics.record_request(
+        namespace + "_batch", time.perf_counter() - started, "batch", images=len(files), cache_hits=len(files) - len(missing)
+    )
+    return results, hits
+
+
+@app.post("/analyze-food", response_model=ScanResponse)
+async def analyze_food_endpoint(
+    request: Request,
+    file: UploadFile = File(None),
+    capture: bool = False,
+    priority: str = "interactive",
+    deadline_ms: Optional[int] = None,
+    diagnostics: bool = False,
+):
+    """
+    Either take an uploaded image file from Next.js,
+    OR capture a photo directly with OpenCV if `capture=true`.
+    `diagnostics=true` adds the raw model output to the response.
+    """
+
+    started = time.perf_counter()
+    scan = await _read_scan(file, capture)
+    if scan is None:
+        return _camera_error()
+
+    lookup = await result_cache.lookup_async(scan, "food")
+    if lookup[2] is not None:
+        metrics.record_request("food", time.perf_counter() - started, "cache")
+        return ORJSONResponse(_shape(lookup[2], "food", diagnostics, cached=True), headers={"X-Scan-Path": "cache"})
+
+    # Call Gemini analysis service (food has no OCR-only answer, so it is never degraded)
+    result, path = await _scan_once(request, "food", lookup, lambda ticket: analyze_food(scan), priority, deadline_ms)
+    metrics.record_request("food", time.perf_counter() - started, path)
+    return ORJSONResponse(_shape(result, "food", diagnostics), headers={"X-Scan-Path": path})
+
+
+@app.post("/analyze-meds", response_model=Union[ScanResponse, MedicationFields])
+async def analyze_meds_endpoint(
+    request: Request,
+    file: UploadFile = File(None),
+    capture: bool = False,
+    format: str = "full",
+    priority: str = "interactive",
+    deadline_ms: Optional[int] = None,
+    diagnostics: bool = False,
+):
+    """
+    Analyze a medication label image. Returns the medication fields under `text` and the
+    pipeline `path`; `diagnostics=true` adds raw model/OCR output and stage timings. If
+    `format=json_only` is provided, return only the parsed medication object when available.
+    `priority` ("interactive" or "batch") and `deadline_ms` feed admission control.
+    """
+
+    started = time.perf_counter()
+    scan = await _read_scan(file, capture)
+    if scan is None:
+        return _camera_error()
+
+    # The cached value is the full analyzer result; `format` is applied afterwards
+    lookup = await result_cache.lookup_async(scan, "meds")
+    result = lookup[2]
+    if result is None:
+        analyze = lambda ticket: analyze_meds(scan, degraded=ticket.degraded)  # noqa: E731
+        result, path = await _scan_once(request, "meds", lookup, analyze, priority, deadline_ms)
+    else:
+        path = "cache"
+
+    details = result.get("diagnostics") if isinstance(result, dict) else None
+    metrics.record_request(
+        "meds", time.perf_counter() - started, path,
+        stages=details.get("stages") if isinstance(details, dict) and path not in ("cache", "coalesced") else None,
+        bytes=len(scan),
+    )
+
+    # X-Scan-Path lets load tests and proxies attribute latency to a pipeline path without parsing the body
+    body = _shape(result, "meds", diagnostics, cached=path == "cache", format=format)
+    return ORJSONResponse(body, headers={"X-Scan-Path": path})
+
+
+@app.post("/analyze-food/batch", response_model=BatchResponse)
+async def analyze_food_batch_endpoint(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    priority: str = "batch",
+    deadline_ms: Optional[int] = None,
+    diagnostics: bool = False,
+):
+    """
+    Analyze several food images in one request. Returns {"results": [...]} in upload order.
+    """
+    results, hits = await _cached_batch(request, files, "food", analyze_food_batch, priority, deadline_ms)
+    return {"results": [_shape(result, "food", diagnostics, cached=i in hits) for i, result in enumerate(results)]}
+
+
+@app.post("/analyze-meds/batch", response_model=BatchResponse)
+async def analyze_meds_batch_endpoint(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    format: str = "full",
+    priority: str = "batch",
+    deadline_ms: Optional[int] = None,
+    diagnostics: bool = False,
+):
+    """
+    Analyze several medication label images in one request (e.g. a pharmacy onboarding scan).
+    Identical images are analyzed once and OCR runs in parallel. Returns {"results": [...]}
+    in upload order, each shaped like the single-image endpoint's response for `format`.
+    """
+    results, hits = await _cached_batch(request, files, "meds", analyze_meds_batch, priority, deadline_ms)
+    return {"results": [_shape(result, "meds", diagnostics, cached=i in hits, format=format) for i, result in enumerate(results)]}
+
+
+def _sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+async def _cached_stream(namespace: str, cached, started: float, diagnostics: bool):
+    yield _sse("result", _shape(cached, namespace, diagnostics, cached=True))
+    yield _sse("done", {"cached": True})
+    metrics.record_request(namespace + "_stream", time.perf_counter() - started, "cache")
+
+
+async def _event_stream(request: Request, namespace: str, events, lookup, ticket, started: float, diagnostics: bool):
+    """
+    Serialize (event, data) pairs as Server-Sent Events and cache the `result` event, which is
+    sent in the compact ScanResult shape; the `diagnostics` event is only sent when asked for.
+    Stops early if the client disconnects or the deadline passes; the scheduler slot is
+    released when the stream ends either way (and by the response's background task when
+    the stream never started).
+    """
+    cache_key, phash, _ = lookup
+    path = "disconnected"
+    try:
+        async for event, data in events:
+            if await request.is_disconnected():
+                break
+            if ticket.remaining() <= 0:
+                path = "deadline"
+                yield _sse("error", {"error": "deadline passed while processing"})
+                break
+            if event == "ocr":
+                metrics.stage_seconds.observe(time.perf_counter() - started, endpoint=namespace + "_stream", stage="first_event")
+            if event == "result":
+                path = metrics.served_path(data)
+                if is_cacheable(data):
+                    await result_cache.store_async(cache_key, data, namespace, phash)
+                data = _shape(data, namespace, diagnostics)
+            elif event == "diagnostics" and not diagnostics:
+                continue
+            yield _sse(event, data)
+        yield _sse("done", {"cached": False})
+    finally:
+        await events.aclose()
+        scheduler.release(ticket)
+        metrics.record_request(namespace + "_stream", time.perf_counter() - started, path)
+
+
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse_response(stream, ticket=None) -> StreamingResponse:
+    # A client that goes away before the body starts never runs the generator's `finally`,
+    # so the scheduler slot is also released once the response is over, whichever way it ends
+    background = BackgroundTask(scheduler.release, ticket) if ticket is not None else None
+    return StreamingResponse(stream, media_type="text/event-stream", headers=_SSE_HEADERS, background=background)
+
+
+@app.post("/analyze-meds/stream")
+async def analyze_meds_stream_endpoint(
+    request: Request,
+    file: UploadFile = File(None),
+    capture: bool = False,
+    refine: bool = True,
+    priority: str = "interactive",
+    deadline_ms: Optional[int] = None,
+    diagnostics: bool = False,
+):
+    """
+    Server-Sent Events version of /analyze-meds. Emits `ocr` (heuristic fields), then `field`
+    events as Gemini's streamed reply completes each field, then `result`, `done`
+    (plus `diagnostics` before `done` with `diagnostics=true`).
+    """
+    started = time.perf_counter()
+    scan = await _read_scan(file, capture)
+    if scan is None:
+        return _camera_error()
+    lookup = await result_cache.lookup_async(scan, "meds")
+    if lookup[2] is not None:
+        return _sse_response(_cached_stream("meds", lookup[2], started, diagnostics))
+    ticket = await _admit(request, priority, deadline_ms)
+    events = stream_meds(scan, refine=refine, degraded=ticket.degraded)
+    return _sse_response(_event_stream(request, "meds", events, lookup, ticket, started, diagnostics), ticket)
+
+
+@app.post("/analyze-food/stream")
+async def analyze_food_stream_endpoint(
+    request: Request,
+    file: UploadFile = File(None),
+    capture: bool = False,
+    priority: str = "interactive",
+    deadline_ms: Optional[int] = None,
+    diagnostics: bool = False,
+):
+    """
+    Server-Sent Events version of /analyze-food. Emits `delta` text chunks, then `result`, `done`.
+    """
+    started = time.perf_counter()
+    scan = await _read_scan(file, capture)
+    if scan is None:
+        return _camera_error()
+    lookup = await result_cache.lookup_async(scan, "food")
+    if lookup[2] is not None:
+        return _sse_response(_cached_stream("food", lookup[2], started, diagnostics))
+    ticket = await _admit(request, priority, deadline_ms)
+    return _sse_response(_event_stream(request, "food", stream_food(scan), lookup, ticket, started, diagnostics), ticket)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus scrape endpoint: request/stage latency histograms, served-path counters, and
+    pool/cache gauges.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def _gauges():
+    pools = pool_stats()
+    for field, help in (("waiting", "Calls waiting for a pool slot"), ("in_flight", "Calls running in a pool")):
+        yield f"upstream_pool_{field}", help, ("pool",), {(name,): stats[field] for name, stats in pools.items()}
+    sched = scheduler.stats()
+    yield "scheduler_active", "Scans currently admitted", (), {(): sched["active"]}
+    yield "scheduler_waiting", "Scans waiting for admission", ("priority",), {
+        (name,): depth for name, depth in sched["waiting"].items()
+    }
+    yield "scheduler_events", "Admission outcomes", ("outcome",), {
+        (k,): sched[k] for k in ("admitted", "queued", "rejected", "shed", "expired", "disconnected", "degraded")
+    }
+    breaker = resilience.get_caller().breaker.stats()
+    yield "gemini_breaker_state", "Gemini circuit breaker state (1 for the current state)", ("state",), {
+        (state,): 1 if breaker["state"] == state else 0 for state in (resilience.CLOSED, resilience.OPEN, resilience.HALF_OPEN)
+    }
+    if job_store is not None:
+        yield "scan_jobs", "Jobs in the durable queue by status", ("status",), {
+            (status,): n for status, n in job_store.counts().items()
+        }
+    yield "scan_inflight", "Distinct scans in flight that identical requests can join", (), {(): inflight.stats()["in_flight"]}
+    yield "startup_step_seconds", "Duration of each startup step in this worker", ("step",), {
+        (step["step"],): step["ms"] / 1000.0 for step in startup.profile.stats()["steps"]
+    }
+    if result_cache is not None:
+        yield "result_cache_entries", "Entries in the in-memory result cache", (), {(): len(result_cache.memory)}
+        yield "result_cache_lookups", "Result cache lookups by outcome", ("outcome",), {
+            (k,): v for k, v in result_cache.counts().items()
+        }
+
+
+metrics.register_gauges(_gauges)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "enabled": result_cache.enabled,
+        "memory_entries": len(result_cache.memory),
+        "disk": result_cache.disk.path if result_cache.disk is not None else None,
+        "phash": result_cache.use_phash,
+        **result_cache.counts(),
+    }
+
+
+@app.post("/jobs/{kind}", status_code=202)
+async def submit_job(
+    kind: str,
+    file: UploadFile = File(...),
+    callback_url: Optional[str] = None,
+    priority: str = "batch",
+):
+    """
+    Queue a scan for background processing and return its job id right away.
+    `kind` is analyze-meds or analyze-food. Poll GET /jobs/{job_id}, or pass `callback_url`
+    to have the finished job POSTed there. Already-cached images complete immediately.
+    """
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=404, detail=f"unknown job kind {kind!r}")
+    loop = asyncio.get_running_loop()
+    if callback_url:
+        try:
+            await loop.run_in_executor(None, check_callback_url, callback_url)
+        except CallbackRejected as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    scan = await _read_scan(file, capture=False)
+    store = _jobs()
+    namespace = "meds" if kind == "analyze-meds" else "food"
+
+    # A cached image is recorded as done right away, so no worker can claim it and rescan
+    cached = (await result_cache.lookup_async(scan, namespace))[2]
+    if cached is not None:
+        job_id = await loop.run_in_executor(None, store.insert_done, kind, cached, callback_url)
+        if callback_url:
+            payload = {"job_id": job_id, "status": "done", "result": ScanResult.from_analyzer(cached, namespace).to_dict()}
+            loop.run_in_executor(None, post_callback, callback_url, payload)
+        return {"job_id": job_id, "status": "done", "poll": f"/jobs/{job_id}"}
+
+    try:
+        job_id = await loop.run_in_executor(
+            None,
+            lambda: store.enqueue(kind, scan.data, scan.mime_type, callback_url=callback_url, priority=0 if priority == "interactive" else 1),
+        )
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    if job_runner is not None:
+        job_runner.notify()
+    return {"job_id": job_id, "status": "queued", "poll": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, diagnostics: bool = False):
+    """
+    Job status; `result` (compact, or verbose with `diagnostics=true`) is included once the job
+    is done. 404 once the result has expired.
+    """
+    # A poll only reads: it opens an existing queue but doesn't start this process's workers
+    global job_store
+    if job_store is None:
+        if not os.path.exists(JobStore.path_from_env()):
+            raise HTTPException(status_code=404, detail="unknown or expired job")
+        job_store = JobStore.from_env()
+    store = job_store
+    job = await asyncio.get_running_loop().run_in_executor(None, store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown or expired job")
+    if "result" in job:
+        job["result"] = _shape(job["result"], "meds" if job["kind"] == "analyze-meds" else "food", diagnostics)
+    if job["status"] == "queued":
+        job["queue_position"] = await asyncio.get_running_loop().run_in_executor(None, store.position, job_id)
+    return job
+
+
+@app.get("/pools/stats")
+async def pools_stats():
+    """
+    Concurrency and queue-depth counters for each upstream pool (gemini, ocr), and per-stage
+    counters of the scan pipelines.
+    """
+    stats = pool_stats()
+    stats["ocr"] = get_engine().stats()
+    stats["extractor"] = get_extractor().stats()
+    stats["drug_names"] = drug_names.get_index().stats()
+    stats["preprocess"] = preprocess.stats()
+    stats["pipeline"] = get_pipeline_engine().stats()
+    stats["clients"] = clients.stats()
+    stats["routing"] = routing.get_router().stats()
+    stats["gemini_resilience"] = resilience.get_caller().stats()
+    stats["scheduler"] = scheduler.stats()
+    stats["coalesce"] = inflight.stats()
+    stats["startup"] = startup.profile.stats()
+    if camera.camera_started():
+        stats["camera"] = camera.get_camera().stats()
+    if job_store is not None:
+        stats["jobs"] = dict(job_store.counts(), workers=job_runner.stats() if job_runner is not None else None)
+    return stats
@@ -0,0 +1,388 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+# Perceptual hashes are 64-bit dHashes split into 4 bands of 16 bits. Two hashes within
+# Hamming distance 3 always share at least one identical band (pigeonhole), so near-duplicate
+# lookups only have to look at entries sharing a band instead of scanning the whole cache.
+_PHASH_BANDS = 4
+_PHASH_BAND_BITS = 16
+MAX_PHASH_DISTANCE = _PHASH_BANDS - 1
+
+
+def content_key(data: bytes, namespace: str = "") -> str:
+    """
+    Hash image bytes (plus a namespace such as the endpoint name) into a cache key.
+    """
+    h = hashlib.sha256()
+    h.update(namespace.encode("utf-8"))
+    h.update(b"\0")
+    h.update(data)
+    return h.hexdigest()
+
+
+def perceptual_hash(image: Any) -> Optional[int]:
+    """
+    Compute a 64-bit difference hash (dHash) of an encoded image (bytes) or an
+    already-decoded PIL image. Returns None if the image can't be decoded.
+    """
+    try:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            import io
+            from PIL import Image
+
+            image = Image.open(io.BytesIO(image))
+        img = image.convert("L").resize((9, 8))
+    except Exception:
+        return None
+
+    px = list(img.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = px[row * 9 + col]
+            right = px[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(phash: int) -> Tuple[int, ...]:
+    mask = (1 << _PHASH_BAND_BITS) - 1
+    return tuple((phash >> (_PHASH_BAND_BITS * i)) & mask for i in range(_PHASH_BANDS))
+
+
+def is_cacheable(result) -> bool:
+    # Only cache real answers; errors (camera, model not found, ...) should be retried
+    if not isinstance(result, dict):
+        return False
+    text = result.get("text")
+    diagnostics = result.get("diagnostics")
+    if isinstance(diagnostics, dict) and diagnostics.get("degraded"):
+        # Overload answers skip Gemini; don't let them shadow a full answer later
+        return False
+    return isinstance(text, dict) and "error" not in text and "error" not in result
+
+
+class MemoryTier:
+    """
+    In-process LRU cache with per-entry TTL and a banded perceptual-hash index.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expires_at, namespace, phash, value)
+        self._entries: "OrderedDict[str, Tuple[float, str, Optional[int], Any]]" = OrderedDict()
+        # (namespace, band index, band value) -> keys
+        self._bands: Dict[Tuple[str, int, int], Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[3]
+
+    def near(self, namespace: str, phash: int, max_distance: int) -> Optional[Any]:
+        with self._lock:
+            best_key, best_dist = None, max_distance + 1
+            for key in self._candidates(namespace, phash):
+                entry = self._entries.get(key)
+                if entry is None or entry[2] is None:
+                    continue
+                dist = hamming(entry[2], phash)
+                if dist < best_dist:
+                    best_key, best_dist = key, dist
+            if best_key is None:
+                return None
+            entry = self._entries[best_key]
+            if entry[0] < time.time():
+                self._drop(best_key)
+                return None
+            self._entries.move_to_end(best_key)
+            return entry[3]
+
+    def set(self, key: str, value: Any, namespace: str = "", phash: Optional[int] = None, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, namespace, phash, value)
+            if phash is not None:
+                for i, band in enumerate(_bands(phash)):
+                    self._bands.setdefault((namespace, i, band), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+
+    def _candidates(self, namespace: str, phash: int) -> Iterable[str]:
+        seen: Set[str] = set()
+        for i, band in enumerate(_bands(phash)):
+            for key in self._bands.get((namespace, i, band), ()):
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[2] is None:
+            return
+        for i, band in enumerate(_bands(entry[2])):
+            bucket = self._bands.get((entry[1], i, band))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._bands[(entry[1], i, band)]
+
+
+class DiskTier:
+    """
+    SQLite-backed cache tier so results survive restarts and are shared between workers.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600.0):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " namespace TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " phash TEXT,"
+            " b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER)"
+        )
+        for i in range(_PHASH_BANDS):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS results_b{i} ON results (namespace, b{i})")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self.delete(key)
+            return None
+        return json.loads(row[0])
+
+    def near(self, namespace: str, phash: int, max_distance: int) -> Optional[Tuple[str, Any, int]]:
+        """
+        Return (key, value, phash) of the closest entry within max_distance, if any.
+        """
+        bands = _bands(phash)
+        where = " OR ".join(f"b{i} = ?" for i in range(_PHASH_BANDS))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, value, phash FROM results WHERE namespace = ? AND expires_at >= ? AND ({where})",
+                (namespace, time.time(), *bands),
+            ).fetchall()
+        best = None
+        for key, value, row_phash in rows:
+            if row_phash is None:
+                continue
+            row_phash = int(row_phash, 16)
+            dist = hamming(row_phash, phash)
+            if dist <= max_distance and (best is None or dist < best[2]):
+                best = (key, value, dist, row_phash)
+        if best is None:
+            return None
+        return best[0], json.loads(best[1]), best[3]
+
+    def set(self, key: str, value: Any, namespace: str = "", phash: Optional[int] = None, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        bands = _bands(phash) if phash is not None else (None,) * _PHASH_BANDS
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, namespace, value, expires_at, phash, b0, b1, b2, b3)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, namespace, json.dumps(value), expires_at,
+                 format(phash, "016x") if phash is not None else None, *bands),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+            return cur.rowcount
+
+
+class ResultCache:
+    """
+    Two-tier (memory + optional SQLite) cache for analyzer results, keyed by image content.
+
+    Lookups try an exact content hash first and, when perceptual hashing is enabled, fall back
+    to the closest stored perceptual hash so re-captures of the same label also hit.
+    """
+
+    def __init__(
+        self,
+        memory: Optional[MemoryTier] = None,
+        disk: Optional[DiskTier] = None,
+        use_phash: bool = False,
+        max_distance: int = 2,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        # Not `memory or ...`: an empty MemoryTier is falsy (it has __len__)
+        self.memory = memory if memory is not None else MemoryTier()
+        self.disk = disk
+        self.use_phash = use_phash
+        self.max_distance = min(max_distance, MAX_PHASH_DISTANCE)
+        self.stats = {"hits": 0, "near_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        # Lookups and stores run on the loop and in executor threads alike
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """
+        Build a cache from RESULT_CACHE_* environment variables:
+          RESULT_CACHE_SIZE      max entries in memory (default 512, 0 disables caching)
+          RESULT_CACHE_TTL       memory TTL in seconds (default 3600)
+          RESULT_CACHE_DB        path to a SQLite file for the disk tier (unset = memory only)
+          RESULT_CACHE_DB_TTL    disk TTL in seconds (default 7 days)
+          RESULT_CACHE_PHASH     "1" to enable near-duplicate matching by perceptual hash
+          RESULT_CACHE_PHASH_DISTANCE  max Hamming distance for a near hit (default 2, max 3)
+        """
+        size = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+        memory = MemoryTier(max_entries=size, ttl=float(os.getenv("RESULT_CACHE_TTL", "3600")))
+        disk = None
+        db_path = os.getenv("RESULT_CACHE_DB")
+        if db_path:
+            disk = DiskTier(db_path, ttl=float(os.getenv("RESULT_CACHE_DB_TTL", str(7 * 24 * 3600))))
+        cache = cls(
+            memory=memory,
+            disk=disk,
+            use_phash=os.getenv("RESULT_CACHE_PHASH", "0") == "1",
+            max_distance=int(os.getenv("RESULT_CACHE_PHASH_DISTANCE", "2")),
+            enabled=size > 0,
+        )
+        return cache
+
+    def lookup(self, image: Any, namespace: str, key: Optional[str] = None) -> Tuple[str, Optional[int], Optional[Any]]:
+        """
+        Look up image bytes or a ScanImage. Returns (key, phash, cached value or None); pass
+        key and phash back to `store` on a miss so the image isn't hashed twice.
+        """
+        data = getattr(image, "data", image)
+        if key is None:
+            key = content_key(data, namespace)
+        phash = None
+        if self.enabled and self.use_phash:
+            # Reuse the scan's decoded image so the pipeline doesn't decode it a second time
+            try:
+                phash = perceptual_hash(image.decoded() if hasattr(image, "decoded") else data)
+            except Exception:
+                phash = None
+        return key, phash, self.get(key, namespace, phash)
+
+    async def lookup_async(self, image: Any, namespace: str) -> Tuple[str, Optional[int], Optional[Any]]:
+        """
+        `lookup` for the event loop. An exact hit in memory is answered inline (a SHA-256 and a
+        dict probe); the perceptual hash, which decodes the image, and the SQLite tier run in
+        the default executor.
+        """
+        key = content_key(getattr(image, "data", image), namespace)
+        if self.enabled:
+            value = self.memory.get(key)
+            if value is not None:
+                self._count("hits")
+                # No phash: it's only needed to store a miss
+                return key, None, copy.deepcopy(value)
+        return await asyncio.get_running_loop().run_in_executor(None, self.lookup, image, namespace, key)
+
+    async def store_async(self, key: str, value: Any, namespace: str = "", phash: Optional[int] = None):
+        # `store` off the event loop when there is a disk tier to write
+        if self.disk is None:
+            self.store(key, value, namespace, phash)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.store, key, value, namespace, phash)
+
+    def get(self, key: str, namespace: str = "", phash: Optional[int] = None) -> Optional[Any]:
+        if not self.enabled:
+            return None
+
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("hits")
+            return copy.deepcopy(value)
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self._count("disk_hits")
+                self.memory.set(key, value, namespace, phash)
+                return copy.deepcopy(value)
+
+        if phash is not None:
+            value = self.memory.near(namespace, phash, self.max_distance)
+            if value is None and self.disk is not None:
+                found = self.disk.near(namespace, phash, self.max_distance)
+                if found is not None:
+                    near_key, value, near_phash = found
+                    self.memory.set(near_key, value, namespace, near_phash)
+            if value is not None:
+                self._count("near_hits")
+                return copy.deepcopy(value)
+
+        self._count("misses")
+        return None
+
+    def store(self, key: str, value: Any, namespace: str = "", phash: Optional[int] = None):
+        if not self.enabled:
+            return
+        self.memory.set(key, value, namespace, phash)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, namespace, phash)
+            except (sqlite3.Error, TypeError, ValueError):
+                # A disk failure (locked DB, unserializable value) shouldn't fail the request
+                pass
+        self._count("stores")
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def counts(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def clear(self):
+        self.memory.clear()
@@ -0,0 +1,510 @@
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services import metrics
+
+# Shared segment layout: a float64 header, one float64 record per slot, then the raw frames.
+#   header: magic, slots, height, width, channels, heartbeat (unix time), frames written, reserved
+#   slot:   sequence number (-1 while being written), captured at (unix time), sharpness, reserved
+HEADER_FIELDS = 8
+SLOT_FIELDS = 4
+MAGIC = float(0x4E4C4341)
+
+OWNER = "owner"
+READER = "reader"
+
+# A reader whose owner hasn't written a frame for this long assumes it died
+STALE_S = 5.0
+# Frames darker than this (mean gray level) are still exposing; they score zero
+_DARK = 16.0
+
+camera_frames_total = metrics.counter(
+    "camera_frames_total", "Frames read from the capture device by outcome", ("outcome",)
+)
+camera_picks_total = metrics.counter(
+    "camera_picks_total", "capture=true scans by whether a recent frame was available", ("outcome",)
+)
+camera_pick_age_seconds = metrics.histogram(
+    "camera_pick_age_seconds", "Age of the frame handed to a capture=true scan",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+def sharpness(frame, width: int = 320) -> float:
+    """
+    Variance of the Laplacian on a downscaled grayscale copy: high for crisp edges (printed
+    text), low for motion blur, defocus and under-exposed frames.
+    """
+    import cv2
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    h, w = gray.shape[:2]
+    if w > width:
+        gray = cv2.resize(gray, (width, max(1, h * width // w)), interpolation=cv2.INTER_AREA)
+    if float(gray.mean()) < _DARK:
+        return 0.0
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class OpenCVSource:
+    """
+    A V4L2/DirectShow/AVFoundation device through cv2.VideoCapture, opened once.
+    """
+
+    def __init__(self, device: int = 0, width: Optional[int] = None, height: Optional[int] = None):
+        import cv2
+
+        self.cap = cv2.VideoCapture(device)
+        if not self.cap.isOpened():
+            self.cap.release()
+            raise RuntimeError(f"cannot open camera {device}")
+        if width:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        # Keep the driver's queue short so each read returns a current frame
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def read(self):
+        ok, frame = self.cap.read()
+        return frame if ok else None
+
+    def close(self):
+        self.cap.release()
+
+
+class SyntheticSource:
+    """
+    Generated frames for benchmarks and tests without a camera: a printed medication label
+    that drifts in and out of focus, paced at `fps`. The first `dark_frames` are nearly black,
+    like a sensor still exposing, and every `sharp_every`-th frame is perfectly sharp, so the
+    selection can be checked. `open_delay` simulates the time a real device takes to open.
+    """
+
+    LINES = ("AMOXICILLIN 500 MG", "Take 1 capsule every 8 hours", "Finish all medication", "Rx 0042137  Qty 21")
+
+    def __init__(
+        self,
+        width: int = 640,
+        height: int = 480,
+        fps: float = 30.0,
+        dark_frames: int = 3,
+        sharp_every: int = 4,
+        open_delay: float = 0.0,
+        seed: int = 0,
+    ):
+        import numpy as np
+
+        if open_delay:
+            time.sleep(open_delay)
+        self.fps = fps
+        self.dark_frames = dark_frames
+        self.sharp_every = sharp_every
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+        self._base = self._render(width, height)
+        self._next = time.monotonic()
+
+    def _render(self, width: int, height: int):
+        import cv2
+        import numpy as np
+
+        img = np.full((height, width, 3), 235, dtype=np.uint8)
+        scale = width / 640.0
+        for i, line in enumerate(self.LINES):
+            y = int(height * (0.2 + 0.18 * i))
+            cv2.putText(img, line, (int(30 * scale), y), cv2.FONT_HERSHEY_SIMPLEX, 0.9 * scale, (20, 20, 20), max(1, int(2 * scale)))
+        return img
+
+    def read(self):
+        import cv2
+        import numpy as np
+
+        if self.fps:
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next = max(self._next, time.monotonic()) + 1.0 / self.fps
+        self.count += 1
+        if self.count <= self.dark_frames:
+            return (self._base * 0.04).astype(np.uint8)
+        if self.sharp_every and self.count % self.sharp_every == 0:
+            frame = self._base.copy()
+        else:
+            frame = cv2.GaussianBlur(self._base, (0, 0), 1.5 + 2.5 * self._rng.random())
+        noise = self._rng.integers(0, 6, frame.shape, dtype=np.uint8)
+        return cv2.add(frame, noise)
+
+    def close(self):
+        pass
+
+
+def make_source(device: str = "0", width: Optional[int] = None, height: Optional[int] = None):
+    """
+    "synthetic" for SyntheticSource, otherwise an OpenCV device index or URL.
+    """
+    if device == "synthetic":
+        return SyntheticSource(width or 640, height or 480)
+    return OpenCVSource(int(device) if device.isdigit() else device, width, height)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before 3.13 attaching registers the segment with this process's resource tracker,
+        # which would unlink it (under the owner) when this process exits
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class FrameRing:
+    """
+    Fixed number of frame slots in a named shared memory segment: one writer (the capture
+    thread) and any number of readers, in this process or attached by name from others.
+    The writer sets a slot's sequence number to -1 while copying a frame in; a reader that
+    sees the number change across its copy knows the slot was overwritten and skips it.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        import numpy as np
+
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.float64, buffer=shm.buf)
+        slots, h, w, c = (int(v) for v in self.header[1:5])
+        self.slots = slots
+        self.shape = (h, w, c) if c > 1 else (h, w)
+        self.meta = np.ndarray((slots, SLOT_FIELDS), dtype=np.float64, buffer=shm.buf, offset=HEADER_FIELDS * 8)
+        self.frames = np.ndarray(
+            (slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=(HEADER_FIELDS + slots * SLOT_FIELDS) * 8
+        )
+
+    @classmethod
+    def create(cls, name: str, slots: int, shape: Tuple[int, ...]) -> "FrameRing":
+        import numpy as np
+
+        h, w = shape[:2]
+        c = shape[2] if len(shape) > 2 else 1
+        size = (HEADER_FIELDS + slots * SLOT_FIELDS) * 8 + slots * h * w * c
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a capture process that didn't shut down cleanly
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.float64, buffer=shm.buf)
+        header[:] = 0
+        header[1:5] = (slots, h, w, c)
+        del header
+        ring = cls(shm, owner=True)
+        ring.meta[:, :] = 0
+        ring.meta[:, 0] = -1
+        # Written last so readers never see a half-initialised segment
+        ring.header[0] = MAGIC
+        return ring
+
+    @classmethod
+    def attach(cls, name: str) -> "FrameRing":
+        shm = _attach(name)
+        if shm.size < HEADER_FIELDS * 8:
+            shm.close()
+            raise RuntimeError(f"shared memory segment {name!r} is not a frame ring")
+        ring = cls(shm, owner=False)
+        if ring.header[0] != MAGIC:
+            ring.close()
+            raise RuntimeError(f"shared memory segment {name!r} is not a frame ring")
+        return ring
+
+    def heartbeat(self) -> float:
+        return float(self.header[5])
+
+    def written(self) -> int:
+        return int(self.header[6])
+
+    def write(self, frame, score: float):
+        seq = self.written() + 1
+        slot = seq % self.slots
+        self.meta[slot, 0] = -1
+        self.frames[slot] = frame
+        now = time.time()
+        self.meta[slot, 1] = now
+        self.meta[slot, 2] = score
+        self.meta[slot, 0] = seq
+        self.header[6] = seq
+        self.header[5] = now
+
+    def best(self, max_age: float) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """
+        Copy out the sharpest frame captured within `max_age` seconds, with its sequence
+        number, age and score. None if no slot qualifies.
+        """
+        now = time.time()
+        meta = self.meta.copy()
+        recent = [i for i in range(self.slots) if meta[i, 0] >= 0 and now - meta[i, 1] <= max_age]
+        for i in sorted(recent, key=lambda i: meta[i, 2], reverse=True):
+            frame = self.frames[i].copy()
+            if self.meta[i, 0] == meta[i, 0]:
+                return frame, {"seq": int(meta[i, 0]), "age": float(now - meta[i, 1]), "sharpness": float(meta[i, 2])}
+        return None
+
+    def close(self):
+        # The numpy views pin the buffer; drop them before closing the mapping
+        self.header = self.meta = self.frames = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class CameraService:
+    """
+    Keeps the capture device open and a FrameRing topped up from a background thread, so a
+    `capture=true` scan takes the sharpest frame of the last moment instead of opening the
+    camera, reading whatever un-exposed first frame it returns and closing it again.
+
+    Only one process can hold a camera. With mode "auto" the first process to start owns
+    the device and the others on the machine attach to its ring by name and read from it;
+    "own" and "attach" force one role (e.g. a standalone `python capture.py` owner with API
+    workers in attach mode). A reader whose owner stops writing takes over in "auto" mode.
+    """
+
+    def __init__(
+        self,
+        source_factory: Callable[[], Any],
+        name: str = "nutrilens-camera",
+        slots: int = 8,
+        max_age: float = 1.0,
+        warmup_frames: int = 5,
+        wait: float = 3.0,
+        mode: str = "auto",
+        retry: float = 1.0,
+        max_retry: float = 30.0,
+    ):
+        self.source_factory = source_factory
+        self.name = name
+        self.slots = slots
+        self.max_age = max_age
+        self.warmup_frames = warmup_frames
+        self.wait = wait
+        self.mode = mode
+        self.retry = retry
+        self.max_retry = max_retry
+        self.role: Optional[str] = None
+        self.ring: Optional[FrameRing] = None
+        self.error: Optional[str] = None
+        self.frames = 0
+        self.read_errors = 0
+        self.picks = 0
+        self.stale_picks = 0
+        self.misses = 0
+        self.failures = 0
+        self._age_total = 0.0
+        # After a failed open, start() does nothing until then; the wait doubles per failure
+        self._retry_at = 0.0
+        self._backoff = retry
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "CameraService":
+        """
+          CAMERA_DEVICE         OpenCV device index or URL, or "synthetic" (default 0)
+          CAMERA_WIDTH / CAMERA_HEIGHT  requested resolution (default: the driver's)
+          CAMERA_RING_SLOTS     frames kept in the shared ring (default 8)
+          CAMERA_MAX_AGE_S      oldest frame a scan may be given (default 1)
+          CAMERA_WARMUP_FRAMES  frames discarded after opening while exposure settles (default 5)
+          CAMERA_WAIT_S         how long a scan waits for the first frames (default 3)
+          CAMERA_SHM_NAME       shared memory segment name (default nutrilens-camera)
+          CAMERA_MODE           auto, own or attach (default auto)
+          CAMERA_RETRY_S        wait before reopening a device that failed, doubling up to 30 s (default 1)
+        """
+        device = os.getenv("CAMERA_DEVICE", "0")
+        width = int(os.getenv("CAMERA_WIDTH", "0")) or None
+        height = int(os.getenv("CAMERA_HEIGHT", "0")) or None
+        return cls(
+            source_factory=lambda: make_source(device, width, height),
+            name=os.getenv("CAMERA_SHM_NAME", "nutrilens-camera"),
+            slots=int(os.getenv("CAMERA_RING_SLOTS", "8")),
+            max_age=float(os.getenv("CAMERA_MAX_AGE_S", "1")),
+            warmup_frames=int(os.getenv("CAMERA_WARMUP_FRAMES", "5")),
+            wait=float(os.getenv("CAMERA_WAIT_S", "3")),
+            mode=os.getenv("CAMERA_MODE", "auto"),
+            retry=float(os.getenv("CAMERA_RETRY_S", "1")),
+        )
+
+    def start(self):
+        """
+        Attach to a live ring, or open the device and start capturing. Idempotent; after the
+        device failed, nothing happens until its retry backoff has passed.
+        """
+        with self._lock:
+            if self.role is not None or time.monotonic() < self._retry_at:
+                return
+            if self.mode != "own":
+                try:
+                    ring = FrameRing.attach(self.name)
+                except (FileNotFoundError, RuntimeError, ValueError):
+                    ring = None
+                if ring is not None and time.time() - ring.heartbeat() < STALE_S:
+                    self.ring, self.role = ring, READER
+                    return
+                if ring is not None:
+                    ring.close()
+                if self.mode == "attach":
+                    # No owner yet; grab() keeps looking for one
+                    return
+            self.role = OWNER
+            self.error = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="camera-capture", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            source = self.source_factory()
+        except Exception as e:
+            self._failed(e)
+            return
+        try:
+            # Auto-exposure and white balance settle over the first few frames
+            for _ in range(self.warmup_frames):
+                source.read()
+            while not self._stop.is_set():
+                frame = source.read()
+                if frame is None:
+                    self.read_errors += 1
+                    camera_frames_total.inc(outcome="failed")
+                    time.sleep(0.05)
+                    continue
+                if self.ring is None:
+                    self.ring = FrameRing.create(self.name, self.slots, frame.shape)
+                    self._backoff = self.retry
+                self.ring.write(frame, sharpness(frame))
+                self.frames += 1
+                camera_frames_total.inc(outcome="ok")
+        except Exception as e:
+            self._failed(e)
+        finally:
+            source.close()
+
+    def _failed(self, e: Exception):
+        # Give up the owner role and the segment so a later start() (after the backoff) can
+        # reopen the device, or attach to whichever process owns it by then
+        with self._lock:
+            self.error = str(e)
+            self.failures += 1
+            if self.ring is not None:
+                self.ring.close()
+            self.ring = None
+            self.role = None
+            self._retry_at = time.monotonic() + self._backoff
+            self._backoff = min(self._backoff * 2, self.max_retry)
+
+    def _reattach(self):
+        # The owning process stopped writing; let start() find a new owner or become it
+        with self._lock:
+            if self.ring is not None:
+                self.ring.close()
+            self.ring = None
+            self.role = None
+        self.start()
+
+    def grab(self) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """
+        The sharpest frame of the last `max_age` seconds as (BGR ndarray, info), waiting up to
+        `wait` seconds for the device to deliver. If nothing that recent turns up, the newest
+        frame of any age; None if there is no camera. Blocking.
+        """
+        self.start()
+        deadline = time.monotonic() + self.wait
+        while True:
+            ring = self.ring
+            if ring is None and self.role is None:
+                self.start()
+            elif ring is not None:
+                if self.role == READER and time.time() - ring.heartbeat() > STALE_S:
+                    self._reattach()
+                    continue
+                # Right after the device opens, wait for a few frames so there is something to choose from
+                picked = ring.best(self.max_age) if ring.written() >= self.slots // 2 else None
+                if picked is not None:
+                    return self._picked(picked, "ok")
+            if self.error or time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+        picked = self.ring.best(float("inf")) if self.ring is not None else None
+        if picked is not None:
+            self.stale_picks += 1
+            return self._picked(picked, "stale")
+        self.misses += 1
+        camera_picks_total.inc(outcome="none")
+        return None
+
+    def _picked(self, picked, outcome: str):
+        frame, info = picked
+        self.picks += 1
+        self._age_total += info["age"]
+        camera_picks_total.inc(outcome=outcome)
+        camera_pick_age_seconds.observe(info["age"])
+        return frame, dict(info, role=self.role)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        with self._lock:
+            if self.ring is not None:
+                self.ring.close()
+            self.ring = None
+            self.role = None
+            self._retry_at = 0.0
+            self._backoff = self.retry
+
+    def stats(self) -> Dict[str, Any]:
+        ring = self.ring
+        return {
+            "role": self.role,
+            "mode": self.mode,
+            "segment": self.name,
+            "shape": list(ring.shape) if ring is not None else None,
+            "slots": self.slots,
+            "frames_written": ring.written() if ring is not None else 0,
+            "heartbeat_age_s": round(time.time() - ring.heartbeat(), 3) if ring is not None else None,
+            "captured": self.frames,
+            "read_errors": self.read_errors,
+            "picks": self.picks,
+            "stale_picks": self.stale_picks,
+            "misses": self.misses,
+            "avg_pick_age_ms": round(1000 * self._age_total / self.picks, 1) if self.picks else None,
+            "error": self.error,
+            "failures": self.failures,
+            "retry_in_s": round(max(0.0, self._retry_at - time.monotonic()), 1) if self.role is None and self.error else None,
+        }
+
+
+_camera: Optional[CameraService] = None
+
+
+def get_camera() -> CameraService:
+    global _camera
+    if _camera is None:
+        _camera = CameraService.from_env()
+    return _camera
+
+
+def camera_started() -> bool:
+    # A camera that failed and is waiting to retry still counts, so its error shows in the stats
+    return _camera is not None and (_camera.role is not None or _camera.error is not None)
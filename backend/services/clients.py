@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    # Annotations only; the real import is deferred to _genai()
+    import google.generativeai as genai
+
+# Model used for image prompts, and for text prompts (None = the SDK's default model)
+MULTIMODAL_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+TEXT_MODEL = os.getenv("GEMINI_TEXT_MODEL") or None
+
+_lock = threading.Lock()
+_configured = False
+_models: Dict[Optional[str], "genai.GenerativeModel"] = {}
+_model_names: Optional[List[str]] = None
+_model_names_at = 0.0
+
+
+def _genai():
+    # The SDK takes a second or so to import; it's loaded on first use (normally the startup
+    # warm-up in services/startup.py), not when this module is imported
+    import google.generativeai as genai
+
+    return genai
+
+
+def configure():
+    """
+    Configure the SDK once per worker process. The SDK keeps one underlying client (and its
+    gRPC channel / HTTP session) per process after this, so every model handle below shares
+    the same pooled, kept-alive connection.
+      API_KEY              Gemini API key (also read from .env)
+      GEMINI_TRANSPORT     "grpc" (default) or "rest"
+      GEMINI_API_ENDPOINT  override the API host (e.g. a local stub server)
+    """
+    global _configured
+    if _configured:
+        return
+    with _lock:
+        if _configured:
+            return
+        from dotenv import load_dotenv
+
+        # Load environment variables from .env file
+        load_dotenv()
+        kwargs = {"api_key": os.getenv("API_KEY")}
+        transport = os.getenv("GEMINI_TRANSPORT")
+        if transport:
+            kwargs["transport"] = transport
+        endpoint = os.getenv("GEMINI_API_ENDPOINT")
+        if endpoint:
+            kwargs["client_options"] = {"api_endpoint": endpoint}
+        _genai().configure(**kwargs)
+        _configured = True
+
+
+def model(name: Optional[str] = MULTIMODAL_MODEL) -> "genai.GenerativeModel":
+    """
+    Shared GenerativeModel handle for `name` (None = SDK default text model), created once.
+    """
+    handle = _models.get(name)
+    if handle is None:
+        configure()
+        with _lock:
+            handle = _models.get(name)
+            if handle is None:
+                genai = _genai()
+                handle = genai.GenerativeModel(name) if name else genai.GenerativeModel()
+                _models[name] = handle
+    return handle
+
+
+def text_model() -> "genai.GenerativeModel":
+    return model(TEXT_MODEL)
+
+
+def list_model_names(ttl: Optional[float] = None) -> List[str]:
+    """
+    Names of the models available to this API key, cached for MODELS_CACHE_TTL seconds
+    (default 600). Blocking; call it through the Gemini pool.
+    """
+    global _model_names, _model_names_at
+    ttl = float(os.getenv("MODELS_CACHE_TTL", "600")) if ttl is None else ttl
+    if _model_names is not None and time.monotonic() - _model_names_at < ttl:
+        return _model_names
+    configure()
+    names = [m.name for m in _genai().list_models()]
+    with _lock:
+        _model_names, _model_names_at = names, time.monotonic()
+    return names
+
+
+def warm():
+    """
+    Build the model handles and open the connection before the first scan arrives.
+    Blocking; errors (no network, bad key) are left for the first real request to report.
+    """
+    model()
+    text_model()
+    try:
+        list_model_names()
+    except Exception:
+        pass
+
+
+def stats() -> dict:
+    return {
+        "configured": _configured,
+        "models": [name or "default" for name in _models],
+        "model_names_cached": _model_names is not None,
+        "model_names_age_s": round(time.monotonic() - _model_names_at, 1) if _model_names is not None else None,
+    }
@@ -0,0 +1,253 @@
+import asyncio
+import copy
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing stays within each worker
+    fcntl = None
+
+from services import metrics
+from services.cache import is_cacheable
+from services.scheduler import ClientGone, DeadlineExceeded
+
+coalesced_total = metrics.counter(
+    "scan_coalesced_total", "Scans answered by an identical scan that was already in flight", ("scope",)
+)
+
+# Lock and result files older than this are left over from finished scans
+_SWEEP_AGE_S = 120.0
+_SWEEP_EVERY = 256
+
+# Set on a flight whose leader failed or was cancelled, so its followers try again themselves
+_FAILED = object()
+
+# How often a waiting request checks whether its client is still there
+_CHECK_EVERY_S = 0.5
+
+
+class SingleFlight:
+    """
+    Single-flight deduplication of identical scans (double taps, client retries). The first
+    request for a key runs the pipeline; identical requests arriving while it runs wait on
+    its future and get a copy of its result instead of taking their own scheduler slot and
+    Gemini call.
+
+    With a lock directory, workers on the same host coordinate too: the worker holding an
+    flock on `<key>.lock` runs the scan and leaves the result in `<key>.json`; the others
+    wait for the lock to be released and read it.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = None, wait: float = 30.0, poll: float = 0.02, enabled: bool = True):
+        self.enabled = enabled
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.wait = wait
+        self.poll = poll
+        self._flights: Dict[str, asyncio.Future] = {}
+        self._dir_ready = False
+        self._leads = 0
+        self.counts = {"led": 0, "joined": 0, "remote_joined": 0, "remote_timeouts": 0, "retried": 0, "deadline_exceeded": 0}
+
+    @classmethod
+    def from_env(cls) -> "SingleFlight":
+        """
+          COALESCE          "0" to turn coalescing off (default 1)
+          COALESCE_DIR      directory for cross-worker lock/result files (unset = within each worker only)
+          COALESCE_WAIT_S   longest a scan waits on another worker before running itself (default 30;
+                            never past the request's deadline)
+        """
+        return cls(
+            lock_dir=os.getenv("COALESCE_DIR") or None,
+            wait=float(os.getenv("COALESCE_WAIT_S", "30")),
+            enabled=os.getenv("COALESCE", "1") == "1",
+        )
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        deadline: Optional[float] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Tuple[Any, Optional[str]]:
+        """
+        Await `fn()` once per key at a time. Returns (result, shared): shared is None for the
+        request that ran it, "local" or "remote" for requests that reused another's result.
+        If the running request fails or is cancelled (its client went away, its deadline
+        passed), the waiting ones don't inherit that; one of them runs the scan instead.
+        Waiting on another request stops at `deadline` (monotonic) with DeadlineExceeded, or
+        with ClientGone once `is_disconnected()` says so.
+        """
+        if not self.enabled:
+            return await fn(), None
+        while key in self._flights:
+            result = await self._follow(self._flights[key], deadline, is_disconnected)
+            if result is not _FAILED:
+                self.counts["joined"] += 1
+                coalesced_total.inc(scope="local")
+                return copy.deepcopy(result), "local"
+            self.counts["retried"] += 1
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        result = _FAILED
+        try:
+            result, shared = await self._lead(key, fn, deadline, is_disconnected)
+            return result, shared
+        finally:
+            del self._flights[key]
+            flight.set_result(result)
+
+    async def _follow(self, flight: asyncio.Future, deadline: Optional[float], is_disconnected) -> Any:
+        while True:
+            timeout = _CHECK_EVERY_S
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counts["deadline_exceeded"] += 1
+                    raise DeadlineExceeded("deadline passed while waiting for an identical scan")
+                timeout = min(timeout, remaining)
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight), timeout=timeout)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    raise ClientGone("client disconnected while waiting for an identical scan")
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable[Any]], deadline: Optional[float], is_disconnected) -> Tuple[Any, Optional[str]]:
+        self.counts["led"] += 1
+        if self.lock_dir is None:
+            return await fn(), None
+        # The lock and result files are plain blocking I/O; keep it off the event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._prepare)
+
+        started = time.time()
+        fd = await self._lock(key)
+        if fd is None:
+            # Another worker is running this scan: wait for it to let go of the lock, but not
+            # past this request's own deadline
+            give_up = time.monotonic() + self.wait
+            if deadline is not None:
+                give_up = min(give_up, deadline)
+            next_check = time.monotonic() + _CHECK_EVERY_S
+            while fd is None and time.monotonic() < give_up:
+                await asyncio.sleep(self.poll)
+                fd = await self._lock(key)
+                if fd is None and is_disconnected is not None and time.monotonic() >= next_check:
+                    next_check = time.monotonic() + _CHECK_EVERY_S
+                    if await is_disconnected():
+                        raise ClientGone("client disconnected while waiting for an identical scan")
+            found = await loop.run_in_executor(None, self._read_result, key, started)
+            if found is not None:
+                await loop.run_in_executor(None, self._unlock, fd)
+                self.counts["remote_joined"] += 1
+                coalesced_total.inc(scope="remote")
+                return found, "remote"
+            if fd is None:
+                self.counts["remote_timeouts"] += 1
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.counts["deadline_exceeded"] += 1
+                    raise DeadlineExceeded("deadline passed while waiting for an identical scan")
+            # Otherwise the other worker failed (or its result wasn't JSON); run it here
+
+        try:
+            result = await fn()
+            # Degraded and error answers are for this moment only; don't let other workers
+            # pick them up
+            if fd is not None and is_cacheable(result):
+                await loop.run_in_executor(None, self._write_result, key, result)
+            return result, None
+        finally:
+            await loop.run_in_executor(None, self._unlock, fd)
+
+    async def _lock(self, key: str) -> Optional[int]:
+        future = asyncio.get_running_loop().run_in_executor(None, self._try_lock, key)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Cancelled while the thread was taking the lock: release it once it has
+            future.add_done_callback(self._unlock_taken)
+            raise
+
+    def _unlock_taken(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            self._unlock(future.result())
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.lock_dir, key + suffix)
+
+    def _prepare(self):
+        if not self._dir_ready:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            self._dir_ready = True
+        self._leads += 1
+        if self._leads % _SWEEP_EVERY == 0:
+            self._sweep()
+
+    def _try_lock(self, key: str) -> Optional[int]:
+        path = self._path(key, ".lock")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # A sweep may have unlinked the file between our open and flock; a lock on that
+            # orphan wouldn't exclude anyone
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except OSError:
+            pass
+        os.close(fd)
+        return None
+
+    def _unlock(self, fd: Optional[int]):
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _write_result(self, key: str, result: Any):
+        # Written before the lock is released, so a waiter that gets the lock sees it
+        path = self._path(key, ".json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"finished": time.time(), "result": result}, f)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def _read_result(self, key: str, since: float) -> Optional[Any]:
+        # Only a result finished after we started waiting answers this request
+        try:
+            with open(self._path(key, ".json")) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("finished", 0) < since:
+            return None
+        return entry.get("result")
+
+    def _sweep(self):
+        cutoff = time.time() - _SWEEP_AGE_S
+        try:
+            names = os.listdir(self.lock_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "lock_dir": self.lock_dir,
+            "in_flight": len(self._flights),
+            **self.counts,
+        }
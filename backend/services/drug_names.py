@@ -0,0 +1,276 @@
+import csv
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from services import metrics
+
+DEFAULT_VOCAB_PATH = os.path.join(os.path.dirname(__file__), "data", "drug_names.csv")
+
+# OCR confusions folded to one character on both sides before matching, so "Amoxici11in",
+# "AMOXICILLIN" and "am0xicillin" all land on the same key and cost no edits
+_FOLD_MULTI = (("rn", "m"), ("vv", "w"))
+_FOLD = str.maketrans("01i|!58$49", "ollllsbsag")
+_WORD_RX = re.compile(r"[A-Za-z0-9][A-Za-z0-9/'-]*")
+
+drug_name_lookups_total = metrics.counter(
+    "drug_name_lookups_total", "Medication names checked against the drug vocabulary", ("outcome",)
+)
+
+
+def fold(text: str) -> str:
+    text = " ".join((text or "").lower().split())
+    for src, dst in _FOLD_MULTI:
+        text = text.replace(src, dst)
+    return text.translate(_FOLD)
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance (insert, delete, substitute, swap neighbours), or
+    limit + 1 as soon as it is certain to exceed `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    prev2: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        ca = a[i - 1]
+        cur = [i] * (len(b) + 1)
+        best = i
+        for j in range(1, len(b) + 1):
+            value = prev[j - 1] if ca == b[j - 1] else prev[j - 1] + 1
+            if prev[j] + 1 < value:
+                value = prev[j] + 1
+            if cur[j - 1] + 1 < value:
+                value = cur[j - 1] + 1
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == b[j - 1] and prev2[j - 2] + 1 < value:
+                value = prev2[j - 2] + 1
+            cur[j] = value
+            if value < best:
+                best = value
+        if best > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _deletes(word: str, distance: int) -> set:
+    out, frontier = {word}, {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out |= frontier
+    return out
+
+
+def _match_case(like: str, word: str) -> str:
+    # Write the vocabulary spelling the way the label printed the original
+    if like.isupper():
+        return word.upper()
+    if like[:1].isupper():
+        return word[:1].upper() + word[1:]
+    return word.lower()
+
+
+class DrugMatch(NamedTuple):
+    term: str  # the text that matched, as printed
+    start: int  # where it is in the text that was searched
+    end: int
+    name: str  # vocabulary spelling
+    generic: str
+    brand: bool
+    distance: int  # edits between the folded term and the folded name (OCR swaps are free)
+
+
+class DrugIndex:
+    """
+    Brand and generic drug names in a SymSpell-style deletion index: every name is stored
+    under all the strings it becomes with up to `max_distance` characters deleted, so finding
+    the names within that many edits of an OCR token is a handful of dict probes (the token's
+    own deletes) plus a bounded edit distance on the few candidates, instead of a scan of the
+    vocabulary. Matching happens on folded text (see `fold`), so the usual digit-for-letter
+    misreads don't even count as edits.
+    """
+
+    def __init__(self, rows: Iterable[Dict[str, str]], max_distance: int = 2):
+        self.max_distance = max_distance
+        self.names: List[Tuple[str, str, bool]] = []  # (name, generic, brand)
+        self._keys: Dict[str, List[int]] = {}
+        self._deletes: Dict[str, List[str]] = {}
+        self._max_words = 1
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.corrected = 0
+        for row in rows:
+            generic = row["generic"].strip()
+            self._add(generic, generic, False)
+            for brand in (row.get("brands") or "").split("|"):
+                if brand.strip():
+                    self._add(brand.strip(), generic, True)
+
+    def _add(self, name: str, generic: str, brand: bool):
+        key = fold(name)
+        if not key:
+            return
+        self.names.append((name, generic, brand))
+        if key not in self._keys:
+            self._keys[key] = []
+            for d in _deletes(key, self.max_distance):
+                self._deletes.setdefault(d, []).append(key)
+        self._keys[key].append(len(self.names) - 1)
+        self._max_words = max(self._max_words, len(key.split()))
+
+    @classmethod
+    def from_csv(cls, path: str = DEFAULT_VOCAB_PATH, max_distance: int = 2) -> "DrugIndex":
+        with open(path, newline="", encoding="utf-8") as f:
+            lines = (line for line in f if not line.startswith("#"))
+            return cls(csv.DictReader(lines), max_distance=max_distance)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def allowed_distance(self, term: str) -> int:
+        # Short words are too easy to turn into some drug name: exact only up to 4 letters
+        n = len(term)
+        return 0 if n <= 4 else min(self.max_distance, 1 if n <= 7 else 2)
+
+    def lookup(self, term: str) -> Optional[Tuple[str, str, bool, int]]:
+        """
+        Closest vocabulary name to `term` as (name, generic, brand, distance), or None when
+        nothing is within the allowed distance. Ties go to the name closest as printed.
+        """
+        key = fold(term)
+        if not key:
+            return None
+        found = self._keys.get(key)
+        distance = 0
+        if found is None:
+            # Nearest first: a name one edit away is found without looking two edits out
+            for limit in range(1, self.allowed_distance(key) + 1):
+                found, distance = self._nearest(key, limit)
+                if found:
+                    break
+            if not found:
+                return None
+        if len(found) == 1:
+            return self.names[found[0]] + (distance,)
+        lower = term.lower()
+        name, generic, brand = min(
+            (self.names[i] for i in found),
+            key=lambda entry: edit_distance(lower, entry[0].lower(), len(lower) + len(entry[0])),
+        )
+        return name, generic, brand, distance
+
+    def _nearest(self, key: str, limit: int) -> Tuple[List[int], int]:
+        # Entries of the closest keys within `limit` edits, and their distance
+        seen: Dict[str, int] = {}
+        for d in _deletes(key, limit):
+            for candidate in self._deletes.get(d, ()):
+                if candidate not in seen:
+                    seen[candidate] = edit_distance(key, candidate, limit)
+        distance = min(seen.values(), default=limit + 1)
+        if distance > limit:
+            return [], distance
+        return [i for k, dist in seen.items() if dist == distance for i in self._keys[k]], distance
+
+    def find(self, text: str) -> Optional[DrugMatch]:
+        """
+        The first drug named in `text` ("Amoxici11in 25O mg/5mL", "METFORMIN HCL ER 750MG",
+        "Lipitor (atorvastatin) 20 mg"): the leftmost run of words that matches, longest run
+        first so "insulin glargine" beats "insulin".
+        """
+        words = [(m.group(0), m.start(), m.end()) for m in _WORD_RX.finditer(text or "")]
+        for i in range(len(words)):
+            for size in range(min(self._max_words, len(words) - i), 0, -1):
+                start, end = words[i][1], words[i + size - 1][2]
+                term = text[start:end]
+                if not any(ch.isalpha() for ch in term):
+                    continue
+                found = self.lookup(term)
+                if found is not None:
+                    name, generic, brand, distance = found
+                    return DrugMatch(term, start, end, name, generic, brand, distance)
+        return None
+
+    def normalize(
+        self, fields: Optional[dict], text: Optional[str] = None, lines: int = 3, report: Optional[dict] = None
+    ) -> Optional[dict]:
+        """
+        Check a parse's medicationName against the vocabulary: fix an OCR misread of the drug
+        name in place (keeping the label's case and whatever else the name says, like the
+        salt or "ER"), and fill an empty genericName. A name with no drug in it is kept as
+        parsed: only an empty name is filled from a drug on the first `lines` lines of the
+        OCR `text`. Otherwise a drug found there is recorded in `report` as `candidate`, for
+        diagnostics. Returns a new dict; `fields` itself is left alone.
+        """
+        if not fields:
+            return fields
+        name = fields.get("medicationName") or ""
+        match = self.find(name)
+        replace_name = False
+        if match is None and text:
+            for line in [l.strip() for l in text.splitlines() if l.strip()][:lines]:
+                found = self.find(line)
+                if found is None:
+                    continue
+                if name.strip():
+                    # The parse may well be right about an unlisted drug; don't overrule it
+                    if report is not None:
+                        report["candidate"] = {"term": found.term, "name": found.name, "generic": found.generic}
+                else:
+                    match, replace_name = found, True
+                break
+        # Folding makes "Amoxici11in" an exact hit, so compare spellings, not the distance
+        misread = match is not None and match.term.lower() != match.name.lower()
+        with self._lock:
+            self.lookups += 1
+            self.corrected += bool(misread or replace_name)
+        if match is None:
+            drug_name_lookups_total.inc(outcome="unknown")
+            return fields
+
+        out = dict(fields)
+        fixed = _match_case(match.term, match.name) if misread else match.term
+        if replace_name:
+            out["medicationName"] = fixed
+            drug_name_lookups_total.inc(outcome="found_in_text")
+        elif misread:
+            out["medicationName"] = name[:match.start] + fixed + name[match.end:]
+            drug_name_lookups_total.inc(outcome="corrected")
+        else:
+            drug_name_lookups_total.inc(outcome="exact")
+        if misread and out.get("plainLanguage"):
+            out["plainLanguage"] = out["plainLanguage"].replace(match.term, fixed)
+        if not out.get("genericName"):
+            out["genericName"] = match.generic
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "names": len(self.names),
+            "keys": len(self._keys),
+            "delete_entries": len(self._deletes),
+            "max_distance": self.max_distance,
+            "lookups": self.lookups,
+            "corrected": self.corrected,
+        }
+
+
+_index: Optional[DrugIndex] = None
+
+
+def get_index() -> DrugIndex:
+    """
+    Index built from DRUG_NAMES_PATH (defaults to the bundled data/drug_names.csv), matching
+    up to DRUG_NAMES_MAX_EDIT edits (default 2; 0 only folds OCR confusions).
+    """
+    global _index
+    if _index is None:
+        _index = DrugIndex.from_csv(
+            os.getenv("DRUG_NAMES_PATH", DEFAULT_VOCAB_PATH),
+            max_distance=int(os.getenv("DRUG_NAMES_MAX_EDIT", "2")),
+        )
+    return _index
@@ -0,0 +1,240 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("nutrilens.executor")
+
+
+class PoolSaturated(Exception):
+    """
+    Raised when an upstream's wait queue is already at its configured maximum.
+    """
+
+
+class UpstreamPool:
+    """
+    Runs blocking calls for one upstream (Gemini, OCR workers, ...) on a dedicated executor so
+    they never block the event loop. At most `max_concurrency` calls run at once; the rest wait
+    on a semaphore, and at most `max_queue` may wait (0 = unbounded).
+    """
+
+    def __init__(self, name: str, executor: Executor, max_concurrency: int, max_queue: int = 0):
+        self.name = name
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        # Calls whose caller timed out but that are still running in the executor; they keep
+        # their slot until they actually finish
+        self.overrunning = 0
+        self.timed_out = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_waiting_seen = 0
+        self.total_wait_s = 0.0
+        self.total_run_s = 0.0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        return await self._run(None, fn, args, kwargs)
+
+    async def run_limited(self, timeout: float, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Like `run`, but raises asyncio.TimeoutError if the call itself takes longer than
+        `timeout` seconds. The clock starts once it is running, not while it waits for a slot.
+        """
+        return await self._run(timeout, fn, args, kwargs)
+
+    async def _run(self, timeout: Optional[float], fn: Callable, args, kwargs) -> Any:
+        if self.max_queue and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise PoolSaturated(f"{self.name} queue is full ({self.waiting} waiting)")
+
+        loop = asyncio.get_running_loop()
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting_seen = max(self.max_waiting_seen, self.waiting)
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+
+        started_at = time.perf_counter()
+        self.total_wait_s += started_at - queued_at
+        self.in_flight += 1
+        try:
+            job = self.executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self.in_flight -= 1
+            self.failed += 1
+            self._sem.release()
+            raise
+        # The slot is given back when the job really ends, not when its caller stops waiting:
+        # a timed-out call still occupies an executor worker
+        call = {"overrun": False}
+        job.add_done_callback(lambda _: self._call_soon(loop, self._settle, call, started_at))
+        try:
+            future = asyncio.wrap_future(job)
+            if timeout is None:
+                return await future
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.failed += 1
+            self.timed_out += 1
+            if not job.done():
+                call["overrun"] = True
+                self.in_flight -= 1
+                self.overrunning += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+
+    @staticmethod
+    def _call_soon(loop: asyncio.AbstractEventLoop, fn: Callable, *args):
+        # Done callbacks run on the executor's thread; the counters belong to the loop
+        try:
+            loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            pass  # loop already closed (shutdown)
+
+    def _settle(self, call: dict, started_at: float):
+        if call["overrun"]:
+            self.overrunning -= 1
+        else:
+            self.in_flight -= 1
+        self.completed += 1
+        self.total_run_s += time.perf_counter() - started_at
+        self._sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        done = self.completed or 1
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "overrunning": self.overrunning,
+            "timed_out": self.timed_out,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "max_waiting_seen": self.max_waiting_seen,
+            "avg_wait_ms": round(1000 * self.total_wait_s / done, 2),
+            "avg_run_ms": round(1000 * self.total_run_s / done, 2),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pools: Dict[str, UpstreamPool] = {}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def gemini_pool() -> UpstreamPool:
+    """
+    Thread pool for Gemini SDK calls (I/O bound, so threads are enough).
+      GEMINI_MAX_CONCURRENCY  calls in flight per worker (default 32)
+      GEMINI_MAX_QUEUE        max calls waiting for a slot (default 0 = unbounded)
+    """
+    pool = _pools.get("gemini")
+    if pool is None:
+        size = _env_int("GEMINI_MAX_CONCURRENCY", 32)
+        pool = UpstreamPool(
+            "gemini",
+            ThreadPoolExecutor(max_workers=size, thread_name_prefix="gemini"),
+            max_concurrency=size,
+            max_queue=_env_int("GEMINI_MAX_QUEUE", 0),
+        )
+        _pools["gemini"] = pool
+    return pool
+
+
+async def run_gemini(fn: Callable, *args, **kwargs) -> Any:
+    return await gemini_pool().run(fn, *args, **kwargs)
+
+
+async def stream_gemini(fn: Callable, *args, **kwargs):
+    """
+    Call a blocking function that returns an iterator (e.g. `generate_content(..., stream=True)`)
+    on the Gemini pool and yield its items on the event loop as they arrive.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for item in fn(*args, **kwargs):
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, ("item", item))
+        except Exception as e:
+            if stop.is_set():
+                logger.warning("gemini stream failed after its consumer left: %r", e)
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+
+    def not_started(t: asyncio.Future):
+        # The pool refused or failed the job before `pump` ran (PoolSaturated, say): nothing
+        # else will ever be queued, so hand the error to the consumer instead of leaving it waiting
+        if not t.cancelled() and t.exception() is not None:
+            queue.put_nowait(("error", t.exception()))
+
+    def pump_finished(t: asyncio.Future):
+        # The consumer left before the pump did, so nobody else will see how it ended
+        if not t.cancelled() and t.exception() is not None:
+            logger.warning("gemini stream pump failed after its consumer left: %r", t.exception())
+
+    task = asyncio.ensure_future(gemini_pool().run(pump))
+    task.add_done_callback(not_started)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "done":
+                break
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        # Consumer went away (client disconnected) or we finished: stop pulling chunks. The pump
+        # may be blocked waiting on the next chunk, so don't wait for it here; it exits (and
+        # gives back its pool slot) as soon as that chunk arrives
+        stop.set()
+        if not task.done():
+            task.add_done_callback(pump_finished)
+
+
+def register_pool(pool: UpstreamPool):
+    """
+    Make a pool owned elsewhere (e.g. the OCR engine) visible in `pool_stats`.
+    """
+    _pools[pool.name] = pool
+
+
+def pool_stats(name: Optional[str] = None) -> Dict[str, Any]:
+    if name is not None:
+        return _pools[name].stats() if name in _pools else {}
+    return {pool_name: pool.stats() for pool_name, pool in _pools.items()}
+
+
+def shutdown_pools():
+    for pool in _pools.values():
+        pool.shutdown()
+    _pools.clear()
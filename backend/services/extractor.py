@@ -0,0 +1,647 @@
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.executor import UpstreamPool, register_pool
+from services.label_parser import DEFAULT_RULES_PATH, LabelParser
+
+# A small local model for label fields, for when the regex parse isn't good enough to answer
+# on its own and before paying for Gemini. Two linear-chain taggers:
+#   lines   each OCR line gets a role (NAME, INSTR, WARN, SIDE, OTHER)
+#   tokens  the words of each line get BIO tags for name / generic / dose / freq spans
+# Both are averaged structured perceptrons decoded with Viterbi: the decoding of a linear-chain
+# CRF, trained with perceptron updates, in plain Python (no numpy or ONNX at inference).
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "label_corpus.txt")
+DEFAULT_WEIGHTS_PATH = os.path.join(os.path.dirname(__file__), "data", "extractor_weights.json")
+
+LINE_ROLES = ("NAME", "INSTR", "WARN", "SIDE", "OTHER")
+SPAN_TYPES = ("name", "generic", "dose", "freq")
+TOKEN_TAGS = ("O",) + tuple(f"{prefix}-{span}" for span in SPAN_TYPES for prefix in "BI")
+
+_TOKEN_RX = re.compile(r"\w[\w./%'+-]*|[^\w\s]")
+_MARKUP_RX = re.compile(r"\[(" + "|".join(SPAN_TYPES) + r") ([^\]]*)\]")
+_SHAPE_RX = ((re.compile(r"[A-Z]+"), "A"), (re.compile(r"[a-z]+"), "a"), (re.compile(r"[0-9]+"), "9"))
+# Letters and digits OCR swaps for each other, folded so "25O" and "250" look alike
+_OCR_FOLD = str.maketrans("0o1il5s8b", "ooiiissbb")
+
+
+class StructuredPerceptron:
+    """
+    Averaged structured perceptron over a label sequence (Collins, 2002). Training decodes
+    each example with Viterbi and, where the best sequence differs from the gold one, adds
+    the gold features and transitions and subtracts the predicted ones. Averaging the weights
+    over all updates keeps the late, noisy updates from dominating.
+    """
+
+    def __init__(self, labels: Sequence[str], weights: Optional[Dict[str, List[float]]] = None,
+                 transitions: Optional[List[List[float]]] = None):
+        self.labels = list(labels)
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        n = len(self.labels)
+        self.weights: Dict[str, List[float]] = weights or {}
+        # transitions[prev][label]; row n is the start of the sequence
+        self.transitions: List[List[float]] = transitions or [[0.0] * n for _ in range(n + 1)]
+
+    def _emissions(self, features: List[str]) -> List[float]:
+        out = [0.0] * len(self.labels)
+        weights = self.weights
+        for f in features:
+            w = weights.get(f)
+            if w is not None:
+                for i, v in enumerate(w):
+                    out[i] += v
+        return out
+
+    def decode(self, sequence: List[List[str]]) -> List[int]:
+        if not sequence:
+            return []
+        n = len(self.labels)
+        trans = self.transitions
+        emit = self._emissions(sequence[0])
+        score = [trans[n][j] + emit[j] for j in range(n)]
+        back: List[List[int]] = []
+        for features in sequence[1:]:
+            emit = self._emissions(features)
+            ptr, nxt = [0] * n, [0.0] * n
+            for j in range(n):
+                best_i, best = 0, score[0] + trans[0][j]
+                for i in range(1, n):
+                    s = score[i] + trans[i][j]
+                    if s > best:
+                        best_i, best = i, s
+                ptr[j] = best_i
+                nxt[j] = best + emit[j]
+            back.append(ptr)
+            score = nxt
+        last = max(range(n), key=score.__getitem__)
+        path = [last]
+        for ptr in reversed(back):
+            last = ptr[last]
+            path.append(last)
+        path.reverse()
+        return path
+
+    def train(self, examples: List[Tuple[List[List[str]], List[str]]], epochs: int = 10, seed: int = 0) -> "StructuredPerceptron":
+        n = len(self.labels)
+        weights: Dict[str, List[float]] = {}
+        totals: Dict[str, List[float]] = {}
+        stamps: Dict[str, List[int]] = {}
+        trans = [[0.0] * n for _ in range(n + 1)]
+        trans_totals = [[0.0] * n for _ in range(n + 1)]
+        trans_stamps = [[0] * n for _ in range(n + 1)]
+        self.weights, self.transitions = weights, trans
+        step = 0
+
+        def update(feature: str, label: int, delta: float):
+            w = weights.get(feature)
+            if w is None:
+                w = weights[feature] = [0.0] * n
+                totals[feature] = [0.0] * n
+                stamps[feature] = [0] * n
+            totals[feature][label] += (step - stamps[feature][label]) * w[label]
+            stamps[feature][label] = step
+            w[label] += delta
+
+        def update_trans(prev: int, label: int, delta: float):
+            trans_totals[prev][label] += (step - trans_stamps[prev][label]) * trans[prev][label]
+            trans_stamps[prev][label] = step
+            trans[prev][label] += delta
+
+        order = list(range(len(examples)))
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(order)
+            for k in order:
+                step += 1
+                sequence, gold_labels = examples[k]
+                gold = [self.index[label] for label in gold_labels]
+                guess = self.decode(sequence)
+                if guess == gold:
+                    continue
+                prev_g = prev_p = n
+                for features, g, p in zip(sequence, gold, guess):
+                    if g != p:
+                        for f in features:
+                            update(f, g, 1.0)
+                            update(f, p, -1.0)
+                    if (prev_g, g) != (prev_p, p):
+                        update_trans(prev_g, g, 1.0)
+                        update_trans(prev_p, p, -1.0)
+                    prev_g, prev_p = g, p
+
+        # Average, and drop features that ended up (close to) zero everywhere
+        step += 1
+        averaged: Dict[str, List[float]] = {}
+        for feature, w in weights.items():
+            avg = [round((totals[feature][i] + (step - stamps[feature][i]) * w[i]) / step, 3) for i in range(n)]
+            if any(avg):
+                averaged[feature] = avg
+        self.weights = averaged
+        self.transitions = [
+            [round((trans_totals[p][j] + (step - trans_stamps[p][j]) * trans[p][j]) / step, 3) for j in range(n)]
+            for p in range(n + 1)
+        ]
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"labels": self.labels, "transitions": self.transitions, "weights": self.weights}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StructuredPerceptron":
+        return cls(data["labels"], data["weights"], data["transitions"])
+
+
+def tokenize(line: str) -> List[Tuple[str, int, int]]:
+    return [(m.group(0), m.start(), m.end()) for m in _TOKEN_RX.finditer(line)]
+
+
+def _shape(token: str) -> str:
+    for rx, ch in _SHAPE_RX:
+        token = rx.sub(ch, token)
+    return token[:6]
+
+
+def _bucket(value: int, edges: Sequence[int]) -> int:
+    for i, edge in enumerate(edges):
+        if value <= edge:
+            return i
+    return len(edges)
+
+
+def _hits(rx, line: str) -> List[Tuple[int, int]]:
+    return [m.span() for m in rx.finditer(line)] if rx is not None else []
+
+
+class LabelExtractor:
+    """
+    Medication fields from OCR text with the two taggers. `extract` returns the same dict
+    shape as the regex parser (label_parser.LabelParser.parse), so it is a drop-in upgrade.
+    The regex parser's keyword families are reused as features.
+    """
+
+    def __init__(self, lines: StructuredPerceptron, tokens: StructuredPerceptron, rules: Optional[LabelParser] = None):
+        self.lines = lines
+        self.tokens = tokens
+        self.rules = rules or LabelParser.from_file(DEFAULT_RULES_PATH)
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_WEIGHTS_PATH, rules_path: str = DEFAULT_RULES_PATH) -> "LabelExtractor":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            StructuredPerceptron.from_dict(data["lines"]),
+            StructuredPerceptron.from_dict(data["tokens"]),
+            LabelParser.from_file(rules_path),
+        )
+
+    def save(self, path: str = DEFAULT_WEIGHTS_PATH):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"lines": self.lines.to_dict(), "tokens": self.tokens.to_dict()}, f, separators=(",", ":"))
+
+    # --- features ---
+
+    def line_features(self, lines: List[str]) -> List[List[str]]:
+        rules = self.rules
+        out = []
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            words = [w.lower().strip(".,:;") for w, _, _ in tokenize(line) if w[0].isalnum()]
+            letters = [ch for ch in line if ch.isalpha()]
+            upper = sum(ch.isupper() for ch in letters) / len(letters) if letters else 0.0
+            f = [
+                "bias",
+                f"idx={min(i, 4)}",
+                f"nwords={_bucket(len(words), (1, 2, 3, 6, 10))}",
+                f"upper={_bucket(int(10 * upper), (2, 5, 8))}",
+            ]
+            if i == last:
+                f.append("last")
+            if words:
+                f.append("first_w=" + words[0])
+                if len(words) > 1:
+                    f.append("first2=" + " ".join(words[:2]))
+            f.extend("w=" + w for w in set(words))
+            if rules.bullet_rx.match(line):
+                f.append("bullet")
+            if ":" in line:
+                f.append("colon=" + line.split(":", 1)[0].strip().lower()[:20])
+            if any(ch.isdigit() for ch in line):
+                f.append("digit")
+            if rules.dosage_rx is not None and rules.dosage_rx.search(line):
+                f.append("dose_rx")
+                f.append(f"dose_rx|idx={min(i, 4)}")
+            if rules.frequency_rx is not None and rules.frequency_rx.search(line):
+                f.append("freq_rx")
+            for field, rx in rules.line_rx.items():
+                if rx.search(line):
+                    f.append("rx=" + field)
+            out.append(f)
+        return out
+
+    def token_features(self, line: str, tokens: List[Tuple[str, int, int]], role: str, line_no: int) -> List[List[str]]:
+        rules = self.rules
+        dose = _hits(rules.dosage_rx, line)
+        freq = _hits(rules.frequency_rx, line)
+        lower = [t.lower() for t, _, _ in tokens]
+        out = []
+        for i, (token, start, end) in enumerate(tokens):
+            w = lower[i].rstrip(".")
+            shape = _shape(token)
+            f = [
+                "bias",
+                "w=" + w,
+                "fold=" + w.translate(_OCR_FOLD),
+                "shape=" + shape,
+                "p3=" + w[:3],
+                "s3=" + w[-3:],
+                "role=" + role,
+                "role|shape=" + role + "|" + shape,
+                f"pos={min(i, 3)}",
+                "w-1=" + (lower[i - 1] if i else "<s>"),
+                "w+1=" + (lower[i + 1] if i + 1 < len(tokens) else "</s>"),
+                "shape-1=" + (_shape(tokens[i - 1][0]) if i else "<s>"),
+                "shape+1=" + (_shape(tokens[i + 1][0]) if i + 1 < len(tokens) else "</s>"),
+            ]
+            if line_no == 0:
+                f.append("line0")
+            if any(s <= start < e for s, e in dose):
+                f.append("in_dose_rx")
+            if any(s <= start < e for s, e in freq):
+                f.append("in_freq_rx")
+            if i and lower[i - 1] == "(":
+                f.append("after_paren")
+            out.append(f)
+        return out
+
+    # --- inference ---
+
+    def extract(self, text: str) -> Dict[str, Any]:
+        out = {
+            "medicationName": "",
+            "genericName": "",
+            "dosage": "",
+            "frequency": "",
+            "instructions": [],
+            "warnings": [],
+            "sideEffects": [],
+            "plainLanguage": "",
+        }
+        lines = [l.strip() for l in (text or "").splitlines() if l.strip()]
+        if not lines:
+            return out
+        roles = [self.lines.labels[i] for i in self.lines.decode(self.line_features(lines))]
+        spans: Dict[str, List[Tuple[int, str]]] = {t: [] for t in SPAN_TYPES}
+        for n, (line, role) in enumerate(zip(lines, roles)):
+            tokens = tokenize(line)
+            tags = [self.tokens.labels[i] for i in self.tokens.decode(self.token_features(line, tokens, role, n))]
+            for kind, value in _spans(line, tokens, tags):
+                spans[kind].append((n, value))
+            if role == "INSTR":
+                out["instructions"].append(line)
+            elif role == "WARN":
+                out["warnings"].append(line)
+            elif role == "SIDE":
+                out["sideEffects"].append(line)
+
+        # Prefer spans on the line tagged as the name line; labels repeat the name elsewhere
+        name_lines = {n for n, role in enumerate(roles) if role == "NAME"}
+        for kind, field in (("name", "medicationName"), ("generic", "genericName"), ("dose", "dosage"), ("freq", "frequency")):
+            found = sorted(spans[kind], key=lambda s: (s[0] not in name_lines if kind != "freq" else False, s[0]))
+            if found:
+                out[field] = found[0][1]
+
+        head = " ".join(v for v in (out["medicationName"], out["dosage"]) if v)
+        first = out["instructions"][0] if out["instructions"] else ""
+        out["plainLanguage"] = f"{head}: {first}" if head and first else (head or first or lines[0])
+        return out
+
+    def extract_many(self, texts: Iterable[str]) -> List[Dict[str, Any]]:
+        return [self.extract(t) for t in texts]
+
+
+def _spans(line: str, tokens: List[Tuple[str, int, int]], tags: List[str]) -> List[Tuple[str, str]]:
+    # BIO tags -> (span type, text as printed on the line)
+    out = []
+    kind, start, end = None, 0, 0
+    for (_, s, e), tag in zip(tokens, tags):
+        if tag.startswith("I-") and kind == tag[2:]:
+            end = e
+            continue
+        if kind is not None:
+            out.append((kind, line[start:end]))
+            kind = None
+        if tag != "O":
+            kind, start, end = tag[2:], s, e
+    if kind is not None:
+        out.append((kind, line[start:end]))
+    return out
+
+
+# --- corpus and training ---
+
+def read_corpus(path: str = DEFAULT_CORPUS_PATH) -> List[List[Tuple[str, str, List[Tuple[str, int, int]]]]]:
+    """
+    Parse the labelled corpus: blocks separated by "---", one "<ROLE> <text>" per line, with
+    spans marked inline as [name ...], [generic ...], [dose ...] or [freq ...]. Returns each
+    label as [(role, plain text, [(span type, start, end)])].
+    """
+    labels, current = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            raw = raw.rstrip("\n")
+            if not raw.strip() or raw.startswith("#"):
+                continue
+            if raw.strip() == "---":
+                if current:
+                    labels.append(current)
+                current = []
+                continue
+            role, _, marked = raw.partition(" ")
+            if role not in LINE_ROLES:
+                raise ValueError(f"unknown line role {role!r} in {raw!r}")
+            plain, spans, pos = "", [], 0
+            for m in _MARKUP_RX.finditer(marked):
+                plain += marked[pos:m.start()]
+                spans.append((m.group(1), len(plain), len(plain) + len(m.group(2))))
+                plain += m.group(2)
+                pos = m.end()
+            plain += marked[pos:]
+            current.append((role, plain.strip(), spans))
+    if current:
+        labels.append(current)
+    return labels
+
+
+def _gold_tags(tokens: List[Tuple[str, int, int]], spans: List[Tuple[str, int, int]]) -> List[str]:
+    tags = ["O"] * len(tokens)
+    for kind, s, e in spans:
+        inside = [i for i, (_, ts, te) in enumerate(tokens) if ts >= s and te <= e]
+        for k, i in enumerate(inside):
+            tags[i] = ("B-" if k == 0 else "I-") + kind
+    return tags
+
+
+def train(corpus: List, rules: Optional[LabelParser] = None, epochs: int = 12, seed: int = 0) -> LabelExtractor:
+    """
+    Fit both taggers on a labelled corpus (see read_corpus). The token tagger is trained on
+    gold line roles; at inference it sees predicted ones, which are right almost always.
+    """
+    model = LabelExtractor(StructuredPerceptron(LINE_ROLES), StructuredPerceptron(TOKEN_TAGS), rules)
+    line_examples, token_examples = [], []
+    for label in corpus:
+        lines = [text for _, text, _ in label]
+        line_examples.append((model.line_features(lines), [role for role, _, _ in label]))
+        for n, (role, text, spans) in enumerate(label):
+            tokens = tokenize(text)
+            if tokens:
+                token_examples.append((model.token_features(text, tokens, role, n), _gold_tags(tokens, spans)))
+    model.lines.train(line_examples, epochs=epochs, seed=seed)
+    model.tokens.train(token_examples, epochs=epochs, seed=seed)
+    return model
+
+
+def gold_fields(label) -> Dict[str, Any]:
+    # The fields a perfect extraction of a corpus label would return (for evaluation)
+    out: Dict[str, Any] = {"instructions": [], "warnings": [], "sideEffects": []}
+    fields = {"name": "medicationName", "generic": "genericName", "dose": "dosage", "freq": "frequency"}
+    roles = {"INSTR": "instructions", "WARN": "warnings", "SIDE": "sideEffects"}
+    for role, text, spans in label:
+        if role in roles:
+            out[roles[role]].append(text)
+        for kind, s, e in spans:
+            out.setdefault(fields[kind], text[s:e])
+    for field in fields.values():
+        out.setdefault(field, "")
+    return out
+
+
+def evaluate(parse, corpus: List) -> Dict[str, float]:
+    """
+    Share of labels where `parse(text)` gets each field exactly right (case and surrounding
+    whitespace ignored; list fields must match line for line).
+    """
+    def norm(value):
+        if isinstance(value, list):
+            return [norm(v) for v in value]
+        return " ".join(str(value or "").lower().split())
+
+    fields = ("medicationName", "genericName", "dosage", "frequency", "instructions", "warnings", "sideEffects")
+    right = {f: 0 for f in fields}
+    for label in corpus:
+        gold = gold_fields(label)
+        got = parse("\n".join(text for _, text, _ in label))
+        for f in fields:
+            right[f] += norm(got.get(f)) == norm(gold[f])
+    return {f: round(right[f] / len(corpus), 3) for f in fields} if corpus else {}
+
+
+# --- serving ---
+
+# Per-process model, loaded once by `_init_worker` in each extractor worker process
+_model: Optional[LabelExtractor] = None
+
+
+def _init_worker(weights_path: str, rules_path: str):
+    global _model
+    _model = LabelExtractor.from_file(weights_path, rules_path)
+
+
+def _extract_many(texts: List[str]) -> List[Dict[str, Any]]:
+    return _model.extract_many(texts)
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+class LocalExtractor:
+    """
+    Serves the extractor from a pool of worker processes (pure-Python inference would
+    otherwise hold the GIL on the event loop). Single requests that arrive within `batch_wait`
+    seconds of each other are sent to a worker as one batch, up to `batch_size`, so a burst
+    costs one round trip per batch rather than one per scan. With `workers=0` the model runs
+    in a thread of this process instead.
+    """
+
+    def __init__(self, weights_path: str = DEFAULT_WEIGHTS_PATH, rules_path: str = DEFAULT_RULES_PATH,
+                 workers: int = 1, batch_size: int = 16, batch_wait: float = 0.002, enabled: bool = True):
+        self.weights_path = weights_path
+        self.rules_path = rules_path
+        self.workers = workers
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.enabled = enabled and os.path.exists(weights_path)
+        self.batches = 0
+        self.extracted = 0
+        self._pool: Optional[UpstreamPool] = None
+        self._local: Optional[LabelExtractor] = None
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle = None
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "LocalExtractor":
+        """
+          EXTRACTOR_ENABLED       "0" to skip the local model (default 1)
+          EXTRACTOR_WEIGHTS_PATH  trained weights (default services/data/extractor_weights.json)
+          EXTRACTOR_WORKERS       worker processes (default 1; 0 runs it in a thread)
+          EXTRACTOR_BATCH_SIZE    most scans per batch (default 16)
+          EXTRACTOR_BATCH_WAIT_MS how long a scan waits for others to batch with (default 2)
+        """
+        return cls(
+            weights_path=os.getenv("EXTRACTOR_WEIGHTS_PATH", DEFAULT_WEIGHTS_PATH),
+            rules_path=os.getenv("LABEL_RULES_PATH", DEFAULT_RULES_PATH),
+            workers=int(os.getenv("EXTRACTOR_WORKERS", "1")),
+            batch_size=int(os.getenv("EXTRACTOR_BATCH_SIZE", "16")),
+            batch_wait=float(os.getenv("EXTRACTOR_BATCH_WAIT_MS", "2")) / 1000,
+            enabled=os.getenv("EXTRACTOR_ENABLED", "1") == "1",
+        )
+
+    def start(self) -> "LocalExtractor":
+        """
+        Load the model (in each worker process, or here with workers=0) so the first scan
+        doesn't pay for it.
+        """
+        if not self.enabled:
+            return self
+        with self._start_lock:
+            if self.workers <= 0:
+                if self._local is None:
+                    self._local = LabelExtractor.from_file(self.weights_path, self.rules_path)
+            elif self._pool is None:
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.weights_path, self.rules_path),
+                )
+                for f in [executor.submit(_worker_pid) for _ in range(self.workers)]:
+                    f.result()
+                self._pool = UpstreamPool("extractor", executor, max_concurrency=self.workers)
+                register_pool(self._pool)
+        return self
+
+    @property
+    def started(self) -> bool:
+        return self._pool is not None or self._local is not None
+
+    async def extract(self, text: str) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_wait, self._flush)
+        return await future
+
+    async def extract_many(self, texts: Sequence[str]) -> List[Dict[str, Any]]:
+        # Already a batch: no need to wait for company
+        results: List[Dict[str, Any]] = []
+        for i in range(0, len(texts), self.batch_size):
+            results.extend(await self._run(list(texts[i:i + self.batch_size])))
+        return results
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._deliver(batch))
+
+    async def _deliver(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            results = await self._run([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self, texts: List[str]) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        if not self.started:
+            await loop.run_in_executor(None, self.start)
+        self.batches += 1
+        self.extracted += len(texts)
+        if self._pool is not None:
+            return await self._pool.run(_extract_many, texts)
+        return await loop.run_in_executor(None, self._local.extract_many, texts)
+
+    def stats(self) -> Dict[str, Any]:
+        out = self._pool.stats() if self._pool is not None else {}
+        out.update({
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "batches": self.batches,
+            "extracted": self.extracted,
+            "avg_batch": round(self.extracted / self.batches, 2) if self.batches else 0.0,
+        })
+        return out
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+_extractor: Optional[LocalExtractor] = None
+
+
+def get_extractor() -> LocalExtractor:
+    global _extractor
+    if _extractor is None:
+        _extractor = LocalExtractor.from_env()
+    return _extractor
+
+
+def extractor_started() -> bool:
+    return _extractor is not None and _extractor.started
+
+
+def main():
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(description="Train or evaluate the local label extractor.")
+    ap.add_argument("command", choices=("train", "eval"))
+    ap.add_argument("--corpus", default=DEFAULT_CORPUS_PATH)
+    ap.add_argument("--weights", default=DEFAULT_WEIGHTS_PATH)
+    ap.add_argument("--epochs", type=int, default=12)
+    ap.add_argument("--holdout", type=float, default=0.2, help="share of labels kept out of training for eval")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    from services.label_parser import heuristic_parse
+
+    corpus = read_corpus(args.corpus)
+    shuffled = corpus[:]
+    random.Random(args.seed).shuffle(shuffled)
+    cut = int(len(shuffled) * (1 - args.holdout))
+    train_set, test_set = shuffled[:cut], shuffled[cut:]
+    if args.command == "train":
+        started = time.perf_counter()
+        held = train(train_set, epochs=args.epochs, seed=args.seed)
+        print(f"held-out ({len(test_set)} labels)  model:     {evaluate(held.extract, test_set)}")
+        print(f"held-out ({len(test_set)} labels)  heuristic: {evaluate(heuristic_parse, test_set)}")
+        # The shipped weights are fit on everything
+        model = train(corpus, epochs=args.epochs, seed=args.seed)
+        model.save(args.weights)
+        print(f"trained on {len(corpus)} labels in {time.perf_counter() - started:.1f}s "
+              f"({len(model.lines.weights)} line / {len(model.tokens.weights)} token features) -> {args.weights}")
+    else:
+        model = LabelExtractor.from_file(args.weights)
+        print(f"model:     {evaluate(model.extract, corpus)}")
+        print(f"heuristic: {evaluate(heuristic_parse, corpus)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,250 +1,435 @@
-import google.generativeai as genai
-import base64
 import os
-import json
-import re
-from typing import Any, Optional
-from dotenv import load_dotenv
+import asyncio
+import time
+from typing import Any, Optional, Tuple
+from services import clients
+from services.images import ScanImage
+from services.executor import run_gemini
+from services.resilience import CircuitOpen, call_gemini, call_gemini_stream, gemini_available, google_exceptions
+from services.ocr import get_engine
+from services.extractor import get_extractor
+from services.cache import content_key
+from services.label_parser import heuristic_parse
+from services import drug_names, metrics, nutrition, preprocess, routing
+from services.json_extract import JsonStream, extract_json
+from services.pipeline import CPU, GEMINI, OCR, POOL, THREAD, UPSTREAM, Pipeline, ScanContext, Stage, get_pipeline_engine
+from services.schemas import MEDICATION_FIELDS, Medication, coerce_field
+
+# Food and meds scans are pipelines on the same engine (services/pipeline.py): the stages
+# below are declared once, with their cost, cacheability and concurrency class, and each
+# pipeline's flow decides which of them a scan needs.
+
+MEDS_FIELDS_SCHEMA = (
+    "{\n"
+    "  \"medicationName\": string,\n"
+    "  \"genericName\": string,\n"
+    "  \"dosage\": string,\n"
+    "  \"frequency\": string,\n"
+    "  \"instructions\": [string],\n"
+    "  \"warnings\": [string],\n"
+    "  \"sideEffects\": [string],\n"
+    "  \"plainLanguage\": string\n"
+    "}\n"
+)
+
+# Prompt Gemini to output strict JSON with the fields we expect.
+MEDS_IMAGE_PROMPT = (
+    "You are given an image of a medication label. Extract the following fields and return ONLY a JSON object:\n"
+    + MEDS_FIELDS_SCHEMA
+    + "If any field is missing, return an empty string or empty list for that field. Output valid JSON only."
+)
+
+MEDS_BATCH_PROMPT = (
+    "You are given {n} images of medication labels, in order. For EACH image extract the following fields "
+    "and return ONLY a JSON array containing exactly {n} objects, one per image, in the same order as the images:\n"
+    + MEDS_FIELDS_SCHEMA
+    + "If any field is missing, return an empty string or empty list for that field. Output valid JSON only."
+)
+
+# The model only names the foods and portions; nutrient values come from services/data/nutrition.csv
+FOOD_ITEMS_SCHEMA = "{\"items\": [{\"name\": string, \"portion\": string, \"grams\": number}]}\n"
+
+FOOD_PROMPT = (
+    "Identify the food in this image. Return ONLY a JSON object:\n"
+    + FOOD_ITEMS_SCHEMA
+    + "One item per distinct food, using a plain generic name (e.g. \"banana\", \"white rice\"), the visible "
+    "portion in household terms, and your estimate of its weight in grams. Output valid JSON only."
+)
+
+FOOD_BATCH_PROMPT = (
+    "You are given {n} images of food, in order. For EACH image identify the food and return ONLY a JSON array "
+    "containing exactly {n} objects, one per image, in the same order as the images:\n"
+    + FOOD_ITEMS_SCHEMA
+    + "One item per distinct food, using a plain generic name, the visible portion in household terms, and "
+    "your estimate of its weight in grams. Output valid JSON only."
+)
+
+# How many images to pack into one multi-image Gemini call on the batch endpoints
+BATCH_IMAGES_PER_CALL = int(os.getenv("GEMINI_BATCH_IMAGES", "4"))
+
+MEDS_TEXT_PROMPT = (
+    "You are given extracted text from a medication label. "
+    "Extract the following fields and return ONLY a JSON object with these keys:\n"
+    + MEDS_FIELDS_SCHEMA
+    + "If a field is missing, return an empty string or empty list. Output valid JSON only.\n\n"
+    "Here is the extracted text:\n\n"
+)
+
+
+def parse_medication(raw_text: str) -> Optional[dict]:
+    """
+    Extract the medication object from a model reply (prose and code fences allowed) and
+    validate it against the Medication schema. None if the reply holds no such object.
+    """
+    med = Medication.from_raw(extract_json(raw_text, dict))
+    return med.to_dict() if med is not None else None
+
+
+def _response_text(response) -> Tuple[str, Optional[dict]]:
+    """
+    The reply text and, only when `.text` is unusable (blocked or empty), the response as a
+    dict for diagnostics. Returns (raw_text, resp_dict or None).
+    """
+    try:
+        text = getattr(response, "text", None)
+        if isinstance(text, str) and text.strip():
+            return text, None
+    except Exception:
+        pass
+    try:
+        resp_dict = response.to_dict()
+    except Exception:
+        resp_dict = None
+    # Fallback: search the response dict for any string content, then the repr
+    found = _find_first_string(resp_dict) if resp_dict is not None else None
+    if not found:
+        try:
+            found = str(response)
+        except Exception:
+            found = ""
+    return found, resp_dict
+
 
-# Load environment variables from .env file
-load_dotenv()
+# Helper: find the first non-empty string in nested structures
+def _find_first_string(obj: Any) -> Optional[str]:
+    if obj is None:
+        return None
+    if isinstance(obj, str):
+        s = obj.strip()
+        return s if s else None
+    if isinstance(obj, list):
+        for item in obj:
+            found = _find_first_string(item)
+            if found:
+                return found
+    if isinstance(obj, dict):
+        for v in obj.values():
+            found = _find_first_string(v)
+            if found:
+                return found
+    return None
+
+
+# --- Stages ---
+
+def _preprocess(*profiles: str):
+    """
+    Downscale/re-encode the image for Gemini and/or binarize it for OCR (one decode for all
+    profiles; default all). The stage entry carries the per-profile byte savings.
+    """
+    def run(ctx: ScanContext, entry: dict):
+        for name in profiles or tuple(preprocess.PROFILES):
+            ctx.scan.prepared(name)
+        entry["report"] = ctx.scan.preprocess_report()
+        return entry["report"]
+    return run
 
-# Access the API key
-api_key = os.getenv("API_KEY")
 
-# You can now use api_key in your code
-# print(f"Your API Key: {api_key}")
+def _ocr_output(result: Optional[dict] = None, error: Optional[str] = None) -> dict:
+    return {"text": result["text"] if result else None, "error": error, "result": result}
 
-# Initialize Gemini client
 
-genai.configure(api_key=api_key)
+async def _ocr(ctx: ScanContext, entry: dict):
+    # OCR failures aren't raised: the flows carry on without OCR text and report the error
+    try:
+        result = await get_engine().recognize(ctx.scan.ocr_bytes())
+    except Exception as e:
+        entry["ok"] = False
+        return _ocr_output(error=str(e))
+    entry["mean_conf"] = result.get("mean_conf")
+    return _ocr_output(result)
+
+
+async def _ocr_batch(contexts, entries):
+    # One submission to the OCR pool for a whole batch
+    results = await get_engine().recognize_many([ctx.scan.ocr_bytes() for ctx in contexts])
+    outputs = []
+    for entry, result in zip(entries, results):
+        if isinstance(result, Exception):
+            entry["ok"] = False
+            outputs.append(_ocr_output(error=str(result)))
+        else:
+            entry["mean_conf"] = result.get("mean_conf")
+            outputs.append(_ocr_output(result))
+    return outputs
+
+
+def _heuristic(ctx: ScanContext, entry: dict):
+    return heuristic_parse(ctx.output("ocr")["text"] or "")
+
+
+async def _local_model(ctx: ScanContext, entry: dict):
+    # Fields from the local extractor; None when it is off or OCR found nothing
+    extractor = get_extractor()
+    text = ctx.output("ocr")["text"]
+    if not (extractor.enabled and text):
+        return None
+    try:
+        return await extractor.extract(text)
+    except Exception as e:
+        entry["ok"] = False
+        entry["error"] = str(e)
+        return None
 
-async def analyze_meds(image_path: str):
+
+async def _local_model_batch(contexts, entries):
+    # One extract_many for every scan in the batch that has OCR text
+    extractor = get_extractor()
+    texts = [ctx.output("ocr")["text"] for ctx in contexts]
+    todo = [i for i, text in enumerate(texts) if text] if extractor.enabled else []
+    outputs = [None] * len(contexts)
+    if todo:
+        try:
+            results = await extractor.extract_many([texts[i] for i in todo])
+        except Exception as e:
+            for i in todo:
+                entries[i]["ok"] = False
+                entries[i]["error"] = str(e)
+            return outputs
+        for i, result in zip(todo, results):
+            outputs[i] = result
+    return outputs
+
+
+def _merged_fields(ctx: ScanContext) -> Optional[dict]:
+    # The local model's extraction when it ran, with a name, dosage or frequency it missed
+    # taken from the regex parse; otherwise the regex parse
+    parsed = ctx.output("heuristic")
+    local = ctx.output("local_model")
+    if not local:
+        return parsed
+    merged = dict(local)
+    for key in ("medicationName", "dosage", "frequency"):
+        if not merged.get(key) and parsed and parsed.get(key):
+            merged[key] = parsed[key]
+    return merged
+
+
+def _drug_names(ctx: ScanContext, entry: dict):
+    # Correct an OCR misread of the drug name and fill genericName from the local vocabulary
+    fields = _merged_fields(ctx)
+    if os.getenv("DRUG_NAMES", "1") != "1":
+        return fields
+    out = drug_names.get_index().normalize(fields, ctx.output("ocr")["text"], report=entry)
+    entry["corrected"] = (out or {}).get("medicationName") != (fields or {}).get("medicationName")
+    return out
+
+
+def _ocr_fields(ctx: ScanContext) -> Optional[dict]:
     """
-    Send an image of medication to Gemini API.
-    Returns extracted text and plain-language explanation.
+    The fields read from the OCR text: the local model's extraction or the regex parse, with
+    the drug name checked against the vocabulary once that stage has run.
+    """
+    return ctx.output("drug_names") or _merged_fields(ctx)
+
+
+def _decide(ctx: ScanContext, entry: dict):
+    report = routing.get_router().decide(_ocr_fields(ctx), ctx.output("ocr")["result"])
+    entry["decision"] = report["decision"]
+    return report
+
+
+async def _text_model(ctx: ScanContext, entry: dict):
+    """
+    Ask a text-capable model to turn the OCR text into strict JSON.
+    Returns (parsed or None, raw model output, error).
     """
-    with open(image_path, "rb") as f:
-        image_bytes = f.read()
-    # Consolidated heuristic parser used by OCR-first and fallbacks
-    def heuristic_parse(text: str):
-        out = {
-            "medicationName": "",
-            "genericName": "",
-            "dosage": "",
-            "frequency": "",
-            "instructions": [],
-            "warnings": [],
-            "sideEffects": [],
-            "plainLanguage": "",
-        }
-        if not text:
-            return out
-
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
-        if not lines:
-            return out
-
-        out["medicationName"] = lines[0]
-
-        # Find dosage patterns
-        import re
-        dose_rx = re.search(r"(\d+\s?(mg|ml|mcg|g)\b|\d+\s?units)", text, re.I)
-        if dose_rx:
-            out["dosage"] = dose_rx.group(0)
-
-        # Frequency keywords
-        freq_rx = re.search(r"(once daily|twice daily|every \d+ (hours|hrs)|daily|every day|at bedtime|as needed|prn|weekly|monthly)", text, re.I)
-        if freq_rx:
-            out["frequency"] = freq_rx.group(0)
-
-        # Instructions: lines that look like steps or start with numbers/bullets or appear substantive
-        instr = []
-        for l in lines[1:8]:
-            if re.match(r"^\d+\.|^-|^•|^\*", l) or len(l.split()) > 3:
-                instr.append(l)
-        out["instructions"] = instr
-
-        # Warnings / side effects heuristics
-        for l in lines:
-            if re.search(r"(warning|caution|avoid|do not|risk|contraindicat)", l, re.I):
-                out["warnings"].append(l)
-            if re.search(r"(side effect|nausea|dizziness|headache|rash|allergic)", l, re.I):
-                out["sideEffects"].append(l)
-
-        # Plain language: summarize first 2 lines as plain language fallback
-        out["plainLanguage"] = " ".join(lines[:2])
-        return out
-
-    # OCR-first fast path: try extracting text locally and return immediately if we get useful fields.
-    ocr_text = None
-    ocr_error = None
     try:
-        from PIL import Image
-        import pytesseract
+        # Use default text-capable model (SDK default) which typically supports text generation
+        text_model = clients.text_model()
+        text_response = await call_gemini(text_model.generate_content, MEDS_TEXT_PROMPT + ctx.output("ocr")["text"])
+        text_raw = getattr(text_response, "text", None) or str(text_response)
+    except Exception as tex:
+        entry["ok"] = False
+        return None, None, str(tex)
+    with ctx.stage("extract_json"):
+        return parse_medication(text_raw), text_raw, None
+
+
+def _model_call(prompt: str):
+    # The multimodal call on the downscaled image; errors are raised to the flow
+    async def run(ctx: ScanContext, entry: dict):
+        return await call_gemini(clients.model().generate_content, [prompt, ctx.scan.part()])
+    return run
+
+
+def _meds_json(ctx: ScanContext, entry: dict):
+    """
+    Parse the multimodal reply into Medication fields. Returns (parsed, raw_text, resp_dict);
+    `.text` is enough almost always, and the full response dict is only built when it isn't.
+    """
+    raw_text, resp_dict = _response_text(ctx.output("multimodal"))
+    return parse_medication(raw_text) or {"plain": raw_text}, raw_text, resp_dict
+
+
+async def _food_call(ctx: ScanContext, entry: dict):
+    # Food only needs the reply text (a streamed reply is seeded as the same output)
+    response = await call_gemini(clients.model().generate_content, [FOOD_PROMPT, ctx.scan.part()])
+    return getattr(response, "text", None) or ""
+
+
+def _food_items(ctx: ScanContext, entry: dict):
+    # The {"items": [{name, portion, grams}]} list from the model's reply text
+    items = nutrition.food_items(extract_json(ctx.output("multimodal")))
+    entry["items"] = len(items)
+    return items
+
 
-        img = Image.open(image_path)
-        ocr_text = pytesseract.image_to_string(img)
-    except Exception as oe:
-        ocr_error = str(oe)
+def _nutrition_lookup(ctx: ScanContext, entry: dict):
+    items = ctx.output("extract_items")
+    return nutrition.get_table().describe(items) if items else None
 
+
+# --- Meds ---
+
+async def _ocr_text(state: ScanContext):
+    # (ocr_text, ocr_error), running OCR on the first call only
+    ocr = await state.get("ocr")
+    return ocr["text"], ocr["error"]
+
+
+async def _classify(state: ScanContext):
+    """
+    OCR locally, parse the text heuristically and score the result (once per scan).
+    The routing report is the `route` output; there is none when OCR found no text.
+    """
+    ocr_text, _ = await _ocr_text(state)
     if ocr_text:
-        heuristic_parsed = heuristic_parse(ocr_text)
-        # Consider this a successful fast path if we extracted a medication name or dosage or any instructions
-        if any([
-            heuristic_parsed.get("medicationName"),
-            heuristic_parsed.get("dosage"),
-            heuristic_parsed.get("instructions"),
-        ]):
+        await state.get("route")
+
+
+async def _route(state: ScanContext, degraded: bool = False):
+    """
+    Take the cheapest path the router allows: a confident, complete OCR read is returned
+    directly; a decent one goes to the text-only model; anything else returns None so the
+    caller makes the multimodal image call. With `degraded=True` the text model is skipped
+    (it is still a Gemini call).
+    """
+    await _classify(state)
+    route = state.output("route")
+    if route is None:
+        return None
+    ocr_text, ocr_error = await _ocr_text(state)
+    decision = route["decision"]
+    if decision == routing.OCR:
+        return {
+            "text": _ocr_fields(state),
+            "raw_output": {
+                "ocr_text": ocr_text,
+                "ocr_error": ocr_error,
+                "multimodal": None,
+            },
+            "diagnostics": {
+                "fast_path": "ocr_first",
+                "path": "local_model" if state.output("local_model") else "ocr_first",
+                "route": route,
+                "stages": state.stages,
+            },
+        }
+    if decision == routing.TEXT_MODEL and not degraded:
+        parsed, text_raw, text_error = await state.get("text_model")
+        if isinstance(parsed, dict) and routing.plausible_name(parsed.get("medicationName", "")):
             return {
-                "text": heuristic_parsed,
+                "text": parsed,
                 "raw_output": {
                     "ocr_text": ocr_text,
                     "ocr_error": ocr_error,
+                    "text_model_output": text_raw,
                     "multimodal": None,
                 },
-                "diagnostics": {
-                    "fast_path": "ocr_first",
-                },
+                "diagnostics": {"path": "text_model", "route": route, "stages": state.stages},
             }
+        routing.get_router().escalated(decision)
+    return None
 
-    # Call Gemini multimodal
-    model = genai.GenerativeModel("gemini-1.5-flash")
-
-    # Prompt Gemini to output strict JSON with the fields we expect.
-    prompt = (
-        "You are given an image of a medication label. Extract the following fields and return ONLY a JSON object:\n"
-        "{\n"
-        "  \"medicationName\": string,\n"
-        "  \"genericName\": string,\n"
-        "  \"dosage\": string,\n"
-        "  \"frequency\": string,\n"
-        "  \"instructions\": [string],\n"
-        "  \"warnings\": [string],\n"
-        "  \"sideEffects\": [string],\n"
-        "  \"plainLanguage\": string\n"
-        "}\n"
-        "If any field is missing, return an empty string or empty list for that field. Output valid JSON only."
-    )
 
-    try:
-        response = model.generate_content(
-            [
-                prompt,
-                {"mime_type": "image/jpeg", "data": image_bytes},
-            ]
-        )
-    except Exception as e:
-        # If the model name is invalid for this API version, return helpful diagnostics
-        try:
-            from google.api_core import exceptions as google_exceptions
-        except Exception:
-            google_exceptions = None
+# Why a scan was answered from OCR alone -> the path it is reported under
+_DEGRADED_PATHS = {"overload": "degraded_ocr", "circuit_open": "circuit_open", "gemini_error": "gemini_error_fallback"}
 
-        if google_exceptions and isinstance(e, google_exceptions.NotFound):
-            # Attempt to list available models using the GenerativeServiceClient
-            try:
-                from google.ai.generativelanguage_v1beta.services.generative_service import (
-                    GenerativeServiceClient,
-                )
 
-                client = GenerativeServiceClient()
-                models = [m.name for m in client.list_models()]
-            except Exception:
-                models = None
+def _degraded_result(state: ScanContext, ocr_text, ocr_error, reason: str = "overload", error: Optional[str] = None):
+    """
+    Answer with whatever the OCR heuristic found, without (further) Gemini calls: the server is
+    overloaded, the circuit breaker is open, or Gemini failed after retries. Marked `degraded`
+    so it is never cached. With no OCR text at all this is an error result.
+    """
+    parsed = _ocr_fields(state) or heuristic_parse(ocr_text or "")
+    diagnostics = {
+        "path": _DEGRADED_PATHS[reason],
+        "degraded": True,
+        "route": state.output("route"),
+        "stages": state.stages,
+    }
+    if error is not None and not any(parsed.values()):
+        diagnostics["path"] = "error"
+        return {
+            "text": {"error": error, "ocr_text": ocr_text, "ocr_error": ocr_error},
+            "raw_output": {"error": error},
+            "diagnostics": diagnostics,
+        }
+    return {
+        "text": parsed,
+        "raw_output": {"ocr_text": ocr_text, "ocr_error": ocr_error, "multimodal": None, "error": error},
+        "diagnostics": diagnostics,
+    }
 
-            # Try OCR fallback since multimodal model is not available
-            ocr_text = None
-            ocr_error = None
-            heuristic_parsed = None
-            try:
-                from PIL import Image
-                import pytesseract
-
-                img = Image.open(image_path)
-                ocr_text = pytesseract.image_to_string(img)
-            except Exception as oe:
-                ocr_error = str(oe)
-
-            # local heuristic parser
-            def _heuristic_parse(text: str):
-                import re
-                out = {
-                    "medicationName": "",
-                    "genericName": "",
-                    "dosage": "",
-                    "frequency": "",
-                    "instructions": [],
-                    "warnings": [],
-                    "sideEffects": [],
-                    "plainLanguage": "",
-                }
-                if not text:
-                    return out
-                lines = [l.strip() for l in text.splitlines() if l.strip()]
-                if not lines:
-                    return out
-                out["medicationName"] = lines[0]
-                dose_rx = re.search(r"(\d+\s?(mg|ml|mcg|g)\b|\d+\s?units)", text, re.I)
-                if dose_rx:
-                    out["dosage"] = dose_rx.group(0)
-                freq_rx = re.search(r"(once daily|twice daily|every \d+ (hours|hrs)|daily|every day|at bedtime|as needed|prn|weekly|monthly)", text, re.I)
-                if freq_rx:
-                    out["frequency"] = freq_rx.group(0)
-                instr = []
-                for l in lines[1:8]:
-                    if re.match(r"^\d+\.|^-|^•|^\*", l) or len(l.split()) > 3:
-                        instr.append(l)
-                out["instructions"] = instr
-                for l in lines:
-                    if re.search(r"(warning|caution|avoid|do not|risk|contraindicat)", l, re.I):
-                        out["warnings"].append(l)
-                    if re.search(r"(side effect|nausea|dizziness|headache|rash|allergic)", l, re.I):
-                        out["sideEffects"].append(l)
-                out["plainLanguage"] = " ".join(lines[:2])
-                return out
 
-            if ocr_text:
-                heuristic_parsed = _heuristic_parse(ocr_text)
+async def _meds_flow(state: ScanContext, degraded: bool = False):
+    """
+    ocr -> heuristic + local_model -> drug_names -> route (return the OCR fields, or the
+    text-only model's answer, when the OCR read is confident enough) -> multimodal ->
+    extract_json, with text_model fallbacks that reuse the same OCR result.
+    """
+    fast = await _route(state, degraded=degraded or not gemini_available())
+    if fast is not None:
+        return fast
+    ocr_text, ocr_error = await _ocr_text(state)
+    if degraded:
+        return _degraded_result(state, ocr_text, ocr_error)
+    if not gemini_available():
+        return _degraded_result(state, ocr_text, ocr_error, reason="circuit_open")
+    heuristic_parsed = _ocr_fields(state)
 
-            # Try calling a text-capable model on OCR text to get strict JSON
+    # Call Gemini multimodal
+    try:
+        await state.get("multimodal")
+    except Exception as e:
+        # If the model name is invalid for this API version, return helpful diagnostics
+        exceptions = google_exceptions()
+        if exceptions is not None and isinstance(e, exceptions.NotFound):
+            # List available models (cached with a TTL, so repeated NotFounds don't refetch it)
+            with state.stage("list_models"):
+                try:
+                    models = await run_gemini(clients.list_model_names)
+                except Exception:
+                    models = None
+
+            # OCR fallback since multimodal model is not available (reuses the OCR-first result)
             text_model_output = None
             text_model_error = None
             parsed_from_text = None
             if ocr_text:
-                try:
-                    text_model = genai.GenerativeModel()
-                    text_prompt = (
-                        "You are given extracted text from a medication label. "
-                        "Extract the following fields and return ONLY a JSON object with these keys:\n"
-                        "{\n"
-                        "  \"medicationName\": string,\n"
-                        "  \"genericName\": string,\n"
-                        "  \"dosage\": string,\n"
-                        "  \"frequency\": string,\n"
-                        "  \"instructions\": [string],\n"
-                        "  \"warnings\": [string],\n"
-                        "  \"sideEffects\": [string],\n"
-                        "  \"plainLanguage\": string\n"
-                        "}\n"
-                        "If a field is missing, return an empty string or empty list. Output valid JSON only.\n\n"
-                        "Here is the extracted text:\n\n"
-                    ) + ocr_text
-
-                    text_response = text_model.generate_content(text_prompt)
-                    text_model_output = getattr(text_response, "text", None) or str(text_response)
-
-                    try:
-                        parsed_from_text = json.loads(text_model_output)
-                    except Exception:
-                        m2 = re.search(r"\{[\s\S]*\}", text_model_output)
-                        if m2:
-                            try:
-                                parsed_from_text = json.loads(m2.group(0))
-                            except Exception:
-                                parsed_from_text = None
-                except Exception as tex:
-                    text_model_error = str(tex)
+                parsed_from_text, text_model_output, text_model_error = await state.get("text_model")
 
             # prefer parsed_from_text, then heuristic_parsed
             final_parsed = parsed_from_text or heuristic_parsed
@@ -262,6 +447,8 @@ async def analyze_meds(image_path: str):
                         "ocr_error": ocr_error,
                         "text_model_output": text_model_output,
                         "text_model_error": text_model_error,
+                        "path": "text_model_fallback" if parsed_from_text else "ocr_heuristic_fallback",
+                        "stages": state.stages,
                     },
                 }
             else:
@@ -275,199 +462,50 @@ async def analyze_meds(image_path: str):
                         "text_model_error": text_model_error,
                     },
                     "raw_output": {"error": str(e)},
+                    "diagnostics": {"path": "error", "stages": state.stages},
                 }
-        # Other exceptions - re-raise
-        raise
-
-    # Grab a dict representation if possible for diagnostics
-    try:
-        resp_dict = response.to_dict()
-    except Exception:
-        resp_dict = None
-
-    # Helper: find the first non-empty string in nested structures
-    def _find_first_string(obj: Any) -> Optional[str]:
-        if obj is None:
-            return None
-        if isinstance(obj, str):
-            s = obj.strip()
-            return s if s else None
-        if isinstance(obj, list):
-            for item in obj:
-                found = _find_first_string(item)
-                if found:
-                    return found
-        if isinstance(obj, dict):
-            for v in obj.values():
-                found = _find_first_string(v)
-                if found:
-                    return found
-        return None
-
-    raw_text: str = ""
-    # Preferred: response.text attribute
-    try:
-        raw_text_candidate = getattr(response, "text", None)
-        if raw_text_candidate and isinstance(raw_text_candidate, str) and raw_text_candidate.strip():
-            raw_text = raw_text_candidate
-    except Exception:
-        raw_text = ""
-
-    # Fallback: search the response dict for any string content
-    if not raw_text and resp_dict is not None:
-        found = _find_first_string(resp_dict)
-        if found:
-            raw_text = found
-
-    # Final fallback: stringified response
-    if not raw_text:
-        try:
-            raw_text = str(response)
-        except Exception:
-            raw_text = ""
-
-    # Try to parse JSON from the model output. If parsing fails, try to extract a JSON block.
-    parsed = None
-    try:
-        parsed = json.loads(raw_text)
-    except Exception:
-        m = re.search(r"\{[\s\S]*\}", raw_text)
-        if m:
-            try:
-                parsed = json.loads(m.group(0))
-            except Exception:
-                parsed = None
+        # Anything else (breaker opened, retries exhausted, deadline hit): answer from OCR
+        reason = "circuit_open" if isinstance(e, CircuitOpen) else "gemini_error"
+        return _degraded_result(state, ocr_text, ocr_error, reason=reason, error=str(e))
 
-    if parsed is None:
-        parsed = {"plain": raw_text}
+    parsed, raw_text, resp_dict = await state.get("extract_json")
 
     # Build diagnostics summary
     diagnostics = {
-        "has_text_attr": bool(getattr(response, "text", None)),
+        "has_text_attr": resp_dict is None,
         "resp_dict_keys": list(resp_dict.keys()) if isinstance(resp_dict, dict) else None,
+        "route": state.output("route"),
+        "stages": state.stages,
     }
 
-    # If parsed JSON is only a plain text fallback or empty, attempt OCR fallback
-    ocr_text = None
-    ocr_error = None
-    heuristic_parsed = None
-
-    only_plain = parsed.keys() == {"plain"} or (isinstance(parsed, dict) and parsed.get("plain") and len(parsed.keys()) == 1)
-    if only_plain or (resp_dict is None and not raw_text):
-        try:
-            from PIL import Image
-            import pytesseract
-
-            img = Image.open(image_path)
-            ocr_text = pytesseract.image_to_string(img)
-        except Exception as e:
-            ocr_error = str(e)
-
-        # Simple heuristic parser for medication fields from OCR text
-        def heuristic_parse(text: str):
-            out = {
-                "medicationName": "",
-                "genericName": "",
-                "dosage": "",
-                "frequency": "",
-                "instructions": [],
-                "warnings": [],
-                "sideEffects": [],
-                "plainLanguage": "",
-            }
-            if not text:
-                return out
-
-            lines = [l.strip() for l in text.splitlines() if l.strip()]
-            if not lines:
-                return out
-
-            # First non-empty line as medication name candidate
-            out["medicationName"] = lines[0]
-
-            # Find dosage patterns
-            import re
-            dose_rx = re.search(r"(\d+\s?(mg|ml|mcg|g)\b|\d+\s?units)", text, re.I)
-            if dose_rx:
-                out["dosage"] = dose_rx.group(0)
-
-            # Frequency keywords
-            freq_rx = re.search(r"(once daily|twice daily|every \d+ (hours|hrs)|daily|every day|at bedtime|as needed|prn|weekly|monthly)", text, re.I)
-            if freq_rx:
-                out["frequency"] = freq_rx.group(0)
-
-            # Instructions: lines that look like steps or start with numbers/bullets
-            instr = []
-            for l in lines[1:8]:
-                if re.match(r"^\d+\.|^-|^•|^\*", l) or len(l.split()) > 3:
-                    instr.append(l)
-            out["instructions"] = instr
-
-            # Warnings / side effects heuristics
-            for l in lines:
-                if re.search(r"(warning|caution|avoid|do not|risk|contraindicat)", l, re.I):
-                    out["warnings"].append(l)
-                if re.search(r"(side effect|nausea|dizziness|headache|rash|allergic)", l, re.I):
-                    out["sideEffects"].append(l)
-
-            # Plain language: summarize first 2 lines as plain language fallback
-            out["plainLanguage"] = " ".join(lines[:2])
-            return out
-
-        if ocr_text:
-            heuristic_parsed = heuristic_parse(ocr_text)
-
-            # Try to call a text-capable Gemini model on the OCR text to produce strict JSON
-            try:
-                # Use default text-capable model (SDK default) which typically supports text generation
-                text_model = genai.GenerativeModel()
-                text_prompt = (
-                    "You are given extracted text from a medication label. "
-                    "Extract the following fields and return ONLY a JSON object with these keys:\n"
-                    "{\n"
-                    "  \"medicationName\": string,\n"
-                    "  \"genericName\": string,\n"
-                    "  \"dosage\": string,\n"
-                    "  \"frequency\": string,\n"
-                    "  \"instructions\": [string],\n"
-                    "  \"warnings\": [string],\n"
-                    "  \"sideEffects\": [string],\n"
-                    "  \"plainLanguage\": string\n"
-                    "}\n"
-                    "If a field is missing, return an empty string or empty list. Output valid JSON only.\n\n"
-                    "Here is the extracted text:\n\n"
-                ) + ocr_text
-
-                text_response = text_model.generate_content(text_prompt)
-                # Prefer text attribute
-                text_raw = getattr(text_response, "text", None) or str(text_response)
-
-                # Attempt to parse the model's output as JSON
-                parsed_from_text = None
-                try:
-                    parsed_from_text = json.loads(text_raw)
-                except Exception:
-                    m2 = re.search(r"\{[\s\S]*\}", text_raw)
-                    if m2:
-                        try:
-                            parsed_from_text = json.loads(m2.group(0))
-                        except Exception:
-                            parsed_from_text = None
-
-                if parsed_from_text:
-                    heuristic_parsed = parsed_from_text
-                    # include the text model raw output into diagnostics
-                    resp_dict = resp_dict or {}
-                    resp_dict["text_model_output"] = text_raw
-            except Exception as tex:
-                # If text model fails, keep heuristic_parsed and note the error in diagnostics
-                resp_dict = resp_dict or {}
-                resp_dict["text_model_error"] = str(tex)
+    # If parsed JSON is only a plain text fallback or empty, fall back to the (already computed) OCR text
+    only_plain = parsed.keys() == {"plain"} or (parsed.get("plain") and len(parsed.keys()) == 1)
+    if (only_plain or not raw_text) and ocr_text:
+        # Try to call a text-capable Gemini model on the OCR text to produce strict JSON
+        parsed_from_text, text_raw, text_error = await state.get("text_model")
+        if parsed_from_text:
+            heuristic_parsed = parsed_from_text
+            # include the text model raw output into diagnostics
+            resp_dict = resp_dict or {}
+            resp_dict["text_model_output"] = text_raw
+        elif text_error:
+            # If text model fails, keep heuristic_parsed and note the error in diagnostics
+            resp_dict = resp_dict or {}
+            resp_dict["text_model_error"] = text_error
+    elif not only_plain:
+        # The OCR heuristic only replaces a good multimodal answer when it lacks a name
+        heuristic_parsed = None
+
+    use_fallback = bool(heuristic_parsed and not parsed.get("medicationName"))
+    if use_fallback:
+        diagnostics["path"] = "text_model_fallback" if "text_model_output" in (resp_dict or {}) else "ocr_heuristic_fallback"
+    else:
+        diagnostics["path"] = "multimodal"
 
     result_obj = {
-        "text": parsed if not (heuristic_parsed and not parsed.get("medicationName")) else heuristic_parsed,
+        "text": heuristic_parsed if use_fallback else parsed,
         "raw_output": {
-            "multimodal": resp_dict if resp_dict is not None else {"repr": str(response)},
+            "multimodal": resp_dict,
             "raw_text": raw_text,
             "ocr_text": ocr_text,
             "ocr_error": ocr_error,
@@ -476,3 +514,325 @@ async def analyze_meds(image_path: str):
     }
 
     return result_obj
+
+
+# --- Food ---
+
+async def _food_answer(ctx: ScanContext, raw_text: str, raw_output: dict, path: str = "multimodal") -> dict:
+    """
+    Build the food answer from the model's {"items": [{name, portion, grams}]} reply, with
+    nutrients from the local table. A reply without usable items is passed through as text.
+    """
+    text = await ctx.get("nutrition_lookup")
+    raw_output = dict(raw_output, raw_text=raw_text)
+    diagnostics = {"path": path, "stages": ctx.stages}
+    if text is None:
+        return {"text": {"plain": raw_text}, "raw_output": raw_output, "diagnostics": diagnostics}
+    return {"text": text, "raw_output": raw_output, "diagnostics": diagnostics}
+
+
+async def _food_flow(ctx: ScanContext):
+    """
+    preprocess -> multimodal (the model names the foods and portions) -> extract_items ->
+    nutrition_lookup (nutrient values from the local table).
+    """
+    try:
+        raw_text = await ctx.get("multimodal")
+    except Exception as e:
+        return {"text": {"error": str(e)}, "raw_output": {"error": str(e)}}
+    return await _food_answer(ctx, raw_text, {"preprocess": ctx.output("preprocess")})
+
+
+MEDS = Pipeline("meds", [
+    Stage("preprocess", _preprocess(), cost=CPU, concurrency=THREAD),
+    Stage("ocr", _ocr, needs=("preprocess",), cost=CPU, cacheable=True, concurrency=OCR, batch=_ocr_batch),
+    Stage("heuristic", _heuristic, needs=("ocr",)),
+    Stage("local_model", _local_model, needs=("ocr",), cost=CPU, cacheable=True, concurrency=POOL, batch=_local_model_batch),
+    Stage("drug_names", _drug_names, needs=("ocr", "heuristic", "local_model")),
+    Stage("route", _decide, needs=("ocr", "drug_names")),
+    Stage("text_model", _text_model, needs=("ocr",), cost=UPSTREAM, concurrency=GEMINI),
+    Stage("multimodal", _model_call(MEDS_IMAGE_PROMPT), needs=("preprocess",), cost=UPSTREAM, concurrency=GEMINI),
+    Stage("extract_json", _meds_json, needs=("multimodal",)),
+], _meds_flow)
+
+FOOD = Pipeline("food", [
+    # Food has no OCR step, so only the model profile is computed
+    Stage("preprocess", _preprocess("model"), cost=CPU, concurrency=THREAD),
+    Stage("multimodal", _food_call, needs=("preprocess",), cost=UPSTREAM, concurrency=GEMINI),
+    Stage("extract_items", _food_items, needs=("multimodal",)),
+    Stage("nutrition_lookup", _nutrition_lookup, needs=("extract_items",)),
+], _food_flow)
+
+
+async def analyze_meds(image, degraded: bool = False):
+    """
+    Send an image of medication to Gemini API.
+    Returns extracted text and plain-language explanation.
+    `image` may be a ScanImage, raw bytes/memoryview, a binary buffer, a file path,
+    or a ScanContext from the MEDS pipeline (its finished stages are reused).
+
+    See _meds_flow for the stages; `diagnostics.stages` lists what ran.
+    With `degraded=True` (server overloaded), or while the Gemini circuit breaker is open, the
+    OCR heuristic result is returned as-is and Gemini is never called. Gemini errors that
+    survive retries also fall back to the OCR heuristic instead of failing the request.
+    """
+    return await MEDS.run(image, degraded=degraded)
+
+
+async def analyze_food(image):
+    """
+    Send an image of food to Gemini API to identify the foods and portions; nutrient values
+    come from the local nutrition table.
+    `image` may be a ScanImage, raw bytes/memoryview, a binary buffer, a file path or a
+    ScanContext from the FOOD pipeline.
+    """
+    return await FOOD.run(image)
+
+
+def _dedupe(images):
+    """
+    Collapse identical images. Returns (unique ScanImages, index into them for every input).
+    """
+    unique, order, seen = [], [], {}
+    for image in images:
+        scan = ScanImage.from_input(image)
+        key = content_key(scan.data)
+        if key not in seen:
+            seen[key] = len(unique)
+            unique.append(scan)
+        order.append(seen[key])
+    return unique, order
+
+
+def _chunks(items, size):
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def _multi_image_call(prompt: str, scans):
+    """
+    Send several images in one Gemini call and expect a JSON array with one entry per image.
+    Returns (entries or None if the reply doesn't line up with the images, raw text).
+    """
+    model = clients.model()
+    contents = [prompt.replace("{n}", str(len(scans)))] + [scan.part() for scan in scans]
+    response = await call_gemini(model.generate_content, contents)
+    raw_text, _ = _response_text(response)
+    entries = extract_json(raw_text, list)
+    if not isinstance(entries, list) or len(entries) != len(scans):
+        return None, raw_text
+    return entries, raw_text
+
+
+async def analyze_meds_batch(images, degraded: bool = False):
+    """
+    Analyze several medication label images. Identical images are analyzed once, OCR runs for
+    all of them in one submission, and the images that miss the OCR fast path are packed
+    BATCH_IMAGES_PER_CALL at a time into multi-image Gemini calls. Any image the packed reply
+    doesn't cover falls back to the single-image pipeline. Results are returned in input order.
+    With `degraded=True` (or the circuit breaker open) no Gemini calls are made; every image
+    gets its OCR heuristic result.
+    """
+    unique, order = _dedupe(images)
+    states = [MEDS.context(scan) for scan in unique]
+    await get_pipeline_engine().resolve_batch(states, "ocr")
+    await get_pipeline_engine().resolve_batch(states, "local_model")
+
+    # Routing may call the text-only model, so route every image concurrently
+    reason = "overload" if degraded else (None if gemini_available() else "circuit_open")
+    routed = await asyncio.gather(*(_route(state, degraded=reason is not None) for state in states))
+    results = [None] * len(states)
+    pending = []
+    for i, (state, fast) in enumerate(zip(states, routed)):
+        if fast is not None:
+            results[i] = fast
+        elif reason is not None:
+            results[i] = _degraded_result(state, *(await _ocr_text(state)), reason=reason)
+        else:
+            pending.append(i)
+
+    async def run_chunk(indices):
+        chunk = [states[i] for i in indices]
+        entries, raw_text = None, ""
+        if len(chunk) > 1:
+            started = time.perf_counter()
+            try:
+                entries, raw_text = await _multi_image_call(MEDS_BATCH_PROMPT, [s.scan for s in chunk])
+            except Exception:
+                entries = None
+            ms = round(1000 * (time.perf_counter() - started), 2)
+            metrics.stage_seconds.observe(ms / 1000, endpoint="meds", stage="multimodal_batch")
+            for state in chunk:
+                state.stages.append({"stage": "multimodal_batch", "ok": entries is not None, "ms": ms})
+        for i, state, entry in zip(indices, chunk, entries or [None] * len(chunk)):
+            med = Medication.from_raw(entry)
+            if med is not None and med.medicationName:
+                ocr_text, ocr_error = await _ocr_text(state)
+                results[i] = {
+                    "text": med.to_dict(),
+                    "raw_output": {
+                        "multimodal": None,
+                        "raw_text": raw_text,
+                        "ocr_text": ocr_text,
+                        "ocr_error": ocr_error,
+                    },
+                    "diagnostics": {
+                        "batched_with": len(chunk),
+                        "path": "multimodal_batch",
+                        "route": state.output("route"),
+                        "stages": state.stages,
+                    },
+                }
+            else:
+                results[i] = await analyze_meds(state)
+
+    await asyncio.gather(*(run_chunk(c) for c in _chunks(pending, BATCH_IMAGES_PER_CALL)))
+    return [results[i] for i in order]
+
+
+def _food_overloaded(ctx: ScanContext) -> dict:
+    # Food has no OCR-only answer, so a degraded batch can only say "try again"
+    return {
+        "text": {"error": "server overloaded; retry this image"},
+        "raw_output": {"error": "overload"},
+        "diagnostics": {"path": "degraded_batch", "degraded": True, "stages": ctx.stages},
+    }
+
+
+async def analyze_food_batch(images, degraded: bool = False):
+    """
+    Analyze several food images, packing them into multi-image Gemini calls. Identical images
+    are analyzed once; results are returned in input order.
+    With `degraded=True` (server overloaded) images a packed reply doesn't cover are not retried
+    one by one; they get a `degraded` error result instead.
+    """
+    unique, order = _dedupe(images)
+    contexts = [FOOD.context(scan) for scan in unique]
+    results = [None] * len(unique)
+    await get_pipeline_engine().resolve_batch(contexts, "preprocess")
+
+    async def run_chunk(indices):
+        chunk = [contexts[i] for i in indices]
+        entries, raw_text = None, ""
+        if len(chunk) > 1:
+            try:
+                entries, raw_text = await _multi_image_call(FOOD_BATCH_PROMPT, [ctx.scan for ctx in chunk])
+            except Exception:
+                entries = None
+        for i, ctx, entry in zip(indices, chunk, entries or [None] * len(chunk)):
+            items = nutrition.food_items(entry)
+            if items:
+                # The packed reply already holds this image's items; only the table lookup is left
+                ctx.seed("extract_items", items)
+                results[i] = await _food_answer(ctx, raw_text, {"items": entry, "batched_with": len(chunk)}, "multimodal_batch")
+            elif degraded and len(chunk) > 1:
+                results[i] = _food_overloaded(ctx)
+            else:
+                results[i] = await analyze_food(ctx)
+
+    await asyncio.gather(*(run_chunk(c) for c in _chunks(list(range(len(unique))), BATCH_IMAGES_PER_CALL)))
+    return [results[i] for i in order]
+
+
+async def _finish_stream(state: ScanContext, raw_text: str):
+    """
+    Finish a streamed meds scan whose reply had no name (or broke off) without calling the
+    image model again: what did stream in stands in for the multimodal reply, so the regular
+    flow goes on to the text model on the OCR text and then the OCR fields.
+    """
+    # A plain str goes through _response_text as-is ("" when nothing arrived)
+    state.seed("multimodal", raw_text or "")
+    return await analyze_meds(state)
+
+
+async def stream_meds(image, refine: bool = True, degraded: bool = False):
+    """
+    Streaming variant of analyze_meds. Yields (event, data) pairs:
+      ocr          heuristic fields from OCR and the routing decision (usually well under a second)
+      field        one {name: value} per model field, as soon as the streamed reply completes it
+      result       the final analyzer result (same shape as analyze_meds)
+      diagnostics  stages that ran and their durations
+    With refine=False a confident OCR or text-model answer ends the stream without the
+    multimodal call; with degraded=True (server overloaded) or the circuit breaker open,
+    Gemini is never called.
+    """
+    state = MEDS.context(image)
+    reason = "overload" if degraded else (None if gemini_available() else "circuit_open")
+    await _classify(state)
+    ocr_text, ocr_error = await _ocr_text(state)
+    route = state.output("route")
+    yield "ocr", {
+        "fields": _ocr_fields(state),
+        "fast_path": bool(route) and route["decision"] == routing.OCR,
+        "route": route,
+        "ocr_error": ocr_error,
+    }
+    # A text-model route runs after the OCR event so the client isn't kept waiting on it
+    fast = await _route(state, degraded=reason is not None)
+
+    if reason is not None or (fast is not None and not refine):
+        yield "result", fast if fast is not None else _degraded_result(state, ocr_text, ocr_error, reason=reason)
+        yield "diagnostics", {"stages": state.stages}
+        return
+
+    await state.get("preprocess")
+    model = clients.model()
+    # Parses the reply as it streams in; each field is emitted once its value is complete
+    reply, seen = JsonStream(), set()
+    try:
+        with state.stage("multimodal_stream"):
+            async for chunk in call_gemini_stream(
+                model.generate_content, [MEDS_IMAGE_PROMPT, state.scan.part()], stream=True
+            ):
+                text = getattr(chunk, "text", None) or ""
+                for key, value in reply.feed(text):
+                    if key in MEDICATION_FIELDS and key not in seen:
+                        seen.add(key)
+                        yield "field", {key: coerce_field(key, value)}
+    except Exception as e:
+        # Streaming failed (or the breaker opened); fall back to the regular pipeline, which
+        # reuses the OCR result
+        yield "error", {"error": str(e)}
+        result = fast if fast is not None else await _finish_stream(state, reply.buffer)
+        yield "result", result
+        yield "diagnostics", {"stages": state.stages}
+        return
+
+    buffer = reply.buffer
+    with state.stage("extract_json"):
+        med = Medication.from_raw(reply.value(dict))
+        parsed = med.to_dict() if med is not None else None
+    if not isinstance(parsed, dict) or not parsed.get("medicationName"):
+        # Same rule as analyze_meds: a reply without a name loses to the OCR heuristic
+        result = fast if fast is not None else await _finish_stream(state, buffer)
+    else:
+        result = {
+            "text": parsed,
+            "raw_output": {"multimodal": None, "raw_text": buffer, "ocr_text": ocr_text, "ocr_error": ocr_error},
+            "diagnostics": {"streamed": True, "path": "multimodal_stream", "stages": state.stages},
+        }
+    yield "result", result
+    yield "diagnostics", {"stages": state.stages}
+
+
+async def stream_food(image):
+    """
+    Streaming variant of analyze_food. Yields ("delta", {"text": ...}) as the model writes,
+    then ("result", {...}) with the same shape as analyze_food once the table lookup is done.
+    """
+    ctx = FOOD.context(image)
+    await ctx.get("preprocess")
+    model = clients.model()
+    raw_text = ""
+    try:
+        async for chunk in call_gemini_stream(model.generate_content, [FOOD_PROMPT, ctx.scan.part()], stream=True):
+            text = getattr(chunk, "text", None) or ""
+            if text:
+                raw_text += text
+                yield "delta", {"text": text}
+    except Exception as e:
+        yield "result", {"text": {"error": str(e)}, "raw_output": {"error": str(e)}}
+        return
+    # The streamed reply stands in for the multimodal stage; parsing and lookup are shared
+    ctx.seed("multimodal", raw_text)
+    yield "result", await _food_answer(ctx, raw_text, {}, "multimodal_stream")
@@ -0,0 +1,140 @@
+import asyncio
+import io
+import threading
+from typing import Any, Optional, Union
+
+# Magic-byte prefixes for the formats phones and the camera path actually send us
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def sniff_mime_type(data: bytes, default: str = "image/jpeg") -> str:
+    for prefix, mime in _SIGNATURES:
+        if data.startswith(prefix):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return default
+
+
+class ScanImage:
+    """
+    An uploaded image held in memory: the encoded bytes (sent to Gemini and to the OCR
+    workers as-is) plus a decoded PIL image that is created on first use and shared by
+    every in-process consumer.
+    """
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview], mime_type: Optional[str] = None):
+        self.data = bytes(data)
+        self.mime_type = mime_type or sniff_mime_type(self.data)
+        self._decoded = None
+        self._decode_error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        # Preprocessed payloads per profile ("model", "ocr"), sharing one OpenCV decode
+        self._array = None
+        self._prepared = {}
+
+    @classmethod
+    def from_input(cls, image: Any) -> "ScanImage":
+        """
+        Accept a ScanImage, raw bytes/bytearray/memoryview, a readable binary buffer,
+        or (for older callers) a path on disk.
+        """
+        if isinstance(image, ScanImage):
+            return image
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return cls(image)
+        if hasattr(image, "read"):
+            return cls(image.read())
+        with open(image, "rb") as f:
+            return cls(f.read())
+
+    @classmethod
+    def from_frame(cls, frame, quality: int = 90) -> "ScanImage":
+        """
+        Encode an OpenCV BGR frame to JPEG in memory (for the cache key and any consumer that
+        wants bytes). The frame itself is kept as the decoded array, so preprocessing starts
+        from the camera's pixels instead of decoding the JPEG again.
+        """
+        import cv2
+
+        ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError("Failed to encode camera frame")
+        image = cls(buffer.tobytes(), "image/jpeg")
+        image._array = frame
+        return image
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def decoded(self):
+        """
+        Return the decoded PIL image, decoding at most once. Re-raises the original decode
+        error on every call if the bytes aren't a readable image.
+        """
+        if self._decoded is not None:
+            return self._decoded
+        with self._lock:
+            if self._decoded is None and self._decode_error is None:
+                try:
+                    from PIL import Image
+
+                    img = Image.open(io.BytesIO(self.data))
+                    img.load()
+                    self._decoded = img
+                except Exception as e:
+                    self._decode_error = e
+        if self._decode_error is not None:
+            raise self._decode_error
+        return self._decoded
+
+    def prepared(self, profile: str):
+        """
+        Return (bytes, mime type, report) for a preprocessing profile, computing it once.
+        Both profiles reuse the same decoded ndarray.
+        """
+        from services import preprocess
+
+        with self._lock:
+            if profile not in self._prepared:
+                if self._array is None:
+                    self._array = preprocess.decode_or_none(self.data)
+                data, mime, report = preprocess.prepare(self.data, profile, decoded=self._array)
+                self._prepared[profile] = (data, mime or self.mime_type, report)
+                if len(self._prepared) == len(preprocess.PROFILES):
+                    # Every profile is done; the full-size pixels aren't needed any more
+                    self._array = None
+            return self._prepared[profile]
+
+    async def prepare(self, *profiles: str) -> dict:
+        """
+        Compute the given profiles (default: all) in a worker thread so resizing and
+        re-encoding don't block the event loop. Returns the per-profile reports.
+        """
+        from services import preprocess
+
+        names = profiles or tuple(preprocess.PROFILES)
+        await asyncio.get_running_loop().run_in_executor(None, lambda: [self.prepared(n) for n in names])
+        return self.preprocess_report()
+
+    def ocr_bytes(self) -> bytes:
+        return self.prepared("ocr")[0]
+
+    def preprocess_report(self) -> dict:
+        return {name: report for name, (_, _, report) in self._prepared.items()}
+
+    def part(self) -> dict:
+        """
+        Inline-data part for `GenerativeModel.generate_content`, using the downscaled
+        "model" profile payload.
+        """
+        data, mime, _ = self.prepared("model")
+        return {"mime_type": mime, "data": data}
@@ -0,0 +1,504 @@
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services import metrics
+from services.schemas import ScanResult
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Job kinds accepted by POST /jobs/{kind}
+KINDS = ("analyze-meds", "analyze-food")
+
+jobs_total = metrics.counter("scan_jobs_total", "Background scan jobs by kind and final status", ("kind", "status"))
+job_seconds = metrics.histogram("scan_job_duration_seconds", "Job run time, excluding queueing", ("kind",))
+job_queue_seconds = metrics.histogram("scan_job_queue_seconds", "Time jobs spent queued before a worker took them", ("kind",))
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class CallbackRejected(ValueError):
+    pass
+
+
+class JobStore:
+    """
+    Durable job queue in a SQLite file (WAL), shared by every API and worker process that
+    opens the same path. Workers claim jobs with a lease; a job whose worker died is picked
+    up again once its lease expires, up to `max_attempts` times. The uploaded image is
+    dropped once the job finishes, and finished jobs are kept for `result_ttl` seconds.
+    """
+
+    def __init__(self, path: str, result_ttl: float = 24 * 3600.0, lease: float = 120.0, max_attempts: int = 3, max_queued: int = 0):
+        self.path = path
+        self.result_ttl = result_ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.max_queued = max_queued
+        # Jobs claim() found past their last lease, for the runner to report (see pop_expired)
+        self._expired: List[Dict[str, Any]] = []
+        self._expired_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " priority INTEGER NOT NULL DEFAULT 0,"
+            " payload BLOB,"
+            " mime TEXT,"
+            " options TEXT,"
+            " callback_url TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " worker TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " lease_until REAL,"
+            " finished_at REAL,"
+            " expires_at REAL,"
+            " result TEXT,"
+            " error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_expiry ON jobs (expires_at)")
+
+    @staticmethod
+    def path_from_env() -> str:
+        default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "jobs.sqlite3")
+        return os.getenv("JOBS_DB", default_path)
+
+    @classmethod
+    def from_env(cls) -> "JobStore":
+        """
+          JOBS_DB            SQLite file holding the queue (default jobs.sqlite3 next to main.py)
+          JOBS_RESULT_TTL    seconds finished jobs and their results are kept (default 86400)
+          JOBS_LEASE_S       seconds a worker may hold a job before it is retried (default 120)
+          JOBS_MAX_ATTEMPTS  runs per job before it is marked failed (default 3)
+          JOBS_MAX_QUEUED    queued jobs before submissions get a 503 (default 0 = unbounded)
+        """
+        return cls(
+            cls.path_from_env(),
+            result_ttl=float(os.getenv("JOBS_RESULT_TTL", str(24 * 3600))),
+            lease=float(os.getenv("JOBS_LEASE_S", "120")),
+            max_attempts=int(os.getenv("JOBS_MAX_ATTEMPTS", "3")),
+            max_queued=int(os.getenv("JOBS_MAX_QUEUED", "0")),
+        )
+
+    def enqueue(
+        self,
+        kind: str,
+        data: bytes,
+        mime: Optional[str] = None,
+        options: Optional[dict] = None,
+        callback_url: Optional[str] = None,
+        priority: int = 0,
+    ) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self.max_queued:
+                (queued,) = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()
+                if queued >= self.max_queued:
+                    raise JobQueueFull(f"{queued} jobs already queued")
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, priority, payload, mime, options, callback_url, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, priority, sqlite3.Binary(bytes(data)), mime,
+                 json.dumps(options or {}), callback_url, time.time()),
+            )
+        return job_id
+
+    def insert_done(self, kind: str, result: Any, callback_url: Optional[str] = None) -> str:
+        """
+        Record a job that is already finished (a cached image): no payload, never claimable.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, priority, options, callback_url, created_at, started_at,"
+                " finished_at, expires_at, result) VALUES (?, ?, ?, 0, '{}', ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, DONE, callback_url, now, now, now, now + self.result_ttl, json.dumps(result)),
+            )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Take the next runnable job: queued, or running with an expired lease (its worker died)
+        and attempts left. Jobs whose last allowed run lost its lease are marked failed on the
+        way; pop_expired() hands them to the caller. Atomic across processes (BEGIN IMMEDIATE
+        holds the write lock for the select + update).
+        """
+        now = time.time()
+        failed: List[Dict[str, Any]] = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # A run that crashed or stalled past its lease never calls fail(), so the
+                # attempt limit is enforced here too
+                expired = self._conn.execute(
+                    "SELECT id, kind, callback_url, attempts FROM jobs WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (RUNNING, now, self.max_attempts),
+                ).fetchall()
+                for job_id, kind, callback_url, attempts in expired:
+                    error = f"lease expired after {attempts} attempts"
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, payload = NULL, finished_at = ?, expires_at = ?, lease_until = NULL"
+                        " WHERE id = ?",
+                        (FAILED, error, now, now + self.result_ttl, job_id),
+                    )
+                    failed.append({"id": job_id, "kind": kind, "callback_url": callback_url, "error": error})
+                row = self._conn.execute(
+                    "SELECT id, kind, payload, mime, options, callback_url, attempts, created_at FROM jobs"
+                    " WHERE status = ? OR (status = ? AND lease_until < ? AND attempts < ?)"
+                    " ORDER BY priority, created_at LIMIT 1",
+                    (QUEUED, RUNNING, now, self.max_attempts),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, started_at = ?, lease_until = ?, attempts = attempts + 1"
+                        " WHERE id = ?",
+                        (RUNNING, worker, now, now + self.lease, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if failed:
+            with self._expired_lock:
+                self._expired.extend(failed)
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "data": bytes(row[2]) if row[2] is not None else b"",
+            "mime": row[3],
+            "options": json.loads(row[4] or "{}"),
+            "callback_url": row[5],
+            "attempts": row[6] + 1,
+            "created_at": row[7],
+            "started_at": now,
+            "worker": worker,
+        }
+
+    def pop_expired(self) -> List[Dict[str, Any]]:
+        """
+        Jobs claim() has failed for running out of leases since the last call, as
+        {"id", "kind", "callback_url", "error"}.
+        """
+        # Its own lock: the store lock can be held for a while by a claim waiting on SQLite
+        with self._expired_lock:
+            expired, self._expired = self._expired, []
+        return expired
+
+    @staticmethod
+    def _held(worker: Optional[str], attempts: Optional[int]) -> Tuple[str, tuple]:
+        # The claim a worker got: once its lease expired and another worker claimed the job,
+        # `worker` and `attempts` no longer match and the late result is dropped
+        if worker is None:
+            return "", ()
+        return " AND status = ? AND worker = ? AND attempts = ?", (RUNNING, worker, attempts)
+
+    def complete(self, job_id: str, result: Any, worker: Optional[str] = None, attempts: Optional[int] = None) -> bool:
+        """
+        Store a finished job's result. With `worker` and `attempts` (from the claim), only while
+        that claim still holds the job. Returns whether the job was updated.
+        """
+        now = time.time()
+        held, params = self._held(worker, attempts)
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, payload = NULL, finished_at = ?, expires_at = ?, lease_until = NULL"
+                " WHERE id = ?" + held,
+                (DONE, json.dumps(result), now, now + self.result_ttl, job_id) + params,
+            )
+            return cur.rowcount > 0
+
+    def fail(self, job_id: str, error: str, attempts: int, worker: Optional[str] = None) -> Optional[str]:
+        """
+        Record a failed run. The job is queued again until it has used `max_attempts`.
+        Returns the job's new status, or None when `worker` no longer holds the job.
+        """
+        now = time.time()
+        held, params = self._held(worker, attempts)
+        with self._lock:
+            if attempts < self.max_attempts:
+                cur = self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, lease_until = NULL WHERE id = ?" + held,
+                    (QUEUED, error, job_id) + params,
+                )
+                return QUEUED if cur.rowcount else None
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, payload = NULL, finished_at = ?, expires_at = ?, lease_until = NULL"
+                " WHERE id = ?" + held,
+                (FAILED, error, now, now + self.result_ttl, job_id) + params,
+            )
+            return FAILED if cur.rowcount else None
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, attempts, created_at, started_at, finished_at, expires_at, result, error, callback_url"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None or (row[7] is not None and row[7] < time.time()):
+            return None
+        job = {
+            "job_id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "attempts": row[3],
+            "created_at": row[4],
+            "started_at": row[5],
+            "finished_at": row[6],
+            "expires_at": row[7],
+            "callback_url": row[10],
+        }
+        if row[8] is not None:
+            job["result"] = json.loads(row[8])
+        if row[9] is not None:
+            job["error"] = row[9]
+        return job
+
+    def position(self, job_id: str) -> Optional[int]:
+        # Number of queued jobs ahead of this one
+        with self._lock:
+            row = self._conn.execute("SELECT priority, created_at FROM jobs WHERE id = ? AND status = ?", (job_id, QUEUED)).fetchone()
+            if row is None:
+                return None
+            (ahead,) = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND (priority < ? OR (priority = ? AND created_at < ?))",
+                (QUEUED, row[0], row[0], row[1]),
+            ).fetchone()
+        return ahead
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),))
+            return cur.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        out = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        out.update(dict(rows))
+        return out
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _allowed_hosts() -> Optional[set]:
+    hosts = os.getenv("JOBS_CALLBACK_HOSTS", "")
+    return {h.strip().lower() for h in hosts.split(",") if h.strip()} or None
+
+
+def check_callback_url(url: str):
+    """
+    Raise CallbackRejected unless `url` is somewhere the server may POST results: an http(s)
+    URL whose host is on the JOBS_CALLBACK_HOSTS allow-list when that is set, otherwise one
+    that resolves only to public addresses (no loopback, private, link-local or reserved
+    ranges, so a callback can't reach the metadata service or the internal network). Blocking
+    (resolves the host).
+    """
+    parsed = urllib.parse.urlsplit(url or "")
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise CallbackRejected("callback_url must be an http(s) URL")
+    host = parsed.hostname.lower()
+    allowed = _allowed_hosts()
+    if allowed is not None:
+        if host not in allowed:
+            raise CallbackRejected(f"callback host {host!r} is not in JOBS_CALLBACK_HOSTS")
+        return
+    try:
+        infos = socket.getaddrinfo(host, parsed.port or (443 if parsed.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise CallbackRejected(f"callback host {host!r} does not resolve")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise CallbackRejected(f"callback host {host!r} resolves to a non-public address")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect would skip the address check; treat it as a failed delivery
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def post_callback(url: str, payload: dict, attempts: int = 3, timeout: float = 10.0) -> bool:
+    """
+    POST the finished job to its callback URL, retrying a couple of times. The URL is checked
+    again before each try, since what the host resolves to may have changed. Blocking.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    for attempt in range(attempts):
+        try:
+            check_callback_url(url)
+        except CallbackRejected:
+            return False
+        try:
+            req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+            with _opener.open(req, timeout=timeout) as resp:
+                if 200 <= resp.status < 300:
+                    return True
+        except Exception:
+            pass
+        time.sleep(0.5 * (2 ** attempt))
+    return False
+
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+def default_handlers(result_cache=None) -> Dict[str, Handler]:
+    """
+    The scan pipelines as job handlers. Results are shared with the request path through
+    `result_cache` (pass a ResultCache; with RESULT_CACHE_DB every process sees the same disk tier).
+    """
+    from services.cache import is_cacheable
+    from services.gemini import analyze_food, analyze_meds
+    from services.images import ScanImage
+
+    def cached(namespace: str, analyze):
+        async def handler(job):
+            scan = ScanImage(job["data"], job.get("mime"))
+            lookup = await result_cache.lookup_async(scan, namespace) if result_cache is not None else (None, None, None)
+            if lookup[2] is not None:
+                return lookup[2]
+            result = await analyze(scan)
+            if result_cache is not None and is_cacheable(result):
+                await result_cache.store_async(lookup[0], result, namespace, lookup[1])
+            return result
+        return handler
+
+    return {
+        "analyze-meds": cached("meds", analyze_meds),
+        "analyze-food": cached("food", analyze_food),
+    }
+
+
+class JobRunner:
+    """
+    Pulls jobs from a JobStore and runs up to `concurrency` of them at a time on the event loop.
+    Runs inside the API process (JOBS_WORKERS > 0) or on its own via `python worker.py`, so
+    processing can be scaled separately from request handling.
+    """
+
+    def __init__(self, store: JobStore, handlers: Dict[str, Handler], concurrency: int = 2, poll_interval: float = 0.5):
+        self.store = store
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.completed = 0
+        self.failed = 0
+        self.lost_leases = 0
+        self._tasks: List[asyncio.Task] = []
+        self._wake = None
+        self._last_purge = 0.0
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._loop(i)) for i in range(self.concurrency)]
+
+    def notify(self):
+        # A job was just enqueued by this process; skip the poll delay
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self, slot: int):
+        loop = asyncio.get_running_loop()
+        worker = f"{self.name}/{slot}"
+        while True:
+            job = await loop.run_in_executor(None, self.store.claim, worker)
+            for expired in self.store.pop_expired():
+                self.failed += 1
+                jobs_total.inc(kind=expired["kind"], status=FAILED)
+                await self._callback(expired, {"job_id": expired["id"], "status": FAILED, "error": expired["error"]})
+            if job is None:
+                if slot == 0 and time.time() - self._last_purge > 60:
+                    self._last_purge = time.time()
+                    await loop.run_in_executor(None, self.store.purge_expired)
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run(job)
+
+    async def run(self, job: Dict[str, Any]):
+        loop = asyncio.get_running_loop()
+        job_queue_seconds.observe(max(0.0, job["started_at"] - job["created_at"]), kind=job["kind"])
+        started = time.perf_counter()
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise ValueError(f"no handler for job kind {job['kind']!r}")
+            result = await handler(job)
+        except asyncio.CancelledError:
+            # Shutting down; the lease expires and another worker picks the job up
+            raise
+        except Exception as e:
+            status = await loop.run_in_executor(None, self.store.fail, job["id"], str(e), job["attempts"], job["worker"])
+            if status == FAILED:
+                self.failed += 1
+                jobs_total.inc(kind=job["kind"], status=FAILED)
+                await self._callback(job, {"job_id": job["id"], "status": FAILED, "error": str(e)})
+            return
+        finally:
+            job_seconds.observe(time.perf_counter() - started, kind=job["kind"])
+        held = await loop.run_in_executor(None, self.store.complete, job["id"], result, job["worker"], job["attempts"])
+        if not held:
+            # Ran past its lease and another worker has the job now; that run reports it
+            self.lost_leases += 1
+            return
+        self.completed += 1
+        jobs_total.inc(kind=job["kind"], status=DONE)
+        # Callbacks get the same compact shape as GET /jobs/{id}; the stored result keeps diagnostics
+        kind = "meds" if job["kind"] == "analyze-meds" else "food"
+        await self._callback(job, {"job_id": job["id"], "status": DONE, "result": ScanResult.from_analyzer(result, kind).to_dict()})
+
+    async def _callback(self, job: Dict[str, Any], payload: dict):
+        if job.get("callback_url"):
+            # Fire and forget; the result stays pollable either way
+            asyncio.get_running_loop().run_in_executor(None, post_callback, job["callback_url"], payload)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker": self.name,
+            "concurrency": self.concurrency,
+            "running": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "lost_leases": self.lost_leases,
+        }
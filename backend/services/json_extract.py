@@ -0,0 +1,179 @@
+import json
+import re
+from typing import Any, Iterator, List, Optional, Tuple
+
+# Characters the scanner has to look at outside strings; everything else is skipped in C
+_STRUCTURAL = re.compile(r'[{}\[\]",:`]')
+# Inside a string only the closing quote and escapes matter
+_STRING_END = re.compile(r'["\\]')
+
+
+class JsonStream:
+    """
+    Incremental extractor for JSON embedded in model output: prose, markdown code fences,
+    several candidate objects, or a reply that is still streaming in.
+
+    Feed text as it arrives. The scanner matches braces and brackets (respecting strings and
+    escapes) in a single forward pass, so total work is linear in the reply length no matter
+    how it is chunked. It collects every complete top-level object/array, remembering whether
+    it sat inside a ``` fence, and reports members of a top-level object as soon as each value
+    is complete, which is what streaming field events need.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._string_start = 0
+        self._start = None  # start of the current top-level value
+        self._in_fence = False
+        self._backticks = 0
+        self._backtick_end = -1
+        # Member tracking for a top-level object: last key seen and where its value began
+        self._key: Optional[str] = None
+        self._value_start = None
+        self._expect_key = False
+        self.values: List[Tuple[Any, bool]] = []  # (parsed value, was inside a code fence)
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Add text; return the (key, value) members of top-level objects completed by it.
+        """
+        self.buffer += chunk
+        members: List[Tuple[str, Any]] = []
+        buf = self.buffer
+        pos = self._pos
+        end = len(buf)
+        while pos < end:
+            if self._in_string:
+                m = _STRING_END.search(buf, pos)
+                if m is None:
+                    pos = end
+                    break
+                if m.group() == "\\":
+                    if m.end() >= end:
+                        # Escape split across chunks; wait for the escaped character
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                    continue
+                self._in_string = False
+                pos = m.end()
+                if len(self._stack) == 1 and self._stack[0] == "{" and self._expect_key:
+                    try:
+                        self._key = json.loads(buf[self._string_start:pos])
+                    except ValueError:
+                        self._key = None
+                    self._expect_key = False
+                continue
+
+            m = _STRUCTURAL.search(buf, pos)
+            if m is None:
+                pos = end
+                break
+            ch = m.group()
+            pos = m.end()
+            depth = len(self._stack)
+
+            if ch == "`":
+                if depth:
+                    # Backticks can't appear in JSON outside a string: an unclosed brace in prose
+                    self._reset()
+                self._backticks = self._backticks + 1 if self._backtick_end == m.start() else 1
+                self._backtick_end = pos
+                if self._backticks == 3:
+                    self._in_fence = not self._in_fence
+                    self._backticks = 0
+                continue
+            if depth == 0 and ch not in "{[":
+                # Prose between values; only an opening brace/bracket starts a candidate
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = m.start()
+            elif ch in "{[":
+                if depth == 0:
+                    self._start = m.start()
+                    self._expect_key = ch == "{"
+                    self._key = None
+                self._stack.append(ch)
+            elif ch in "}]":
+                opener = "{" if ch == "}" else "["
+                if self._stack[-1] != opener:
+                    # Mismatched bracket: not JSON after all, drop the candidate
+                    self._reset()
+                    continue
+                if depth == 1:
+                    self._finish_member(buf, m.start(), members)
+                self._stack.pop()
+                if not self._stack:
+                    self._finish_value(buf[self._start:pos])
+            elif depth == 1 and self._stack[0] == "{":
+                if ch == ":":
+                    self._value_start = pos
+                elif ch == ",":
+                    self._finish_member(buf, m.start(), members)
+                    self._expect_key = True
+        self._pos = pos
+        return members
+
+    def _finish_member(self, buf: str, stop: int, members: List[Tuple[str, Any]]):
+        if self._key is not None and self._value_start is not None:
+            try:
+                members.append((self._key, json.loads(buf[self._value_start:stop])))
+            except ValueError:
+                pass
+        self._key = None
+        self._value_start = None
+
+    def _finish_value(self, text: str):
+        try:
+            self.values.append((json.loads(text), self._in_fence))
+        except ValueError:
+            pass
+        self._reset()
+
+    def _reset(self):
+        self._stack = []
+        self._start = None
+        self._key = None
+        self._value_start = None
+        self._expect_key = False
+
+    def value(self, expect: Optional[type] = None) -> Any:
+        """
+        The best complete value seen so far: the first one inside a code fence if there is one,
+        else the first at top level; restricted to `expect` (dict or list) when given.
+        """
+        candidates = [(v, fenced) for v, fenced in self.values if expect is None or isinstance(v, expect)]
+        for v, fenced in candidates:
+            if fenced:
+                return v
+        return candidates[0][0] if candidates else None
+
+    def iter_values(self, expect: Optional[type] = None) -> Iterator[Any]:
+        for v, _ in self.values:
+            if expect is None or isinstance(v, expect):
+                yield v
+
+
+def extract_json(text: str, expect: Optional[type] = None) -> Any:
+    """
+    Pull the JSON value out of a complete model reply (see JsonStream.value). Replies that are
+    pure JSON take the fast path straight through json.loads.
+    """
+    if not text:
+        return None
+    stripped = text.strip()
+    if stripped[:1] in "{[":
+        try:
+            value = json.loads(stripped)
+            if expect is None or isinstance(value, expect):
+                return value
+        except ValueError:
+            pass
+    stream = JsonStream()
+    stream.feed(text)
+    return stream.value(expect)
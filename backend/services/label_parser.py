@@ -0,0 +1,180 @@
+import json
+import os
+import re
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "data", "label_rules.json")
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """
+    Build a regex alternation from literal keywords, factored through a prefix trie so shared
+    prefixes are matched once ("twice daily|twice a day" -> "twice\\ (?:daily|a\\ day)").
+    The regex engine then does work proportional to the text, not to the number of keywords.
+    Longer keywords win over their prefixes at the same position.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        word = word.lower()
+        if not word:
+            continue
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        terminal = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if terminal:
+            # Single characters don't need a group to be made optional
+            return (body if len(branches) == 1 and len(branches[0]) == 1 else "(?:" + body + ")") + "?"
+        return body
+
+    return build(trie)
+
+
+def _alternation(keywords: Iterable[str], patterns: Iterable[str], whole_words: bool = False) -> Optional[str]:
+    parts = list(patterns)
+    keywords = list(keywords)
+    if keywords:
+        # Keywords must start on a word boundary ("rash" shouldn't hit "crash") but may be
+        # stems that run into a longer word ("contraindicat" -> "contraindicated"), unless
+        # `whole_words` ("bid" must not hit "bidding")
+        parts.append(r"(?<!\w)" + trie_pattern(keywords) + (r"(?!\w)" if whole_words else ""))
+    if not parts:
+        return None
+    return "(?:" + "|".join(parts) + ")"
+
+
+class LabelParser:
+    """
+    Medication label parser driven by a rules file (see data/label_rules.json).
+
+    All keyword families are compiled once into trie-factored regexes. Each family is matched
+    in a single pass over the whole OCR text and the hits are mapped back to lines, so adding
+    units or keywords to the rules file doesn't add passes over the text.
+    """
+
+    def __init__(self, rules: dict):
+        self.rules = rules
+        dosage = rules.get("dosage", {})
+        units = sorted(dosage.get("units", []), key=len, reverse=True)
+        dose_parts = list(dosage.get("patterns", []))
+        if units:
+            dose_parts.append(r"\d+(?:\.\d+)?\s?" + trie_pattern(units) + r"(?!\w)")
+        self.dosage_rx = re.compile("|".join(dose_parts), re.I) if dose_parts else None
+
+        frequency = rules.get("frequency", {})
+        # Frequency keywords are whole words or abbreviations, never stems
+        self.frequency_rx = self._compile(frequency.get("keywords", []), frequency.get("patterns", []), whole_words=True)
+
+        # Line-level families: every line containing a hit is collected under the field name
+        self.line_rx = {}
+        for field in ("warnings", "sideEffects"):
+            spec = rules.get(field, {})
+            rx = self._compile(spec.get("keywords", []), spec.get("patterns", []))
+            if rx is not None:
+                self.line_rx[field] = rx
+
+        instructions = rules.get("instructions", {})
+        self.bullet_rx = re.compile(instructions.get("bullet_pattern", r"^(?:\d+\.|-|•|\*)"))
+        self.instruction_min_words = int(instructions.get("min_words", 4))
+        self.instruction_first = int(instructions.get("first_line", 1))
+        self.instruction_last = int(instructions.get("last_line", 8))
+
+    @staticmethod
+    def _compile(keywords, patterns, whole_words: bool = False):
+        pattern = _alternation(keywords, patterns, whole_words)
+        return re.compile(pattern, re.I) if pattern else None
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_RULES_PATH) -> "LabelParser":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def parse(self, text: str) -> dict:
+        out = {
+            "medicationName": "",
+            "genericName": "",
+            "dosage": "",
+            "frequency": "",
+            "instructions": [],
+            "warnings": [],
+            "sideEffects": [],
+            "plainLanguage": "",
+        }
+        if not text:
+            return out
+
+        # Non-empty stripped lines, plus where each raw line starts so regex hits on the
+        # full text can be mapped back to a line index
+        lines: List[str] = []
+        line_starts: List[int] = []
+        line_index: List[int] = []
+        pos = 0
+        for raw in text.splitlines(keepends=True):
+            stripped = raw.strip()
+            line_starts.append(pos)
+            line_index.append(len(lines) if stripped else -1)
+            if stripped:
+                lines.append(stripped)
+            pos += len(raw)
+        if not lines:
+            return out
+
+        # First non-empty line as medication name candidate
+        out["medicationName"] = lines[0]
+
+        if self.dosage_rx is not None:
+            m = self.dosage_rx.search(text)
+            if m:
+                out["dosage"] = m.group(0)
+
+        if self.frequency_rx is not None:
+            m = self.frequency_rx.search(text)
+            if m:
+                out["frequency"] = m.group(0)
+
+        out["instructions"] = [
+            l for l in lines[self.instruction_first:self.instruction_last]
+            if self.bullet_rx.match(l) or len(l.split()) >= self.instruction_min_words
+        ]
+
+        for field, rx in self.line_rx.items():
+            hit_lines = []
+            last = -1
+            for m in rx.finditer(text):
+                idx = line_index[bisect_right(line_starts, m.start()) - 1]
+                if idx > last:
+                    hit_lines.append(lines[idx])
+                    last = idx
+            out[field] = hit_lines
+
+        # Plain language: summarize first 2 lines as plain language fallback
+        out["plainLanguage"] = " ".join(lines[:2])
+        return out
+
+
+_default_parser: Optional[LabelParser] = None
+
+
+def default_parser() -> LabelParser:
+    """
+    Parser built from LABEL_RULES_PATH (defaults to the bundled data/label_rules.json).
+    """
+    global _default_parser
+    if _default_parser is None:
+        _default_parser = LabelParser.from_file(os.getenv("LABEL_RULES_PATH", DEFAULT_RULES_PATH))
+    return _default_parser
+
+
+def heuristic_parse(text: str) -> dict:
+    """
+    Heuristic parser for medication fields from OCR text, used by the OCR-first path and fallbacks.
+    """
+    return default_parser().parse(text)
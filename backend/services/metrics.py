@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds: OCR and the heuristic land in the low buckets, Gemini calls
+# in the 1-10s range
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+request_logger = logging.getLogger("nutrilens.requests")
+REQUEST_LOG = os.getenv("REQUEST_LOG", "0") == "1"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+_metrics: List = []
+# Callbacks returning (name, help, {labels tuple: value}, labelnames) for gauges read at scrape time
+_gauges: List[Callable[[], Iterable[Tuple[str, str, Tuple[str, ...], Dict[Tuple[str, ...], float]]]]] = []
+
+
+def counter(name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    c = Counter(name, help, labelnames)
+    _metrics.append(c)
+    return c
+
+
+def histogram(name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    h = Histogram(name, help, labelnames, buckets)
+    _metrics.append(h)
+    return h
+
+
+def register_gauges(fn: Callable):
+    """
+    Register a callback that reports current values (queue depth, cache size, ...) at scrape time.
+    It returns an iterable of (name, help, labelnames, {label values: value}).
+    """
+    _gauges.append(fn)
+
+
+request_seconds = histogram(
+    "scan_request_duration_seconds", "End-to-end scan request latency", ("endpoint",)
+)
+stage_seconds = histogram(
+    "scan_stage_duration_seconds", "Latency of each pipeline stage", ("endpoint", "stage")
+)
+requests_total = counter(
+    "scan_requests_total", "Scan requests by endpoint and the pipeline path that served them", ("endpoint", "path")
+)
+stage_errors_total = counter(
+    "scan_stage_errors_total", "Pipeline stages that failed", ("endpoint", "stage")
+)
+
+
+@contextmanager
+def span(stage: str, endpoint: str = "meds"):
+    """
+    Time a block as one pipeline stage. Yields a dict the caller may annotate; it ends up with
+    `stage`, `ok` and `ms`, so it can go straight into a result's diagnostics.
+    """
+    entry = {"stage": stage, "ok": True}
+    started = time.perf_counter()
+    try:
+        yield entry
+    except Exception:
+        entry["ok"] = False
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        entry["ms"] = round(1000 * elapsed, 2)
+        stage_seconds.observe(elapsed, endpoint=endpoint, stage=stage)
+        if not entry["ok"]:
+            stage_errors_total.inc(endpoint=endpoint, stage=stage)
+
+
+def served_path(result) -> str:
+    if isinstance(result, dict):
+        diagnostics = result.get("diagnostics")
+        if isinstance(diagnostics, dict) and diagnostics.get("path"):
+            return diagnostics["path"]
+        if isinstance(result.get("text"), dict) and "error" in result["text"]:
+            return "error"
+    return "multimodal"
+
+
+def record_request(endpoint: str, seconds: float, path: str, stages: Optional[list] = None, **fields):
+    """
+    Count a finished request under the path that served it, observe its latency, and emit one
+    structured JSON log line when REQUEST_LOG=1.
+    """
+    request_seconds.observe(seconds, endpoint=endpoint)
+    requests_total.inc(endpoint=endpoint, path=path)
+    if REQUEST_LOG:
+        line = {"endpoint": endpoint, "path": path, "ms": round(1000 * seconds, 2)}
+        if stages:
+            line["stages"] = {s["stage"]: s.get("ms") for s in stages if isinstance(s, dict)}
+        line.update(fields)
+        request_logger.info(json.dumps(line))
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for fn in _gauges:
+        try:
+            gauges = list(fn())
+        except Exception:
+            continue
+        for name, help, labelnames, values in gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_labels(labelnames, key)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,281 @@
+import csv
+import os
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_TABLE_PATH = os.path.join(os.path.dirname(__file__), "data", "nutrition.csv")
+
+# Columns of the table, all per 100 g
+NUTRIENTS = ("kcal", "protein_g", "carbs_g", "fat_g", "fiber_g", "sodium_mg")
+
+_LABELS = (
+    ("kcal", "Calories", "kcal"),
+    ("protein_g", "Protein", "g"),
+    ("carbs_g", "Carbs", "g"),
+    ("fat_g", "Fat", "g"),
+    ("fiber_g", "Fiber", "g"),
+    ("sodium_mg", "Sodium", "mg"),
+)
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_WEIGHT = re.compile(r"(\d+(?:\.\d+)?)\s*(kg|g|grams?|oz|ounces?|ml|lbs?|pounds?)\b", re.I)
+_COUNT = re.compile(r"^\s*(\d+/\d+|\d+(?:\.\d+)?|a|an|one|two|three|four|half)\b", re.I)
+# "bowl of ...", "2 slices of ..." and "... with ...": the main food is the first part
+_CONTAINER = re.compile(r"^(?:\w+ )?(?:bowl|plate|cup|glass|slice|piece|serving|portion|handful|can|bottle|box)s? of ")
+# "apple slices", "chicken pieces": the cut isn't the food
+_CUT = re.compile(r" (?:slice|piece|chunk|wedge|cube|stick|strip)s?$")
+_CONNECTORS = re.compile(r" (?:with|and|in|on|topped with|served with) ")
+_WORD_COUNTS = {"a": 1.0, "an": 1.0, "one": 1.0, "two": 2.0, "three": 3.0, "four": 4.0, "half": 0.5}
+_GRAMS_PER = {"kg": 1000.0, "oz": 28.35, "ounce": 28.35, "lb": 453.6, "pound": 453.6, "ml": 1.0}
+
+
+def normalize(name: str) -> str:
+    return _NON_WORD.sub(" ", (name or "").lower()).strip()
+
+
+def trigrams(text: str) -> set:
+    # Padded so short names and word starts still produce grams
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def portion_grams(portion: str, default_g: float) -> Tuple[float, str]:
+    """
+    Weight for a portion description: an explicit weight ("150 g", "6 oz") wins, then a count
+    of the table's serving ("2 slices" -> 2 x serving), else one serving.
+    Returns (grams, how it was worked out).
+    """
+    portion = portion or ""
+    m = _WEIGHT.search(portion)
+    if m:
+        unit = m.group(2).lower().rstrip("s")
+        return float(m.group(1)) * _GRAMS_PER.get(unit, 1.0), "portion"
+    m = _COUNT.match(portion)
+    if m:
+        word = m.group(1).lower()
+        if "/" in word:
+            num, den = word.split("/")
+            count = float(num) / float(den) if float(den) else 1.0
+        else:
+            count = _WORD_COUNTS.get(word) or float(word)
+        return count * default_g, "serving"
+    return default_g, "serving"
+
+
+class NutritionTable:
+    """
+    Nutrition facts held column-wise in flat arrays (one float per food per nutrient), with a
+    trigram index over food names and aliases so the model's wording ("grilled chicken
+    breast", "bananas") finds the right row. Built once from data/nutrition.csv; a lookup is
+    a dict probe plus a few posting-list scans, no model call.
+    """
+
+    def __init__(self, rows: Iterable[Dict[str, str]]):
+        self.names: List[str] = []
+        self.portions: List[str] = []
+        self.portion_g = array("f")
+        self.values = array("f")  # row-major, len(NUTRIENTS) per food
+        self._exact: Dict[str, int] = {}
+        # Index keys are names and aliases: key -> food row, key -> trigram count
+        self._keys: List[str] = []
+        self._key_rows = array("I")
+        self._key_sizes = array("H")
+        self._postings: Dict[str, array] = {}
+
+        for row in rows:
+            idx = len(self.names)
+            self.names.append(row["name"].strip())
+            self.portions.append((row.get("portion") or "1 serving").strip())
+            self.portion_g.append(float(row.get("portion_g") or 100))
+            self.values.extend(float(row.get(n) or 0) for n in NUTRIENTS)
+            for key in [row["name"]] + [a for a in (row.get("aliases") or "").split("|") if a.strip()]:
+                self._add_key(normalize(key), idx)
+
+    def _add_key(self, key: str, row: int):
+        if not key or key in self._exact:
+            return
+        self._exact[key] = row
+        grams = trigrams(key)
+        key_id = len(self._key_rows)
+        self._keys.append(key)
+        self._key_rows.append(row)
+        self._key_sizes.append(len(grams))
+        for gram in grams:
+            self._postings.setdefault(gram, array("I")).append(key_id)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "NutritionTable":
+        with open(path, newline="", encoding="utf-8") as f:
+            lines = (line for line in f if not line.startswith("#"))
+            return cls(csv.DictReader(lines))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def match(self, name: str, min_score: float = 0.7) -> Optional[Tuple[int, float]]:
+        """
+        Best (row, score) for a food name. The main food is tried first ("bowl of oatmeal with
+        blueberries" -> "oatmeal"), then the whole name, then its last word. Each try takes, in
+        order: an exact name or alias (score 1.0), the longest name or alias that ends the
+        phrase ("apple juice" -> "juice", never "apple"; the last word is the head noun), and
+        only then the closest name by trigram Dice coefficient, which has to reach `min_score`
+        and share the head noun, so "almond milk" doesn't turn into almonds.
+        """
+        query = normalize(name)
+        if not query:
+            return None
+        head = _CUT.sub("", _CONNECTORS.split(_CONTAINER.sub("", query))[0].strip())
+        for candidate in dict.fromkeys((head, query, head.rsplit(" ", 1)[-1])):
+            found = self._match(candidate, min_score) if candidate else None
+            if found is not None:
+                return found
+        return None
+
+    def _match(self, query: str, min_score: float) -> Optional[Tuple[int, float]]:
+        row = self._exact.get(query)
+        if row is not None:
+            return row, 1.0
+        grams = trigrams(query)
+
+        # A modifier on its own ("apple" in "apple juice") is a different food, so only runs
+        # of words ending at the head noun count, the head also tried singular ("breasts")
+        words = query.split()
+        singular = _singular(words[-1])
+        for start in range(len(words)):
+            for phrase in (" ".join(words[start:]), " ".join(words[start:-1] + [singular])):
+                if phrase in self._exact:
+                    phrase_grams = trigrams(phrase)
+                    return self._exact[phrase], 2.0 * len(grams & phrase_grams) / (len(grams) + len(phrase_grams))
+
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for key_id in self._postings.get(gram, ()):
+                shared[key_id] = shared.get(key_id, 0) + 1
+        fuzzy, fuzzy_score = None, 0.0
+        for key_id, common in shared.items():
+            score = 2.0 * common / (len(grams) + self._key_sizes[key_id])
+            if score > fuzzy_score and score >= min_score and self._same_head(words[-1], key_id):
+                fuzzy, fuzzy_score = key_id, score
+        if fuzzy is None:
+            return None
+        return self._key_rows[fuzzy], fuzzy_score
+
+    def _same_head(self, head: str, key_id: int) -> bool:
+        # Misspellings and plurals of the head noun ("breasts", "spagetti") still count
+        head_grams = trigrams(head)
+        for word in self._keys[key_id].split():
+            word_grams = trigrams(word)
+            if 2.0 * len(head_grams & word_grams) / (len(head_grams) + len(word_grams)) >= 0.5:
+                return True
+        return False
+
+    def per_100g(self, row: int) -> Dict[str, float]:
+        base = row * len(NUTRIENTS)
+        return {n: round(self.values[base + i], 1) for i, n in enumerate(NUTRIENTS)}
+
+    def nutrients(self, row: int, grams: float) -> Dict[str, float]:
+        base = row * len(NUTRIENTS)
+        scale = grams / 100.0
+        return {n: round(self.values[base + i] * scale, 1) for i, n in enumerate(NUTRIENTS)}
+
+    def lookup(self, name: str, portion: str = "", grams: Optional[float] = None) -> Dict[str, Any]:
+        """
+        One identified food as a structured item. The weight is the model's estimate when it
+        gave one, else worked out from the portion text and the table's serving size.
+        """
+        item: Dict[str, Any] = {"name": name, "portion": portion}
+        found = self.match(name)
+        if found is None:
+            item.update(food=None, grams=grams, nutrients=None)
+            return item
+        row, score = found
+        if grams and grams > 0:
+            source = "model"
+        else:
+            grams, source = portion_grams(portion, self.portion_g[row])
+        item.update(
+            food=self.names[row],
+            match=round(score, 2),
+            portion=portion or self.portions[row],
+            grams=round(grams, 1),
+            grams_from=source,
+            nutrients=self.nutrients(row, grams),
+        )
+        return item
+
+    def describe(self, items: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Structured answer for a list of {"name", "portion", "grams"} items from the model:
+        each item with its nutrients, the totals, and a plain-text summary.
+        """
+        looked_up = [self.lookup(str(i.get("name") or ""), str(i.get("portion") or ""), _number(i.get("grams"))) for i in items]
+        looked_up = [i for i in looked_up if i["name"]]
+        totals = {n: 0.0 for n in NUTRIENTS}
+        for item in looked_up:
+            for n, v in (item["nutrients"] or {}).items():
+                totals[n] += v
+        totals = {n: round(v, 1) for n, v in totals.items()}
+        return {"items": looked_up, "totals": totals, "plain": _summary(looked_up, totals)}
+
+
+def _singular(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses", "oes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        # "150 g", "6 oz" or a bare "150"; "1 cup" isn't a weight, so the portion text decides
+        if _WEIGHT.search(value):
+            return portion_grams(value, 0.0)[0]
+        m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*", value)
+        if m:
+            return float(m.group(1))
+    return None
+
+
+def _summary(items: List[Dict[str, Any]], totals: Dict[str, float]) -> str:
+    # Same layout the free-text model answer used, so existing clients keep working
+    names = ", ".join(
+        f"{(i['food'] or i['name']).capitalize()} ({i['portion']}{', %g g' % i['grams'] if i.get('grams') else ''})"
+        for i in items
+    )
+    lines = [f"Food: {names}"]
+    for key, label, unit in _LABELS:
+        lines.append(f"{label}: {totals[key]:g} {unit}")
+    unknown = [i["name"] for i in items if i["food"] is None]
+    if unknown:
+        lines.append("Not in the nutrition table: " + ", ".join(unknown))
+    return "\n".join(lines)
+
+
+_table: Optional[NutritionTable] = None
+
+
+def get_table() -> NutritionTable:
+    """
+    Table built from NUTRITION_TABLE_PATH (defaults to the bundled data/nutrition.csv).
+    """
+    global _table
+    if _table is None:
+        _table = NutritionTable.from_csv(os.getenv("NUTRITION_TABLE_PATH", DEFAULT_TABLE_PATH))
+    return _table
+
+
+def food_items(value: Any) -> List[Dict[str, Any]]:
+    """
+    The item list from a parsed model reply: {"items": [...]}, a bare list, or one item.
+    """
+    if isinstance(value, dict):
+        value = value.get("items", [value] if "name" in value else [])
+    if not isinstance(value, list):
+        return []
+    return [i for i in value if isinstance(i, dict) and i.get("name")]
@@ -0,0 +1,236 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from services.executor import UpstreamPool, register_pool
+
+# Per-process state, set up once by `_init_worker` in each OCR worker process.
+# `_api` is a warm tesserocr handle (language data already loaded); when tesserocr isn't
+# installed we fall back to pytesseract, which still forks the CLI per call.
+_api = None
+_engine_name = None
+_lang = "eng"
+_psm = 3
+
+
+def _init_worker(lang: str, psm: int):
+    global _api, _engine_name, _lang, _psm
+    _lang, _psm = lang, psm
+    from PIL import Image  # noqa: F401  (import once, not on the first job)
+
+    try:
+        import tesserocr
+
+        _api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+        _engine_name = "tesserocr"
+    except Exception:
+        import pytesseract  # noqa: F401
+
+        _api = None
+        _engine_name = "pytesseract"
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def _recognize(data: bytes) -> Dict[str, Any]:
+    from PIL import Image
+
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(data))
+    if _api is not None:
+        _api.SetImage(img)
+        text = _api.GetUTF8Text()
+        mean_conf = _api.MeanTextConf()
+        # Reuses the recognition GetUTF8Text just ran
+        words = [(w, int(c)) for w, c in _api.MapWordConfidences()]
+    else:
+        text, words = _pytesseract_data(img)
+        mean_conf = round(sum(c for _, c in words) / len(words)) if words else None
+    return {
+        "text": text,
+        "mean_conf": mean_conf,
+        "words": words,
+        "engine": _engine_name,
+        "pid": os.getpid(),
+        "elapsed_ms": round(1000 * (time.perf_counter() - started), 2),
+    }
+
+
+def _pytesseract_data(img):
+    """
+    One image_to_data call gives both the per-word confidences and, regrouped by line,
+    the same text image_to_string would have produced.
+    """
+    import pytesseract
+
+    data = pytesseract.image_to_data(img, lang=_lang, config=f"--psm {_psm}", output_type=pytesseract.Output.DICT)
+    lines: Dict[tuple, List[str]] = {}
+    words = []
+    for i, word in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        if conf < 0 or not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        words.append((word, int(conf)))
+    return "\n".join(" ".join(ws) for ws in lines.values()), words
+
+
+class OcrTimeout(Exception):
+    pass
+
+
+class OcrEngine:
+    """
+    Pool of long-lived OCR worker processes, each holding a warm Tesseract handle.
+
+    Jobs are submitted as encoded image bytes (cheap to pickle) and come back as dicts with
+    `text`, `mean_conf` (0-100), `words` ([(word, confidence 0-100)]), `engine` and `elapsed_ms`.
+    """
+
+    def __init__(self, workers: int, lang: str = "eng", psm: int = 3, timeout: float = 15.0, max_queue: int = 0):
+        self.workers = workers
+        self.lang = lang
+        self.psm = psm
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.timeouts = 0
+        self.recycles = 0
+        self._pool: Optional[UpstreamPool] = None
+        # Pools replaced after an overrun, finishing the jobs they already had
+        self._retiring: List[UpstreamPool] = []
+        self._start_lock = threading.Lock()
+
+    def start(self) -> "OcrEngine":
+        """
+        Spawn the worker processes and wait until each has loaded Tesseract, so the first
+        request doesn't pay for process start-up and model load.
+        """
+        with self._start_lock:
+            if self._pool is None:
+                self._spawn()
+        return self
+
+    def _spawn(self):
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.lang, self.psm),
+        )
+        # ProcessPoolExecutor starts workers lazily; submitting one job per worker forces them all up
+        for f in [executor.submit(_worker_pid) for _ in range(self.workers)]:
+            f.result()
+        self._pool = UpstreamPool("ocr", executor, max_concurrency=self.workers, max_queue=self.max_queue)
+        register_pool(self._pool)
+
+    async def recognize(self, data: bytes, timeout: Optional[float] = None) -> Dict[str, Any]:
+        if self._pool is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+        limit = self.timeout if timeout is None else timeout
+        pool = self._pool
+        try:
+            # Only time spent in a worker counts: a job that just queued behind others under
+            # load hasn't hung anything
+            return await pool.run_limited(limit, _recognize, bytes(data))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # The worker is still grinding on the image; new jobs go to a fresh pool (unless
+            # another overrun already replaced it) so it can't starve them
+            if self._pool is pool:
+                self._recycle()
+            raise OcrTimeout(f"OCR exceeded {limit:.1f}s")
+        finally:
+            if self._retiring:
+                self._reap()
+
+    async def recognize_many(self, items: Iterable[bytes], timeout: Optional[float] = None) -> List[Any]:
+        """
+        Submit a batch of images at once. Results come back in input order; a failed or
+        timed-out image yields its exception instead of a result dict.
+        """
+        return await asyncio.gather(
+            *(self.recognize(data, timeout=timeout) for data in items),
+            return_exceptions=True,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        out = self._pool.stats() if self._pool is not None else {}
+        out.update({
+            "workers": self.workers,
+            "timeouts": self.timeouts,
+            "recycles": self.recycles,
+            "retiring_pools": len(self._retiring),
+        })
+        return out
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for pool in self._retiring:
+            self._terminate(pool)
+        self._retiring = []
+
+    def _recycle(self):
+        # Killing the stuck worker right away would break the whole ProcessPoolExecutor, and
+        # with it every other job in flight. The pool is retired instead: it takes no new
+        # jobs, finishes the ones it has, and only the stuck workers are left to terminate.
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        self.recycles += 1
+        self._retiring.append(pool)
+        self._reap()
+
+    def _reap(self):
+        for pool in list(self._retiring):
+            # Overrunning jobs don't count as in flight; nobody is waiting on them any more
+            if not pool.in_flight and not pool.waiting:
+                self._retiring.remove(pool)
+                self._terminate(pool)
+
+    @staticmethod
+    def _terminate(pool: UpstreamPool):
+        # ProcessPoolExecutor has no public way to kill a busy worker
+        processes = list(getattr(pool.executor, "_processes", {}).values())
+        pool.shutdown()
+        for proc in processes:
+            try:
+                proc.terminate()
+            except Exception:
+                pass
+
+
+_engine: Optional[OcrEngine] = None
+
+
+def get_engine() -> OcrEngine:
+    """
+    Process-wide OCR engine configured from the environment:
+      OCR_WORKERS    worker processes (default: CPU count)
+      OCR_LANG       Tesseract language (default "eng")
+      OCR_PSM        Tesseract page segmentation mode (default 3)
+      OCR_TIMEOUT    seconds a job may run in a worker, not counting its wait (default 15)
+      OCR_MAX_QUEUE  max jobs waiting for a worker (default 0 = unbounded)
+    """
+    global _engine
+    if _engine is None:
+        _engine = OcrEngine(
+            workers=int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2))),
+            lang=os.getenv("OCR_LANG", "eng"),
+            psm=int(os.getenv("OCR_PSM", "3")),
+            timeout=float(os.getenv("OCR_TIMEOUT", "15")),
+            max_queue=int(os.getenv("OCR_MAX_QUEUE", "0")),
+        )
+    return _engine
+
+
+async def run_ocr(data: bytes) -> str:
+    result = await get_engine().recognize(data)
+    return result["text"]
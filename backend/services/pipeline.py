@@ -0,0 +1,314 @@
+import asyncio
+import inspect
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from services import metrics
+from services.cache import content_key
+from services.images import ScanImage
+
+# Concurrency classes: where a stage's work runs and what bounds it
+LOOP = "loop"  # inline on the event loop; only for quick, non-blocking work
+THREAD = "thread"  # a plain function run in the default thread pool, at most PIPELINE_THREADS at once
+OCR = "ocr"  # awaits the OCR worker processes (bounded by services/ocr.py)
+GEMINI = "gemini"  # awaits an upstream model call (bounded by services/executor.py and the breaker)
+POOL = "pool"  # awaits another local worker-process pool, e.g. the label extractor (services/extractor.py)
+
+# Rough cost classes, cheapest first
+TRIVIAL = "trivial"
+CPU = "cpu"
+UPSTREAM = "upstream"
+
+
+class Stage:
+    """
+    One step of a scan pipeline (preprocess, OCR, model call, parse, validate, ...).
+    `run(ctx, entry)` produces the stage's output; `entry` is its diagnostics record, to
+    annotate or mark failed with entry["ok"] = False. Raising also marks it failed, and the
+    exception reaches whoever asked for the output.
+
+      needs        stages whose outputs `run` reads (ctx.output); resolved first, concurrently
+      cost         TRIVIAL, CPU or UPSTREAM
+      cacheable    the output depends only on the image bytes, so it is kept across scans of
+                   the same image (a retry after a failed model call skips OCR, for instance)
+      concurrency  LOOP, THREAD, OCR, GEMINI or POOL (see above)
+      batch        optional `batch(contexts, entries) -> outputs` that does the work for
+                   several scans in one go (PipelineEngine.resolve_batch)
+    """
+
+    __slots__ = ("name", "run", "needs", "cost", "cacheable", "concurrency", "batch")
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable,
+        needs: Sequence[str] = (),
+        cost: str = TRIVIAL,
+        cacheable: bool = False,
+        concurrency: str = LOOP,
+        batch: Optional[Callable] = None,
+    ):
+        self.name = name
+        self.run = run
+        self.needs = tuple(needs)
+        self.cost = cost
+        self.cacheable = cacheable
+        self.concurrency = concurrency
+        self.batch = batch
+
+
+class _Span:
+    # Wraps a metrics span so the stage entry is listed in order of start, not completion
+    def __init__(self, span, entry):
+        self.span = span
+        self.entry = entry
+
+    def __enter__(self):
+        return self.entry
+
+    def __exit__(self, *exc):
+        return self.span.__exit__(*exc)
+
+
+class ScanContext:
+    """
+    Per-request state of one scan going through a pipeline: the image, the stage outputs
+    computed so far (each stage runs at most once, and concurrent requests for it share the
+    run) and the diagnostics entries of everything that ran, in start order.
+    """
+
+    def __init__(self, pipeline: "Pipeline", scan: ScanImage):
+        self.pipeline = pipeline
+        self.scan = scan
+        self.endpoint = pipeline.name
+        self.stages: List[Dict[str, Any]] = []
+        self._outputs: Dict[str, asyncio.Future] = {}
+        self._key: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        # Content hash for the cross-scan stage cache, computed only if a cacheable stage runs
+        if self._key is None:
+            self._key = content_key(self.scan.data)
+        return self._key
+
+    async def get(self, name: str) -> Any:
+        return await self.pipeline.engine.resolve(self, name)
+
+    def output(self, name: str, default: Any = None) -> Any:
+        """
+        The output of a stage that has already finished successfully, else `default`.
+        """
+        future = self._outputs.get(name)
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+            return default
+        return future.result()
+
+    def seed(self, name: str, value: Any):
+        """
+        Use an output computed elsewhere (a multi-image call, a stream) instead of running the stage.
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        self._outputs[name] = future
+
+    def stage(self, name: str) -> _Span:
+        """
+        Time a step the flow runs itself (not a declared stage) into the same diagnostics.
+        """
+        span = metrics.span(name, endpoint=self.endpoint)
+        entry = span.__enter__()
+        self.stages.append(entry)
+        return _Span(span, entry)
+
+
+class Pipeline:
+    """
+    A named set of stages plus the flow that decides which of them a scan needs. The flow is
+    `async flow(ctx, **options) -> analyzer result`; it asks for outputs with
+    `await ctx.get(name)` and the engine runs each stage, and what it needs, once.
+    """
+
+    def __init__(self, name: str, stages: Iterable[Stage], flow: Callable, engine: Optional["PipelineEngine"] = None):
+        self.name = name
+        self.stages = {stage.name: stage for stage in stages}
+        self.flow = flow
+        self._engine = engine
+        for stage in self.stages.values():
+            missing = [n for n in stage.needs if n not in self.stages]
+            if missing:
+                raise ValueError(f"{name}: stage {stage.name!r} needs unknown stages {missing}")
+
+    @property
+    def engine(self) -> "PipelineEngine":
+        return self._engine or get_pipeline_engine()
+
+    def context(self, image: Any) -> ScanContext:
+        if isinstance(image, ScanContext):
+            return image
+        return ScanContext(self, ScanImage.from_input(image))
+
+    async def run(self, image: Any, **options) -> Any:
+        return await self.flow(self.context(image), **options)
+
+
+class PipelineEngine:
+    """
+    Runs pipeline stages: resolves what each stage needs concurrently, runs the stage in its
+    concurrency class, keeps cacheable outputs in a small cross-scan LRU and counts runs,
+    cache hits, failures and time per stage for /pools/stats.
+    """
+
+    def __init__(self, threads: int = 8, cache_size: int = 256):
+        self.threads = threads
+        self.cache_size = cache_size
+        self._thread_slots: Optional[asyncio.Semaphore] = None
+        self._cache: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def from_env(cls) -> "PipelineEngine":
+        """
+          PIPELINE_THREADS      THREAD stages running at once (default: CPU count, at most 8)
+          PIPELINE_STAGE_CACHE  outputs of cacheable stages kept across scans (default 256, 0 disables)
+        """
+        return cls(
+            threads=int(os.getenv("PIPELINE_THREADS", str(min(8, os.cpu_count() or 1)))),
+            cache_size=int(os.getenv("PIPELINE_STAGE_CACHE", "256")),
+        )
+
+    async def resolve(self, ctx: ScanContext, name: str) -> Any:
+        future = ctx._outputs.get(name)
+        if future is None:
+            future = ctx._outputs[name] = asyncio.ensure_future(self._run(ctx, ctx.pipeline.stages[name]))
+        # Shielded: a consumer that gives up doesn't cancel the run for the others
+        return await asyncio.shield(future)
+
+    async def resolve_batch(self, contexts: Sequence[ScanContext], name: str) -> List[Any]:
+        """
+        Resolve one stage for several scans. A stage with a `batch` function gets one call for
+        every scan that still needs it; others run per scan, concurrently. Returns outputs (or
+        exceptions) in order.
+        """
+        if not contexts:
+            return []
+        stage = contexts[0].pipeline.stages[name]
+        todo = []
+        for ctx in contexts:
+            if name in ctx._outputs:
+                continue
+            hit, value = self._lookup(ctx, stage)
+            if hit:
+                ctx.seed(name, value)
+            else:
+                todo.append(ctx)
+        if stage.batch is not None and todo:
+            await asyncio.gather(*(self.resolve(c, n) for c in todo for n in stage.needs))
+            loop = asyncio.get_running_loop()
+            futures = [loop.create_future() for _ in todo]
+            for ctx, future in zip(todo, futures):
+                ctx._outputs[name] = future
+            entries = [{"stage": name + "_batch", "ok": True} for _ in todo]
+            started = time.perf_counter()
+            try:
+                values = await stage.batch(todo, entries)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                    future.exception()  # retrieved here; the callers see it through resolve
+                values = None
+            elapsed = time.perf_counter() - started
+            metrics.stage_seconds.observe(elapsed, endpoint=contexts[0].endpoint, stage=name + "_batch")
+            for i, (ctx, entry, future) in enumerate(zip(todo, entries, futures)):
+                entry["ms"] = round(1000 * elapsed, 2)
+                ctx.stages.append(entry)
+                if values is None:
+                    entry["ok"] = False
+                self._count(stage, elapsed / len(todo), entry["ok"])
+                if values is None:
+                    continue
+                future.set_result(values[i])
+                if stage.cacheable and entry["ok"]:
+                    self._remember(ctx, stage, values[i])
+        return await asyncio.gather(*(self.resolve(c, name) for c in contexts), return_exceptions=True)
+
+    async def _run(self, ctx: ScanContext, stage: Stage) -> Any:
+        # A cacheable output only depends on the image, so a hit doesn't need its inputs
+        hit, value = self._lookup(ctx, stage)
+        if hit:
+            return value
+        if stage.needs:
+            await asyncio.gather(*(self.resolve(ctx, n) for n in stage.needs))
+        started = time.perf_counter()
+        ok = False
+        try:
+            with ctx.stage(stage.name) as entry:
+                if stage.concurrency == THREAD:
+                    if self._thread_slots is None:
+                        self._thread_slots = asyncio.Semaphore(max(1, self.threads))
+                    async with self._thread_slots:
+                        value = await asyncio.get_running_loop().run_in_executor(None, stage.run, ctx, entry)
+                else:
+                    value = stage.run(ctx, entry)
+                    if inspect.isawaitable(value):
+                        value = await value
+            ok = entry["ok"]
+        finally:
+            self._count(stage, time.perf_counter() - started, ok)
+        if stage.cacheable and ok:
+            self._remember(ctx, stage, value)
+        return value
+
+    def _lookup(self, ctx: ScanContext, stage: Stage):
+        # (True, output) if the cross-scan cache has this stage's output for the image
+        if not (stage.cacheable and self.cache_size > 0):
+            return False, None
+        value = self._cache.get((stage.name, ctx.key))
+        if value is None:
+            return False, None
+        self._cache.move_to_end((stage.name, ctx.key))
+        self._stats_for(stage)["cache_hits"] += 1
+        ctx.stages.append({"stage": stage.name, "ok": True, "ms": 0.0, "cached": True})
+        return True, value
+
+    def _remember(self, ctx: ScanContext, stage: Stage, value: Any):
+        if self.cache_size <= 0 or value is None:
+            return
+        self._cache[(stage.name, ctx.key)] = value
+        self._cache.move_to_end((stage.name, ctx.key))
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _stats_for(self, stage: Stage) -> Dict[str, Any]:
+        return self._stats.setdefault(stage.name, {
+            "cost": stage.cost, "concurrency": stage.concurrency, "cacheable": stage.cacheable,
+            "runs": 0, "failures": 0, "cache_hits": 0, "seconds": 0.0,
+        })
+
+    def _count(self, stage: Stage, seconds: float, ok: bool):
+        stats = self._stats_for(stage)
+        stats["runs"] += 1
+        stats["failures"] += 0 if ok else 1
+        stats["seconds"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threads": self.threads,
+            "stage_cache_entries": len(self._cache),
+            "stages": {
+                name: dict(s, mean_ms=round(1000 * s["seconds"] / s["runs"], 2) if s["runs"] else None, seconds=round(s["seconds"], 3))
+                for name, s in self._stats.items()
+            },
+        }
+
+
+_engine: Optional[PipelineEngine] = None
+
+
+def get_pipeline_engine() -> PipelineEngine:
+    global _engine
+    if _engine is None:
+        _engine = PipelineEngine.from_env()
+    return _engine
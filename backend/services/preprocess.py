@@ -0,0 +1,134 @@
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# Target profiles. "model" keeps colour and shrinks the upload Gemini has to receive;
+# "ocr" produces a binarized grayscale image, which Tesseract reads faster and more reliably.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "model": {
+        "max_dim": int(os.getenv("PREPROCESS_MODEL_MAX_DIM", "1536")),
+        "format": os.getenv("PREPROCESS_MODEL_FORMAT", "jpeg"),
+        "quality": int(os.getenv("PREPROCESS_MODEL_QUALITY", "85")),
+        "grayscale": False,
+        "threshold": False,
+    },
+    "ocr": {
+        "max_dim": int(os.getenv("PREPROCESS_OCR_MAX_DIM", "2000")),
+        "format": "png",
+        "quality": 0,
+        "grayscale": True,
+        "threshold": os.getenv("PREPROCESS_OCR_THRESHOLD", "1") == "1",
+        # Adaptive threshold neighbourhood (odd, in pixels) and offset
+        "block_size": int(os.getenv("PREPROCESS_OCR_BLOCK", "31")),
+        "c": int(os.getenv("PREPROCESS_OCR_C", "10")),
+    },
+}
+
+ENABLED = os.getenv("PREPROCESS_ENABLED", "1") == "1"
+
+_MIME = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+# Running totals for every profile, e.g. {"model": {"images": 3, "in_bytes": ..., "out_bytes": ...}}
+totals: Dict[str, Dict[str, int]] = {}
+
+
+def decode(data: bytes):
+    """
+    Decode encoded image bytes into a BGR ndarray (None if OpenCV can't read them).
+    """
+    import cv2
+    import numpy as np
+
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def _encode(img, fmt: str, quality: int) -> bytes:
+    import cv2
+
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 3]
+    ok, buffer = cv2.imencode("." + ("jpg" if fmt == "jpeg" else fmt), img, params)
+    if not ok:
+        raise ValueError(f"Failed to encode image as {fmt}")
+    return buffer.tobytes()
+
+
+def apply_profile(img, profile: Dict[str, Any]):
+    """
+    Resize (never upscale) to fit `max_dim`, then optionally convert to grayscale and
+    binarize with a Gaussian adaptive threshold. All whole-array OpenCV operations.
+    """
+    import cv2
+
+    h, w = img.shape[:2]
+    scale = profile["max_dim"] / float(max(h, w))
+    if scale < 1.0:
+        img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    if profile.get("grayscale") and img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    if profile.get("threshold"):
+        block = profile.get("block_size", 31) | 1
+        img = cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block, profile.get("c", 10))
+    return img
+
+
+def prepare(data: bytes, profile_name: str, decoded=None) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Produce the payload for one profile. Returns (bytes, mime type, report); `report` has the
+    input/output sizes and bytes saved. Pass `decoded` to reuse an already decoded ndarray.
+    Falls back to the original bytes if preprocessing is disabled, OpenCV is missing, or the
+    result would be larger than what we started with.
+    """
+    profile = PROFILES[profile_name]
+    report: Dict[str, Any] = {"profile": profile_name, "in_bytes": len(data)}
+    if not ENABLED:
+        report.update({"skipped": "disabled", "out_bytes": len(data), "saved_bytes": 0})
+        return data, "", report
+
+    started = time.perf_counter()
+    try:
+        img = decoded if decoded is not None else decode(data)
+        if img is None:
+            raise ValueError("image could not be decoded")
+        report["in_size"] = [int(img.shape[1]), int(img.shape[0])]
+        out_img = apply_profile(img, profile)
+        out = _encode(out_img, profile["format"], profile["quality"])
+        report["out_size"] = [int(out_img.shape[1]), int(out_img.shape[0])]
+    except Exception as e:
+        report.update({"skipped": str(e), "out_bytes": len(data), "saved_bytes": 0})
+        return data, "", report
+
+    mime = _MIME[profile["format"]]
+    if len(out) >= len(data) and not (profile.get("grayscale") or profile.get("threshold")):
+        # Already small enough; re-encoding only cost us quality
+        out, mime = data, ""
+    report["out_bytes"] = len(out)
+    report["saved_bytes"] = len(data) - len(out)
+    report["ms"] = round(1000 * (time.perf_counter() - started), 2)
+
+    total = totals.setdefault(profile_name, {"images": 0, "in_bytes": 0, "out_bytes": 0})
+    total["images"] += 1
+    total["in_bytes"] += len(data)
+    total["out_bytes"] += len(out)
+    return out, mime, report
+
+
+def stats() -> Dict[str, Any]:
+    out = {}
+    for name, total in totals.items():
+        saved = total["in_bytes"] - total["out_bytes"]
+        out[name] = dict(total, saved_bytes=saved, saved_ratio=round(saved / total["in_bytes"], 3) if total["in_bytes"] else 0.0)
+    return out
+
+
+def decode_or_none(data: bytes) -> Optional[Any]:
+    try:
+        return decode(data)
+    except Exception:
+        return None
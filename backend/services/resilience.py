@@ -0,0 +1,417 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from services import metrics
+from services.executor import PoolSaturated, run_gemini, stream_gemini
+from services.scheduler import current_deadline
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+gemini_attempts_total = metrics.counter(
+    "gemini_attempts_total", "Gemini call attempts by outcome", ("outcome",)
+)
+gemini_hedges_total = metrics.counter(
+    "gemini_hedges_total", "Hedged Gemini calls by which request answered first", ("winner",)
+)
+breaker_transitions_total = metrics.counter(
+    "gemini_breaker_transitions_total", "Circuit breaker state changes", ("to",)
+)
+
+
+class CircuitOpen(Exception):
+    """
+    Gemini is failing too often; callers should take the OCR + heuristic path instead.
+    """
+
+
+_google_exceptions: Any = None
+
+
+def google_exceptions():
+    """
+    google.api_core.exceptions, or None without the SDK. Imported once (the startup warm-up
+    does it) instead of on every failed call.
+    """
+    global _google_exceptions
+    if _google_exceptions is None:
+        try:
+            from google.api_core import exceptions
+        except Exception:
+            exceptions = False
+        _google_exceptions = exceptions
+    return _google_exceptions or None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    Errors worth retrying: rate limits, 5xx, timeouts, dropped connections, a full local queue.
+    Bad requests, auth errors and NotFound are not.
+    """
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError, PoolSaturated)):
+        return True
+    exceptions = google_exceptions()
+    if exceptions is None:
+        return False
+    return isinstance(exc, (
+        exceptions.TooManyRequests,
+        exceptions.ResourceExhausted,
+        exceptions.ServerError,
+        exceptions.DeadlineExceeded,
+        exceptions.ServiceUnavailable,
+    ))
+
+
+class CircuitBreaker:
+    """
+    Tracks the last `window` Gemini attempts. Once at least `min_calls` have been seen and
+    `failure_ratio` of them failed transiently, the breaker opens and calls fail fast with
+    CircuitOpen for `cooldown` seconds. Then one probe call is let through (half-open): success
+    closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, window: int = 20, min_calls: int = 10, failure_ratio: float = 0.5, cooldown: float = 15.0):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.opens = 0
+        self.short_circuited = 0
+        self._outcomes: deque = deque(maxlen=window)
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _set(self, state: str):
+        if state != self.state:
+            self.state = state
+            breaker_transitions_total.inc(to=state)
+
+    def is_open(self) -> bool:
+        """
+        True while calls would be refused. Doesn't take the half-open probe slot.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self._set(HALF_OPEN)
+            return self.state == OPEN or (self.state == HALF_OPEN and self._probe_in_flight)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self._set(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def release(self, probe: bool):
+        """
+        An attempt ended without telling us anything about Gemini (cancelled, or out of the
+        request's own deadline): give back the half-open probe slot it took, if it took it.
+        """
+        with self._lock:
+            if probe and self.state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record(self, ok: bool):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self._outcomes.clear()
+                    self._set(CLOSED)
+                else:
+                    self._open()
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if (
+                self.state == CLOSED
+                and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_ratio
+            ):
+                self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self.opens += 1
+        self._outcomes.clear()
+        self._set(OPEN)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "recent_calls": len(self._outcomes),
+            "recent_failures": self._outcomes.count(False),
+            "opens": self.opens,
+            "short_circuited": self.short_circuited,
+        }
+
+
+class LatencyTracker:
+    """
+    Rolling window of successful call latencies, for the hedging threshold.
+    """
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples: deque = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ResilientCaller:
+    """
+    Wraps blocking Gemini SDK calls with:
+      - retries with full-jitter exponential backoff for transient errors, never past the
+        request's deadline (the scheduler's, else `default_deadline` seconds)
+      - optional hedging: if an attempt outlives the recent p95 a duplicate is fired and the
+        first reply wins, limited to `hedge_budget` of calls
+      - a circuit breaker; while it is open calls raise CircuitOpen immediately
+    """
+
+    def __init__(
+        self,
+        retries: int = 3,
+        backoff_base: float = 0.25,
+        backoff_cap: float = 4.0,
+        default_deadline: float = 20.0,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_budget: float = 0.1,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.default_deadline = default_deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_budget = hedge_budget
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.gave_up = 0
+
+    @classmethod
+    def from_env(cls) -> "ResilientCaller":
+        """
+          GEMINI_RETRIES           retries per call for transient errors (default 3)
+          GEMINI_BACKOFF_BASE      first backoff ceiling in seconds, doubled per retry (default 0.25)
+          GEMINI_BACKOFF_CAP       largest backoff ceiling in seconds (default 4)
+          GEMINI_CALL_DEADLINE_S   deadline for calls made outside a scheduled request (default 20)
+          GEMINI_HEDGE             "1" to hedge slow calls (default off)
+          GEMINI_HEDGE_QUANTILE    latency quantile that triggers a hedge (default 0.95)
+          GEMINI_HEDGE_BUDGET      max share of calls that may be hedged (default 0.1)
+          GEMINI_BREAKER_WINDOW / GEMINI_BREAKER_MIN_CALLS / GEMINI_BREAKER_FAILURE_RATIO /
+          GEMINI_BREAKER_COOLDOWN_S  circuit breaker tuning (defaults 20 / 10 / 0.5 / 15)
+        """
+        return cls(
+            retries=int(os.getenv("GEMINI_RETRIES", "3")),
+            backoff_base=float(os.getenv("GEMINI_BACKOFF_BASE", "0.25")),
+            backoff_cap=float(os.getenv("GEMINI_BACKOFF_CAP", "4")),
+            default_deadline=float(os.getenv("GEMINI_CALL_DEADLINE_S", "20")),
+            hedge=os.getenv("GEMINI_HEDGE", "0") == "1",
+            hedge_quantile=float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.95")),
+            hedge_budget=float(os.getenv("GEMINI_HEDGE_BUDGET", "0.1")),
+            breaker=CircuitBreaker(
+                window=int(os.getenv("GEMINI_BREAKER_WINDOW", "20")),
+                min_calls=int(os.getenv("GEMINI_BREAKER_MIN_CALLS", "10")),
+                failure_ratio=float(os.getenv("GEMINI_BREAKER_FAILURE_RATIO", "0.5")),
+                cooldown=float(os.getenv("GEMINI_BREAKER_COOLDOWN_S", "15")),
+            ),
+        )
+
+    def _deadline(self) -> float:
+        deadline = current_deadline.get()
+        return deadline if deadline is not None else time.monotonic() + self.default_deadline
+
+    async def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run `fn(*args, **kwargs)` on the Gemini pool. Raises CircuitOpen, the last transient
+        error once retries or the deadline run out, or any non-transient error straight away.
+        """
+        self.calls += 1
+        deadline = self._deadline()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                gemini_attempts_total.inc(outcome="short_circuited")
+                raise CircuitOpen("Gemini circuit breaker is open")
+            # Nothing awaits between allow() and here, so this is the slot allow() just gave out
+            probe = self.breaker.state == HALF_OPEN
+            settled = False
+            remaining = deadline - time.monotonic()
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(self._attempt(fn, args, kwargs), timeout=max(0.001, remaining))
+                self.breaker.record(True)
+                settled = True
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and time.monotonic() >= deadline:
+                    # The request's own deadline ran out (a client's short deadline_ms, say);
+                    # that says nothing about Gemini, so it doesn't count against the breaker
+                    gemini_attempts_total.inc(outcome="deadline")
+                    self.gave_up += 1
+                    raise
+                transient = is_transient(e)
+                # Only upstream trouble counts against the breaker, not our own bad requests
+                self.breaker.record(not transient)
+                settled = True
+                gemini_attempts_total.inc(outcome="transient_error" if transient else "error")
+                if not transient:
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+                # Don't start an attempt that can't finish before the deadline
+                typical = self.latency.quantile(0.5) or 0.0
+                if attempt >= self.retries or time.monotonic() + delay + typical >= deadline:
+                    self.gave_up += 1
+                    raise
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                # Cancellation (client gone, hedge loser, an outer wait_for) is a BaseException
+                # and skips the handler above; a probe left marked in flight would keep the
+                # breaker half-open and refusing every call
+                if not settled:
+                    self.breaker.release(probe)
+            self.latency.add(time.perf_counter() - started)
+            gemini_attempts_total.inc(outcome="ok")
+            return result
+
+    async def stream(self, fn: Callable, *args, **kwargs):
+        """
+        Streaming counterpart of `call`: yields the items of the iterator `fn` returns, behind
+        the same breaker. Transient errors are retried only until the first item has been
+        yielded; after that a retry would replay the reply, so the error is raised instead.
+        """
+        self.calls += 1
+        deadline = self._deadline()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                gemini_attempts_total.inc(outcome="short_circuited")
+                raise CircuitOpen("Gemini circuit breaker is open")
+            probe = self.breaker.state == HALF_OPEN
+            settled = False
+            yielded = False
+            chunks = stream_gemini(fn, *args, **kwargs)
+            try:
+                async for item in chunks:
+                    yielded = True
+                    yield item
+                self.breaker.record(True)
+                settled = True
+            except Exception as e:
+                transient = is_transient(e)
+                self.breaker.record(not transient)
+                settled = True
+                gemini_attempts_total.inc(outcome="transient_error" if transient else "error")
+                if not transient or yielded:
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+                if attempt >= self.retries or time.monotonic() + delay >= deadline:
+                    self.gave_up += 1
+                    raise
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                # The consumer stopped reading (client gone): that's no verdict on Gemini
+                if not settled:
+                    self.breaker.release(probe)
+                await chunks.aclose()
+            gemini_attempts_total.inc(outcome="ok")
+            return
+
+    async def _attempt(self, fn: Callable, args, kwargs) -> Any:
+        threshold = self.latency.quantile(self.hedge_quantile) if self.hedge else None
+        if threshold is None or self.hedged >= self.hedge_budget * self.calls:
+            return await run_gemini(fn, *args, **kwargs)
+
+        first = asyncio.ensure_future(run_gemini(fn, *args, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=threshold)
+        if done:
+            return first.result()
+
+        # The first request is in the slow tail; race a duplicate against it
+        self.hedged += 1
+        second = asyncio.ensure_future(run_gemini(fn, *args, **kwargs))
+        pending = {first, second}
+        try:
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = "hedge" if task is second else "primary"
+                        if winner == "hedge":
+                            self.hedge_wins += 1
+                        gemini_hedges_total.inc(winner=winner)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The loser's thread runs to completion, but nobody waits for it
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.latency.quantile(0.95)
+        return {
+            "calls": self.calls,
+            "retried": self.retried,
+            "gave_up": self.gave_up,
+            "hedging": self.hedge,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p95_ms": round(1000 * p95, 1) if p95 is not None else None,
+            "breaker": self.breaker.stats(),
+        }
+
+
+_caller: Optional[ResilientCaller] = None
+
+
+def get_caller() -> ResilientCaller:
+    global _caller
+    if _caller is None:
+        _caller = ResilientCaller.from_env()
+    return _caller
+
+
+async def call_gemini(fn: Callable, *args, **kwargs) -> Any:
+    return await get_caller().call(fn, *args, **kwargs)
+
+
+def call_gemini_stream(fn: Callable, *args, **kwargs):
+    return get_caller().stream(fn, *args, **kwargs)
+
+
+def gemini_available() -> bool:
+    return not get_caller().breaker.is_open()
+
@@ -0,0 +1,184 @@
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import metrics
+
+# Where a scan goes after OCR: answer from the heuristic directly, ask the cheap text-only
+# model to structure the OCR text, or pay for the multimodal image call
+OCR = "ocr"
+TEXT_MODEL = "text_model"
+MULTIMODAL = "multimodal"
+
+# How much each field counts towards "this label was read completely"
+FIELD_WEIGHTS = {
+    "medicationName": 0.35,
+    "dosage": 0.25,
+    "frequency": 0.15,
+    "instructions": 0.15,
+    "warnings": 0.05,
+    "sideEffects": 0.05,
+}
+# Fields whose words must have been read confidently; the list fields are whole lines and
+# mostly matter for completeness
+CONFIDENCE_FIELDS = ("medicationName", "dosage", "frequency")
+
+_TOKEN_RX = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+route_decisions_total = metrics.counter(
+    "scan_route_decisions_total", "Routing decisions after OCR", ("decision",)
+)
+route_escalations_total = metrics.counter(
+    "scan_route_escalations_total", "Routed scans that had to fall through to a more expensive path", ("from_decision",)
+)
+route_score = metrics.histogram(
+    "scan_route_score", "OCR routing score (completeness x confidence)", (),
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+
+
+def _tokens(value) -> List[str]:
+    if isinstance(value, list):
+        value = " ".join(str(v) for v in value)
+    return _TOKEN_RX.findall(str(value or "").lower())
+
+
+def plausible_name(name: str) -> bool:
+    """
+    Reject the usual junk first lines: pharmacy headers, barcodes, stray symbols.
+    A name is short, mostly letters and not a sentence.
+    """
+    name = (name or "").strip()
+    if not 3 <= len(name) <= 40 or len(name.split()) > 5:
+        return False
+    letters = sum(ch.isalpha() for ch in name)
+    return letters >= 3 and letters / len(name) >= 0.6
+
+
+def word_confidences(words: Optional[List[Tuple[str, int]]]) -> Dict[str, int]:
+    # Normalized token -> lowest confidence it was read with anywhere on the label
+    out: Dict[str, int] = {}
+    for word, conf in words or ():
+        for token in _tokens(word):
+            if token not in out or conf < out[token]:
+                out[token] = conf
+    return out
+
+
+def score(parsed: Dict[str, Any], ocr: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Score a heuristic parse against the OCR it came from.
+      completeness  weighted share of fields filled (a junk medicationName doesn't count)
+      confidence    mean Tesseract confidence (0-1) of the words behind the key fields
+      score         completeness x confidence
+    Without per-word confidences (OCR seeded from text only) confidence is None and the
+    score uses a neutral 0.5, which never clears the direct-answer threshold.
+    """
+    parsed = parsed or {}
+    name_ok = plausible_name(parsed.get("medicationName", ""))
+    filled = {
+        field for field in FIELD_WEIGHTS
+        if parsed.get(field) and (field != "medicationName" or name_ok)
+    }
+    completeness = sum(FIELD_WEIGHTS[f] for f in filled)
+
+    words = (ocr or {}).get("words")
+    confidence = None
+    if words:
+        confs = word_confidences(words)
+        fallback = sum(c for _, c in words) / len(words)
+        weighted, weight = 0.0, 0.0
+        for field in CONFIDENCE_FIELDS:
+            if field not in filled:
+                continue
+            tokens = _tokens(parsed[field])
+            if not tokens:
+                continue
+            field_conf = sum(confs.get(t, fallback) for t in tokens) / len(tokens)
+            weighted += FIELD_WEIGHTS[field] * field_conf
+            weight += FIELD_WEIGHTS[field]
+        confidence = round((weighted / weight if weight else fallback) / 100.0, 3)
+
+    return {
+        "score": round(completeness * (0.5 if confidence is None else confidence), 3),
+        "completeness": round(completeness, 3),
+        "confidence": confidence,
+        "name_ok": name_ok,
+        "fields": sorted(filled),
+    }
+
+
+class Router:
+    """
+    Decides, per scan, the cheapest path likely to give a correct answer:
+      score >= ocr_min (and a plausible name)  -> return the OCR heuristic as-is
+      score >= text_min                        -> text-only model on the OCR text
+      otherwise                                -> multimodal image call
+    Decisions, escalations and the score distribution are exported via /metrics.
+    """
+
+    def __init__(self, ocr_min: float = 0.75, text_min: float = 0.4):
+        self.ocr_min = ocr_min
+        self.text_min = text_min
+        self._lock = threading.Lock()
+        self.decisions = {OCR: 0, TEXT_MODEL: 0, MULTIMODAL: 0}
+        self.escalations = {TEXT_MODEL: 0}
+        self._score_sum = 0.0
+
+    @classmethod
+    def from_env(cls) -> "Router":
+        """
+          ROUTE_OCR_MIN   score needed to answer from OCR alone (default 0.75; >1 disables)
+          ROUTE_TEXT_MIN  score needed to try the text-only model first (default 0.4; >1 disables)
+        """
+        return cls(
+            ocr_min=float(os.getenv("ROUTE_OCR_MIN", "0.75")),
+            text_min=float(os.getenv("ROUTE_TEXT_MIN", "0.4")),
+        )
+
+    def decide(self, parsed: Dict[str, Any], ocr: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Return the score report with a `decision` added.
+        """
+        report = score(parsed, ocr)
+        if report["score"] >= self.ocr_min and report["name_ok"] and report["confidence"] is not None:
+            decision = OCR
+        elif report["score"] >= self.text_min:
+            decision = TEXT_MODEL
+        else:
+            decision = MULTIMODAL
+        report["decision"] = decision
+        with self._lock:
+            self.decisions[decision] += 1
+            self._score_sum += report["score"]
+        route_decisions_total.inc(decision=decision)
+        route_score.observe(report["score"])
+        return report
+
+    def escalated(self, decision: str):
+        # A cheap route didn't produce a usable answer and the scan moved on to multimodal
+        with self._lock:
+            self.escalations[decision] = self.escalations.get(decision, 0) + 1
+        route_escalations_total.inc(from_decision=decision)
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.decisions.values())
+        return {
+            "ocr_min": self.ocr_min,
+            "text_min": self.text_min,
+            "decisions": dict(self.decisions),
+            "escalations": dict(self.escalations),
+            "multimodal_ratio": round(self.decisions[MULTIMODAL] / total, 3) if total else 0.0,
+            "avg_score": round(self._score_sum / total, 3) if total else 0.0,
+        }
+
+
+_router: Optional[Router] = None
+
+
+def get_router() -> Router:
+    global _router
+    if _router is None:
+        _router = Router.from_env()
+    return _router
@@ -0,0 +1,213 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Lower value = served first. Interactive camera/upload scans jump ahead of batch work.
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+# Monotonic deadline of the request being served, so upstream calls (retries in particular)
+# can stop in time. Set on admission; tasks spawned afterwards inherit it.
+current_deadline: contextvars.ContextVar = contextvars.ContextVar("current_deadline", default=None)
+
+
+class Overloaded(Exception):
+    """
+    The queue is full (or this request was shed for a higher-priority one). Maps to a 503.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """
+    The request's deadline passed before (or while) it was served. Maps to a 504.
+    """
+
+
+class ClientGone(Exception):
+    """
+    The client disconnected while the request was queued or running.
+    """
+
+
+class Ticket:
+    def __init__(self, priority: int, deadline: float, degraded: bool):
+        self.priority = priority
+        self.deadline = deadline
+        self.degraded = degraded
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+
+class Scheduler:
+    """
+    Admission control in front of the scan pipeline.
+
+    At most `max_active` scans run at once. Extra requests wait in a priority queue bounded
+    at `max_queue`; when it's full, a newcomer either displaces the lowest-priority waiter or
+    gets a 503 with Retry-After. Once the queue is `degrade_at` deep, newly admitted scans are
+    marked `degraded`, which tells the pipeline to skip Gemini and answer from OCR alone.
+    Waiters whose deadline passes or whose client disconnects are dropped without running.
+    """
+
+    def __init__(self, max_active: int = 16, max_queue: int = 64, degrade_at: int = 16, default_deadline: float = 30.0):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.degrade_at = degrade_at
+        self.default_deadline = default_deadline
+        self.active = 0
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._service_time = 2.0  # EWMA of seconds per scan, for Retry-After
+        self.counters: Dict[str, int] = {
+            "admitted": 0, "queued": 0, "rejected": 0, "shed": 0,
+            "expired": 0, "disconnected": 0, "degraded": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "Scheduler":
+        """
+          SCHED_MAX_ACTIVE       scans processed at once per worker (default 16)
+          SCHED_MAX_QUEUE        scans allowed to wait (default 64)
+          SCHED_DEGRADE_AT       queue depth at which new scans skip Gemini (default 16)
+          SCHED_DEADLINE_S       default per-request deadline in seconds (default 30)
+        """
+        return cls(
+            max_active=int(os.getenv("SCHED_MAX_ACTIVE", "16")),
+            max_queue=int(os.getenv("SCHED_MAX_QUEUE", "64")),
+            degrade_at=int(os.getenv("SCHED_DEGRADE_AT", "16")),
+            default_deadline=float(os.getenv("SCHED_DEADLINE_S", "30")),
+        )
+
+    def depth(self, priority: Optional[int] = None) -> int:
+        return sum(1 for entry in self._queue if not entry[3].done() and (priority is None or entry[0] == priority))
+
+    def retry_after(self) -> int:
+        waiting = self.depth() + 1
+        return max(1, int(round(self._service_time * waiting / max(1, self.max_active))))
+
+    async def acquire(
+        self,
+        priority: str = "interactive",
+        deadline: Optional[float] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Ticket:
+        """
+        Wait for a slot. `deadline` is seconds from now (default: the scheduler default).
+        Raises Overloaded, DeadlineExceeded or ClientGone instead of admitting.
+        """
+        prio = PRIORITIES.get(priority, PRIORITIES["interactive"])
+        deadline_at = time.monotonic() + (self.default_deadline if deadline is None else deadline)
+
+        if self.active < self.max_active and not self.depth():
+            current_deadline.set(deadline_at)
+            return self._admit(prio, deadline_at)
+
+        if self.depth() >= self.max_queue:
+            self._shed_for(prio)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = (prio, next(self._seq), deadline_at, future)
+        heapq.heappush(self._queue, entry)
+        self.counters["queued"] += 1
+        try:
+            while True:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    self.counters["expired"] += 1
+                    raise DeadlineExceeded("deadline passed while queued")
+                try:
+                    # Wake up periodically to notice clients that went away while queued
+                    ticket = await asyncio.wait_for(asyncio.shield(future), timeout=min(remaining, 0.5))
+                    current_deadline.set(deadline_at)
+                    return ticket
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        self.counters["disconnected"] += 1
+                        raise ClientGone("client disconnected while queued")
+        except BaseException:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # A slot was handed to us just as we gave up; pass it on
+                self.release(future.result())
+            elif not future.done():
+                future.cancel()
+            raise
+
+    def release(self, ticket: Ticket):
+        # Safe to call twice (a stream releases from its generator and its response's background task)
+        if ticket.released:
+            return
+        ticket.released = True
+        elapsed = time.monotonic() - ticket.admitted_at
+        self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        self.active -= 1
+        while self._queue:
+            prio, _, deadline_at, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            if deadline_at <= time.monotonic():
+                self.counters["expired"] += 1
+                future.set_exception(DeadlineExceeded("deadline passed while queued"))
+                continue
+            future.set_result(self._admit(prio, deadline_at))
+            break
+
+    def _admit(self, prio: int, deadline_at: float) -> Ticket:
+        self.active += 1
+        self.counters["admitted"] += 1
+        degraded = self.depth() >= self.degrade_at
+        if degraded:
+            self.counters["degraded"] += 1
+        return Ticket(prio, deadline_at, degraded)
+
+    def _shed_for(self, prio: int):
+        # Evict the lowest-priority, most recently queued waiter if it ranks below the newcomer
+        live = [entry for entry in self._queue if not entry[3].done()]
+        victim = max(live, key=lambda e: (e[0], e[1]), default=None)
+        if victim is None or victim[0] <= prio:
+            self.counters["rejected"] += 1
+            raise Overloaded("scan queue is full", self.retry_after())
+        self.counters["shed"] += 1
+        victim[3].set_exception(Overloaded("shed for higher-priority work", self.retry_after()))
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_active": self.max_active,
+            "waiting": {name: self.depth(prio) for name, prio in PRIORITIES.items()},
+            "max_queue": self.max_queue,
+            "degrade_at": self.degrade_at,
+            "service_time_s": round(self._service_time, 3),
+            **self.counters,
+        }
+
+
+async def run_with_deadline(coro, ticket: Ticket, is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+    """
+    Run admitted work, cancelling it if the ticket's deadline passes (DeadlineExceeded) or the
+    client disconnects mid-flight (ClientGone), so nobody keeps paying for an abandoned scan.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            remaining = ticket.remaining()
+            if remaining <= 0:
+                raise DeadlineExceeded("deadline passed while processing")
+            done, _ = await asyncio.wait({task}, timeout=min(remaining, 0.5))
+            if done:
+                return task.result()
+            if is_disconnected is not None and await is_disconnected():
+                raise ClientGone("client disconnected while processing")
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional
+
+
+def _as_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(_as_text(v) for v in value if _as_text(v))
+    if isinstance(value, dict):
+        return ""
+    return str(value).strip()
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    elif not isinstance(value, list):
+        value = [value]
+    return [s for s in (_as_text(v) for v in value) if s]
+
+
+@dataclass(slots=True)
+class Medication:
+    """
+    Medication label fields, as every analyzer path returns them. `from_raw` coerces whatever
+    a model or parser produced: missing fields get defaults, a bare string where a list is
+    expected becomes a one-item list, unknown keys are dropped.
+    """
+
+    medicationName: str = ""
+    genericName: str = ""
+    dosage: str = ""
+    frequency: str = ""
+    instructions: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    sideEffects: List[str] = field(default_factory=list)
+    plainLanguage: str = ""
+
+    @classmethod
+    def from_raw(cls, data: Any) -> Optional["Medication"]:
+        """
+        None unless `data` is a dict with at least one known field.
+        """
+        if not isinstance(data, dict) or not any(name in data for name in MEDICATION_FIELDS):
+            return None
+        return cls(**{name: coerce_field(name, data.get(name)) for name in MEDICATION_FIELDS})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in MEDICATION_FIELDS}
+
+    def is_empty(self) -> bool:
+        return not any(getattr(self, name) for name in MEDICATION_FIELDS)
+
+
+MEDICATION_FIELDS = tuple(f.name for f in fields(Medication))
+_LIST_FIELDS = {"instructions", "warnings", "sideEffects"}
+
+
+def coerce_field(name: str, value: Any) -> Any:
+    return _as_list(value) if name in _LIST_FIELDS else _as_text(value)
+
+
+@dataclass(slots=True)
+class ScanResult:
+    """
+    What the scan endpoints send back: the useful fields, the pipeline path that produced them,
+    and, only when asked for (`?diagnostics=true`), the analyzer's raw output and stage timings.
+
+    `text` holds the Medication fields for meds, {"items", "totals", "plain"} for food (just
+    {"plain": ...} if the model's reply couldn't be read as items), or {"error": ...}.
+    """
+
+    text: Dict[str, Any]
+    path: str
+    degraded: bool = False
+    cached: bool = False
+    raw_output: Optional[Dict[str, Any]] = None
+    diagnostics: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_analyzer(cls, result: Any, kind: str = "meds", verbose: bool = False, cached: bool = False) -> "ScanResult":
+        result = result if isinstance(result, dict) else {}
+        text = result.get("text") if isinstance(result.get("text"), dict) else {}
+        diagnostics = result.get("diagnostics") if isinstance(result.get("diagnostics"), dict) else {}
+        if "error" in text or "error" in result:
+            path = "error"
+            text = {"error": str(text.get("error") or result.get("error"))}
+        elif kind == "meds":
+            med = Medication.from_raw(text)
+            text = med.to_dict() if med is not None else {"plain": _as_text(text.get("plain"))}
+            path = diagnostics.get("path") or "multimodal"
+        elif isinstance(text.get("items"), list):
+            # Food with nutrients from the local table
+            text = {"items": text["items"], "totals": text.get("totals") or {}, "plain": _as_text(text.get("plain"))}
+            path = diagnostics.get("path") or "multimodal"
+        else:
+            text = {"plain": _as_text(text.get("plain"))}
+            path = diagnostics.get("path") or "multimodal"
+        return cls(
+            text=text,
+            path="cache" if cached else path,
+            degraded=bool(diagnostics.get("degraded")),
+            cached=cached,
+            raw_output=result.get("raw_output") if verbose else None,
+            diagnostics=(diagnostics or None) if verbose else None,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Defaults are left out so the common answer is just fields + path
+        out: Dict[str, Any] = {"text": self.text, "path": self.path}
+        if self.degraded:
+            out["degraded"] = True
+        if self.cached:
+            out["cached"] = True
+        if self.raw_output is not None:
+            out["raw_output"] = self.raw_output
+        if self.diagnostics is not None:
+            out["diagnostics"] = self.diagnostics
+        return out
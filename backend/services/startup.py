@@ -0,0 +1,117 @@
+import asyncio
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Heavy third-party modules the request path needs. They are imported (and so compiled and
+# initialised) during startup instead of inside the first request that touches them.
+# Missing optional ones are recorded and skipped.
+HEAVY_MODULES = (
+    "numpy",
+    "cv2",
+    "PIL.Image",
+    "google.generativeai",
+    "google.api_core.exceptions",
+)
+
+
+class StartupProfile:
+    """
+    Wall-clock time of each startup step (module imports, SDK configuration, table loads,
+    worker spawn), so a slow cold start can be pinned on its cause. Exposed under `startup`
+    in /pools/stats and as `startup_step_seconds` in /metrics.
+    """
+
+    def __init__(self):
+        self.steps: List[Dict[str, Any]] = []
+        self.started = time.perf_counter()
+        self.ready_s: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, error: Optional[str] = None):
+        with self._lock:
+            self.steps.append({"step": name, "ms": round(1000 * seconds, 1), "error": error})
+
+    @contextmanager
+    def step(self, name: str):
+        # Failures are recorded, not raised: a missing optional dependency shouldn't stop the app
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.record(name, time.perf_counter() - started, error)
+
+    def import_modules(self, names: Iterable[str] = HEAVY_MODULES):
+        for name in names:
+            if name in sys.modules:
+                continue
+            with self.step("import " + name):
+                importlib.import_module(name)
+
+    def run(self, steps: Iterable[Tuple[str, Callable[[], Any]]]):
+        for name, fn in steps:
+            with self.step(name):
+                fn()
+
+    def ready(self):
+        self.ready_s = time.perf_counter() - self.started
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            steps = list(self.steps)
+        return {
+            "ready_ms": round(1000 * self.ready_s, 1) if self.ready_s is not None else None,
+            "steps": steps,
+            "slowest": max(steps, key=lambda s: s["ms"])["step"] if steps else None,
+        }
+
+
+profile = StartupProfile()
+
+
+def default_steps() -> List[Tuple[str, Callable[[], Any]]]:
+    """
+    One-time initialisation shared by the API and the standalone worker, in order.
+    """
+    from services import clients, drug_names, label_parser, nutrition, resilience, routing
+
+    return [
+        ("gemini_sdk", clients.configure),
+        ("google_exceptions", resilience.google_exceptions),
+        ("label_rules", label_parser.default_parser),
+        ("nutrition_table", nutrition.get_table),
+        ("drug_names", drug_names.get_index),
+        ("router", routing.get_router),
+    ]
+
+
+async def warm_up(extra: Iterable[Tuple[str, Callable[[], Any]]] = ()):
+    """
+    Import the heavy modules and run the init steps in a worker thread, while the OCR and label
+    extractor worker processes spawn in others (the OCR ones import PIL/Tesseract themselves).
+    Nothing here touches the network; `clients.warm` does that separately, in the background.
+    STARTUP_WARM=0 skips all of it: workers come up sooner and the first scans pay instead.
+    """
+    if os.getenv("STARTUP_WARM", "1") != "1":
+        return
+    from services.extractor import get_extractor
+    from services.ocr import get_engine
+
+    loop = asyncio.get_running_loop()
+
+    def imports_and_steps():
+        profile.import_modules()
+        profile.run(default_steps())
+        profile.run(extra)
+
+    await asyncio.gather(
+        loop.run_in_executor(None, imports_and_steps),
+        loop.run_in_executor(None, profile.run, [("ocr_workers", get_engine().start)]),
+        loop.run_in_executor(None, profile.run, [("extractor_workers", get_extractor().start)]),
+    )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app imports its modules as `services.*` from the backend directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
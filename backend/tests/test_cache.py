@@ -0,0 +1,78 @@
+import threading
+
+from services.cache import DiskTier, MemoryTier, ResultCache, content_key, is_cacheable
+
+ANSWER = {"text": {"medicationName": "Ibuprofen"}, "diagnostics": {"path": "multimodal"}}
+
+
+def test_memory_hit_and_miss():
+    cache = ResultCache()
+    key = content_key(b"label", "meds")
+    assert cache.get(key, "meds") is None
+    cache.store(key, ANSWER, "meds")
+    hit = cache.get(key, "meds")
+    assert hit == ANSWER
+    # Callers get their own copy
+    hit["text"]["medicationName"] = "changed"
+    assert cache.get(key, "meds") == ANSWER
+    assert cache.counts() == {"hits": 2, "near_hits": 0, "disk_hits": 0, "misses": 1, "stores": 1}
+
+
+def test_namespaces_do_not_share_keys():
+    assert content_key(b"label", "meds") != content_key(b"label", "food")
+
+
+def test_expired_entries_miss():
+    cache = ResultCache(memory=MemoryTier(ttl=-1))
+    cache.store("k", ANSWER)
+    assert cache.get("k") is None
+    assert len(cache.memory) == 0
+
+
+def test_disk_tier_refills_memory(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ResultCache(disk=DiskTier(path)).store("k", ANSWER)
+    # A fresh process: empty memory, same file
+    cache = ResultCache(disk=DiskTier(path))
+    assert cache.get("k") == ANSWER
+    assert cache.get("k") == ANSWER
+    assert (cache.counts()["disk_hits"], cache.counts()["hits"]) == (1, 1)
+
+
+def test_expired_disk_entries_are_deleted(tmp_path):
+    disk = DiskTier(str(tmp_path / "cache.sqlite3"), ttl=-1)
+    disk.set("k", ANSWER)
+    assert disk.get("k") is None
+    assert disk.purge_expired() == 0
+
+
+def test_near_hit_by_perceptual_hash():
+    cache = ResultCache(use_phash=True, max_distance=2)
+    cache.store("original", ANSWER, "meds", phash=0b1011 << 40)
+    assert cache.get("recapture", "meds", phash=(0b1011 << 40) | 0b1) == ANSWER
+    assert cache.get("other", "meds", phash=(0b1011 << 40) | 0b111) is None
+    assert cache.get("recapture", "food", phash=(0b1011 << 40) | 0b1) is None
+    assert cache.counts()["near_hits"] == 1
+
+
+def test_counts_survive_concurrent_lookups():
+    cache = ResultCache()
+    cache.store("k", ANSWER)
+
+    def hammer():
+        for _ in range(2000):
+            cache.get("k")
+            cache.get("missing")
+
+    threads = [threading.Thread(target=hammer) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (cache.counts()["hits"], cache.counts()["misses"]) == (16000, 16000)
+
+
+def test_only_full_answers_are_cacheable():
+    assert is_cacheable(ANSWER)
+    assert not is_cacheable({"text": {"error": "Camera error"}})
+    assert not is_cacheable({"text": {"medicationName": "x"}, "diagnostics": {"degraded": True}})
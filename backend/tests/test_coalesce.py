@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+
+from services.coalesce import SingleFlight
+from services.scheduler import DeadlineExceeded
+
+RESULT = {"text": {"medicationName": "Amoxicillin"}, "diagnostics": {"path": "multimodal"}}
+DEGRADED = {"text": {"medicationName": "Amoxicillin"}, "diagnostics": {"path": "ocr_heuristic_fallback", "degraded": True}}
+
+
+def scan(result, delay=0.05, calls=None):
+    async def fn():
+        if calls is not None:
+            calls.append(1)
+        await asyncio.sleep(delay)
+        return dict(result)
+    return fn
+
+
+def test_local_followers_share_the_leaders_result():
+    async def main():
+        flight, calls = SingleFlight(), []
+        results = await asyncio.gather(*(flight.run("k", scan(RESULT, calls=calls)) for _ in range(3)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(shared or "" for _, shared in results) == ["", "local", "local"]
+    assert all(result == RESULT for result, _ in results)
+    assert flight.stats()["joined"] == 2 and flight.stats()["in_flight"] == 0
+
+
+def test_follower_runs_itself_when_the_leader_fails():
+    async def failing():
+        await asyncio.sleep(0.02)
+        raise RuntimeError("upstream down")
+
+    async def main():
+        flight = SingleFlight()
+        leader = asyncio.ensure_future(flight.run("k", failing))
+        await asyncio.sleep(0)
+        follower = await flight.run("k", scan(RESULT))
+        with pytest.raises(RuntimeError):
+            await leader
+        return flight, follower
+
+    flight, (result, shared) = asyncio.run(main())
+    assert result == RESULT and shared is None
+    assert flight.stats()["retried"] == 1
+
+
+def test_follower_stops_at_its_deadline():
+    async def main():
+        flight = SingleFlight()
+        leader = asyncio.ensure_future(flight.run("k", scan(RESULT, delay=0.5)))
+        await asyncio.sleep(0)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await flight.run("k", scan(RESULT), deadline=time.monotonic() + 0.05)
+        waited = time.monotonic() - started
+        await leader
+        return waited
+
+    assert asyncio.run(main()) < 0.3
+
+
+def test_remote_follower_reads_the_other_workers_result(tmp_path):
+    async def main():
+        a, b = SingleFlight(lock_dir=str(tmp_path)), SingleFlight(lock_dir=str(tmp_path), poll=0.005)
+        calls = []
+        leader = asyncio.ensure_future(a.run("k", scan(RESULT, delay=0.1, calls=calls)))
+        await asyncio.sleep(0.02)
+        follower = await b.run("k", scan(RESULT, calls=calls))
+        return await leader, follower, calls
+
+    (lead, lead_shared), (result, shared), calls = asyncio.run(main())
+    assert lead_shared is None and shared == "remote"
+    assert result == RESULT and len(calls) == 1
+
+
+def test_degraded_results_are_not_shared_across_workers(tmp_path):
+    async def main():
+        a, b = SingleFlight(lock_dir=str(tmp_path)), SingleFlight(lock_dir=str(tmp_path), poll=0.005)
+        calls = []
+        leader = asyncio.ensure_future(a.run("k", scan(DEGRADED, delay=0.1, calls=calls)))
+        await asyncio.sleep(0.02)
+        follower = await b.run("k", scan(RESULT, calls=calls))
+        await leader
+        return follower, calls
+
+    (result, shared), calls = asyncio.run(main())
+    # The follower got the lock but no published result, so it ran the scan itself
+    assert shared is None and result == RESULT and len(calls) == 2
+
+
+def test_remote_wait_is_bounded_by_the_deadline(tmp_path):
+    async def main():
+        a, b = SingleFlight(lock_dir=str(tmp_path)), SingleFlight(lock_dir=str(tmp_path), poll=0.005)
+        leader = asyncio.ensure_future(a.run("k", scan(RESULT, delay=0.5)))
+        await asyncio.sleep(0.02)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await b.run("k", scan(RESULT), deadline=time.monotonic() + 0.05)
+        waited = time.monotonic() - started
+        await leader
+        return b, waited
+
+    b, waited = asyncio.run(main())
+    assert waited < 0.3
+    assert b.stats()["deadline_exceeded"] == 1
@@ -0,0 +1,68 @@
+import pytest
+
+from services.drug_names import DrugIndex, edit_distance, fold
+
+
+@pytest.fixture(scope="module")
+def index():
+    return DrugIndex.from_csv()
+
+
+# The lookups bench/bench_drug_names.py times
+@pytest.mark.parametrize("query, name, distance", [
+    ("atorvastatin", "atorvastatin", 0),
+    ("Lipitor", "Lipitor", 0),
+    ("insulin glargine", "insulin glargine", 0),
+    ("Amoxici11in", "amoxicillin", 0),
+    ("SERTRA1INE", "sertraline", 0),
+    ("amoxicilin", "amoxicillin", 1),
+    ("atrovastatin", "atorvastatin", 1),
+])
+def test_lookup(index, query, name, distance):
+    found = index.lookup(query)
+    assert (found[0], found[3]) == (name, distance)
+
+
+@pytest.mark.parametrize("word", ["tablets", "pharmacy", "daily"])
+def test_label_words_are_not_drugs(index, word):
+    assert index.lookup(word) is None
+
+
+def test_fold_and_edit_distance():
+    assert fold("AMOXICI11IN") == fold("amoxicillin")
+    assert edit_distance("atrovastatin", "atorvastatin", 2) == 1
+    assert edit_distance("abcdef", "uvwxyz", 2) == 3
+
+
+def test_find_prefers_the_longest_leftmost_name(index):
+    assert index.find("Lipitor (atorvastatin) 20 mg").name == "Lipitor"
+    assert index.find("Lantus insulin glargine 100 units/mL").name == "Lantus"
+    assert index.find("Use insulin glargine nightly").name == "insulin glargine"
+
+
+def test_misread_name_fixed_in_place(index):
+    out = index.normalize({"medicationName": "AMOXICI11IN 250 MG", "plainLanguage": "AMOXICI11IN treats infections"})
+    assert out["medicationName"] == "AMOXICILLIN 250 MG"
+    assert out["plainLanguage"] == "AMOXICILLIN treats infections"
+    assert out["genericName"] == "amoxicillin"
+
+
+def test_exact_name_keeps_the_rest(index):
+    fields = {"medicationName": "METFORMIN HCL ER 750MG", "genericName": "metformin hydrochloride"}
+    assert index.normalize(fields) == fields
+
+
+def test_unknown_name_is_kept_and_candidate_reported(index):
+    report = {}
+    fields = {"medicationName": "CVS Pharmacy"}
+    out = index.normalize(fields, "CVS Pharmacy\nLisinopril 10 mg\nTake one tablet daily", report=report)
+    assert out == fields
+    assert report["candidate"]["name"] == "lisinopril"
+
+
+def test_empty_name_filled_from_the_first_lines(index):
+    text = "Rx 0012345\nLisinopril 10 mg\nTake one tablet daily"
+    out = index.normalize({"medicationName": ""}, text)
+    assert (out["medicationName"], out["genericName"]) == ("Lisinopril", "lisinopril")
+    # Past the first `lines` lines nothing is searched
+    assert index.normalize({"medicationName": ""}, "a\nb\nc\nLisinopril", lines=3) == {"medicationName": ""}
@@ -0,0 +1,57 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.executor import PoolSaturated, UpstreamPool, stream_gemini
+
+
+def test_timed_out_calls_keep_their_slot_until_they_finish():
+    async def main():
+        pool = UpstreamPool("test", ThreadPoolExecutor(2), max_concurrency=2)
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.run_limited(0.05, time.sleep, 0.3)
+        during = pool.stats()
+        started = time.perf_counter()
+        # Both workers are still sleeping, so this waits for one of them
+        assert await pool.run(lambda: 42) == 42
+        waited = time.perf_counter() - started
+        await asyncio.sleep(0.2)
+        return during, waited, pool.stats()
+
+    during, waited, after = asyncio.run(main())
+    assert (during["in_flight"], during["overrunning"], during["timed_out"]) == (0, 2, 2)
+    assert waited > 0.15
+    assert (after["in_flight"], after["overrunning"], after["completed"]) == (0, 0, 3)
+
+
+def test_queue_limit():
+    async def main():
+        pool = UpstreamPool("test", ThreadPoolExecutor(1), max_concurrency=1, max_queue=1)
+        first = asyncio.ensure_future(pool.run(time.sleep, 0.1))
+        second = asyncio.ensure_future(pool.run(time.sleep, 0.01))
+        await asyncio.sleep(0.01)
+        with pytest.raises(PoolSaturated):
+            await pool.run(time.sleep, 0)
+        await asyncio.gather(first, second)
+        return pool.stats()
+
+    assert asyncio.run(main())["rejected"] == 1
+
+
+def test_abandoned_stream_does_not_wait_for_the_next_chunk():
+    def slow_chunks():
+        yield "first"
+        time.sleep(0.5)
+        yield "second"
+
+    async def main():
+        chunks = stream_gemini(slow_chunks)
+        assert await chunks.__anext__() == "first"
+        started = time.perf_counter()
+        await chunks.aclose()
+        return time.perf_counter() - started
+
+    assert asyncio.run(main()) < 0.1
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from services.extractor import (
+    LabelExtractor, LocalExtractor, StructuredPerceptron, evaluate, gold_fields, read_corpus, train,
+)
+from services.label_parser import heuristic_parse
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return read_corpus()
+
+
+@pytest.fixture(scope="module")
+def model():
+    return LabelExtractor.from_file()
+
+
+def test_extracts_a_label(model):
+    text = (
+        "AMOXICILLIN 500 MG CAPSULES\n"
+        "Take 1 capsule by mouth three times daily\n"
+        "WARNING: Do not take if allergic to penicillin."
+    )
+    out = model.extract(text)
+    assert (out["medicationName"], out["dosage"], out["frequency"]) == ("AMOXICILLIN", "500 MG", "three times daily")
+    assert out["instructions"] == ["Take 1 capsule by mouth three times daily"]
+    assert out["warnings"] == ["WARNING: Do not take if allergic to penicillin."]
+
+
+def test_empty_text(model):
+    assert model.extract("  \n")["medicationName"] == ""
+
+
+def test_shipped_weights_beat_the_regex_parse(model, corpus):
+    # The hand-annotated real OCR samples come first in the corpus
+    real = corpus[:6]
+    ours, regex = evaluate(model.extract, real), evaluate(heuristic_parse, real)
+    assert ours["medicationName"] == 1.0
+    assert sum(ours.values()) > sum(regex.values())
+
+
+def test_gold_fields(corpus):
+    gold = gold_fields(corpus[0])
+    assert (gold["medicationName"], gold["dosage"], gold["frequency"]) == ("AMOXICILLIN", "500 MG", "three times daily")
+
+
+def test_training_round_trips(corpus):
+    small = corpus[:40]
+    trained = train(small, epochs=3)
+    texts = ["\n".join(text for _, text, _ in label) for label in small[:5]]
+    restored = LabelExtractor(
+        StructuredPerceptron.from_dict(trained.lines.to_dict()),
+        StructuredPerceptron.from_dict(trained.tokens.to_dict()),
+        trained.rules,
+    )
+    assert restored.extract_many(texts) == trained.extract_many(texts)
+
+
+def test_concurrent_requests_share_a_batch():
+    extractor = LocalExtractor(workers=0, batch_size=8, batch_wait=0.01)
+
+    async def main():
+        return await asyncio.gather(*(extractor.extract(f"IBUPROFEN {n}00 MG TABLETS") for n in range(1, 6)))
+
+    results = asyncio.run(main())
+    assert [r["dosage"] for r in results] == [f"{n}00 MG" for n in range(1, 6)]
+    assert (extractor.stats()["batches"], extractor.stats()["extracted"]) == (1, 5)
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+from services.jobs import DONE, FAILED, QUEUED, RUNNING, CallbackRejected, JobQueueFull, JobStore, check_callback_url
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = JobStore(str(tmp_path / "jobs.sqlite3"), lease=60.0, max_attempts=2)
+    yield s
+    s.close()
+
+
+def expire_lease(store, job_id):
+    with store._lock:
+        store._conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+def test_claim_complete(store):
+    job_id = store.enqueue("analyze-meds", b"img", "image/jpeg")
+    assert store.get(job_id)["status"] == QUEUED
+    job = store.claim("w1")
+    assert (job["id"], job["data"], job["attempts"]) == (job_id, b"img", 1)
+    assert store.claim("w2") is None
+    assert store.complete(job_id, {"text": "ok"}, job["worker"], job["attempts"])
+    done = store.get(job_id)
+    assert done["status"] == DONE and done["result"] == {"text": "ok"}
+
+
+def test_fail_requeues_until_max_attempts(store):
+    job_id = store.enqueue("analyze-food", b"img")
+    job = store.claim("w1")
+    assert store.fail(job_id, "boom", job["attempts"], job["worker"]) == QUEUED
+    job = store.claim("w1")
+    assert job["attempts"] == 2
+    assert store.fail(job_id, "boom", job["attempts"], job["worker"]) == FAILED
+    assert store.claim("w1") is None
+    assert store.get(job_id)["error"] == "boom"
+
+
+def test_expired_lease_is_reclaimed_and_late_result_dropped(store):
+    job_id = store.enqueue("analyze-meds", b"img")
+    first = store.claim("w1")
+    expire_lease(store, job_id)
+    second = store.claim("w2")
+    assert second["id"] == job_id and second["attempts"] == 2
+    assert store.get(job_id)["status"] == RUNNING
+    # The first worker finishing late no longer holds the job
+    assert not store.complete(job_id, {"text": "late"}, first["worker"], first["attempts"])
+    assert store.fail(job_id, "late", first["attempts"], first["worker"]) is None
+    assert store.complete(job_id, {"text": "ok"}, second["worker"], second["attempts"])
+    assert store.get(job_id)["result"] == {"text": "ok"}
+
+
+def test_expired_lease_on_last_attempt_fails_the_job(store):
+    job_id = store.enqueue("analyze-meds", b"img", callback_url="https://example.org/hook")
+    store.claim("w1")
+    expire_lease(store, job_id)
+    store.claim("w2")
+    expire_lease(store, job_id)
+    # Both attempts lost their lease (worker crashed or stalled): not retried a third time
+    assert store.claim("w3") is None
+    job = store.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"] == "lease expired after 2 attempts"
+    assert store.pop_expired() == [
+        {"id": job_id, "kind": "analyze-meds", "callback_url": "https://example.org/hook", "error": job["error"]}
+    ]
+    assert store.pop_expired() == []
+
+
+def test_insert_done_is_never_claimed(store):
+    job_id = store.insert_done("analyze-food", {"text": "cached"})
+    assert store.claim("w1") is None
+    job = store.get(job_id)
+    assert job["status"] == DONE and job["result"] == {"text": "cached"}
+
+
+def test_max_queued(tmp_path):
+    s = JobStore(str(tmp_path / "jobs.sqlite3"), max_queued=1)
+    s.enqueue("analyze-meds", b"a")
+    with pytest.raises(JobQueueFull):
+        s.enqueue("analyze-meds", b"b")
+    s.close()
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.org/x",
+    "http://127.0.0.1:8000/hook",
+    "http://localhost/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.1.2.3/hook",
+    "http://[::1]/hook",
+])
+def test_callback_url_rejects_internal_targets(url):
+    with pytest.raises(CallbackRejected):
+        check_callback_url(url)
+
+
+def test_callback_allow_list(monkeypatch):
+    monkeypatch.setenv("JOBS_CALLBACK_HOSTS", "hooks.internal")
+    check_callback_url("http://hooks.internal:9000/done")
+    with pytest.raises(CallbackRejected):
+        check_callback_url("http://other.internal/done")
@@ -0,0 +1,70 @@
+import pytest
+
+from services.nutrition import DEFAULT_TABLE_PATH, NutritionTable, food_items, portion_grams
+
+
+@pytest.fixture(scope="module")
+def table():
+    return NutritionTable.from_csv(DEFAULT_TABLE_PATH)
+
+
+# The names bench/bench_nutrition.py times, plus a few the head-noun rule has to get right
+@pytest.mark.parametrize("query, food", [
+    ("banana", "banana"),
+    ("Bananas", "banana"),
+    ("grilled chicken breast", "chicken breast"),
+    ("grilled chicken breasts", "chicken breast"),
+    ("spaghetti with tomato sauce", "pasta"),
+    ("bowl of oatmeal with blueberries", "oatmeal"),
+    ("roasted brocoli", "broccoli"),
+    ("greek yoghurt", "yogurt"),
+    ("2 slices of pepperoni pizza", "pepperoni pizza"),
+    ("chicken tikka masala", "chicken curry"),
+    ("apple pie", "apple pie"),
+    ("apple juice", "apple juice"),
+])
+def test_match(table, query, food):
+    row, score = table.match(query)
+    assert table.names[row] == food
+    assert 0 < score <= 1.0
+
+
+@pytest.mark.parametrize("query", ["dragonfruit", "a", ""])
+def test_unknown_foods(table, query):
+    assert table.match(query) is None
+
+
+@pytest.mark.parametrize("portion, grams, source", [
+    ("150 g", 150.0, "portion"),
+    ("6 oz", 6 * 28.35, "portion"),
+    ("2 slices", 200.0, "serving"),
+    ("half", 50.0, "serving"),
+    ("1/4", 25.0, "serving"),
+    ("a plate", 100.0, "serving"),
+    ("", 100.0, "serving"),
+])
+def test_portion_grams(portion, grams, source):
+    got, how = portion_grams(portion, 100.0)
+    assert (round(got, 2), how) == (round(grams, 2), source)
+
+
+def test_describe_totals_and_unknown_items(table):
+    out = table.describe([
+        {"name": "banana", "portion": "1 medium"},
+        {"name": "white rice", "grams": "150 g"},
+        {"name": "dragonfruit", "portion": "1"},
+    ])
+    banana, rice, unknown = out["items"]
+    assert (banana["grams"], banana["grams_from"]) == (118.0, "serving")
+    assert (rice["grams"], rice["grams_from"]) == (150.0, "model")
+    assert unknown["food"] is None and unknown["nutrients"] is None
+    assert out["totals"]["kcal"] == round(banana["nutrients"]["kcal"] + rice["nutrients"]["kcal"], 1)
+    assert "Not in the nutrition table: dragonfruit" in out["plain"]
+
+
+def test_food_items_shapes():
+    item = {"name": "banana", "portion": "1"}
+    assert food_items({"items": [item, {"portion": "no name"}]}) == [item]
+    assert food_items([item]) == [item]
+    assert food_items(item) == [item]
+    assert food_items("banana") == []
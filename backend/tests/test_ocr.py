@@ -0,0 +1,46 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from services import ocr
+
+
+def _init(lang, psm):
+    pass
+
+
+def _sleep_for(data):
+    # Stands in for Tesseract: the image bytes are how long to "recognize"
+    time.sleep(float(data.decode()))
+    return {"text": data.decode(), "pid": os.getpid()}
+
+
+@pytest.fixture
+def fake_tesseract(monkeypatch):
+    # Workers are forked after this, so they see the stand-ins too
+    monkeypatch.setattr(ocr, "_init_worker", _init)
+    monkeypatch.setattr(ocr, "_recognize", _sleep_for)
+
+
+def test_overrun_only_fails_its_own_job(fake_tesseract):
+    async def main():
+        engine = ocr.OcrEngine(workers=3, timeout=5.0).start()
+        try:
+            stuck = engine.recognize(b"3", timeout=0.2)
+            results = await asyncio.gather(stuck, engine.recognize(b"0.5"), engine.recognize(b"0.7"), return_exceptions=True)
+            retired = engine.stats()
+            after = await engine.recognize(b"0.05")
+            return results, retired, after, engine.stats()
+        finally:
+            engine.shutdown()
+
+    results, retired, after, stats = asyncio.run(main())
+    assert isinstance(results[0], ocr.OcrTimeout)
+    # The other jobs in flight on the same pool still finish
+    assert [r["text"] for r in results[1:]] == ["0.5", "0.7"]
+    # Once they had, the old pool (and its stuck worker) was terminated
+    assert retired["recycles"] == 1 and retired["retiring_pools"] == 0
+    assert after["text"] == "0.05"
+    assert stats["timeouts"] == 1
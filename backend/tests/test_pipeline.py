@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from services.pipeline import THREAD, Pipeline, PipelineEngine, Stage
+
+
+def build(calls, cache_size=16, batch=None):
+    def source(ctx, entry):
+        calls.append("source")
+        return len(ctx.scan.data)
+
+    async def double(ctx, entry):
+        calls.append("double")
+        await asyncio.sleep(0.01)
+        return 2 * ctx.output("source")
+
+    def broken(ctx, entry):
+        raise RuntimeError("stage failed")
+
+    async def flow(ctx):
+        return await ctx.get("double")
+
+    engine = PipelineEngine(threads=2, cache_size=cache_size)
+    return Pipeline("test", [
+        Stage("source", source, concurrency=THREAD, cacheable=True, batch=batch),
+        Stage("double", double, needs=("source",)),
+        Stage("broken", broken),
+    ], flow, engine=engine), engine
+
+
+def test_each_stage_runs_once_per_scan():
+    calls = []
+    pipeline, engine = build(calls)
+
+    async def main():
+        ctx = pipeline.context(b"abcd")
+        results = await asyncio.gather(*(ctx.get("double") for _ in range(5)))
+        return results, [entry["stage"] for entry in ctx.stages]
+
+    results, stages = asyncio.run(main())
+    assert results == [8] * 5
+    assert calls == ["source", "double"]
+    assert stages == ["source", "double"]
+    assert engine.stats()["stages"]["double"]["runs"] == 1
+
+
+def test_cacheable_output_is_reused_across_scans():
+    calls = []
+    pipeline, engine = build(calls)
+    assert asyncio.run(pipeline.run(b"abcd")) == 8
+    assert asyncio.run(pipeline.run(b"abcd")) == 8
+    assert calls == ["source", "double", "double"]
+    assert engine.stats()["stages"]["source"]["cache_hits"] == 1
+
+
+def test_failed_stage_reaches_the_caller_and_is_counted():
+    pipeline, engine = build([])
+
+    async def main():
+        ctx = pipeline.context(b"x")
+        with pytest.raises(RuntimeError):
+            await ctx.get("broken")
+        return ctx.output("broken", "missing"), ctx.stages[0]["ok"]
+
+    assert asyncio.run(main()) == ("missing", False)
+    assert engine.stats()["stages"]["broken"]["failures"] == 1
+
+
+def test_batch_stage_runs_once_for_the_scans_that_need_it():
+    batches = []
+
+    async def source_batch(contexts, entries):
+        batches.append(len(contexts))
+        return [len(ctx.scan.data) for ctx in contexts]
+
+    pipeline, engine = build([], batch=source_batch)
+
+    async def main():
+        warm = pipeline.context(b"aa")
+        await warm.get("source")
+        contexts = [pipeline.context(data) for data in (b"aa", b"bbb", b"cccc")]
+        return await engine.resolve_batch(contexts, "source")
+
+    assert asyncio.run(main()) == [2, 3, 4]
+    # b"aa" came from the stage cache
+    assert batches == [2]
+
+
+def test_unknown_needs_are_rejected():
+    with pytest.raises(ValueError):
+        Pipeline("bad", [Stage("a", lambda ctx, entry: None, needs=("missing",))], None)
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+
+from services.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, ResilientCaller
+
+
+def collect(caller, fn):
+    async def main():
+        return [item async for item in caller.stream(fn)]
+
+    return asyncio.run(main())
+
+
+def test_stream_is_refused_while_the_breaker_is_open():
+    caller = ResilientCaller(breaker=CircuitBreaker(min_calls=1, cooldown=60))
+    caller.breaker.record(False)
+    with pytest.raises(CircuitOpen):
+        collect(caller, lambda: iter(["never"]))
+
+
+def test_stream_retries_only_before_the_first_chunk():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("reset")
+        yield "a"
+        yield "b"
+
+    caller = ResilientCaller(backoff_base=0.01)
+    assert collect(caller, flaky) == ["a", "b"]
+    assert caller.retried == 1
+
+    def breaks_midway():
+        yield "a"
+        raise ConnectionError("reset")
+
+    with pytest.raises(ConnectionError):
+        collect(caller, breaks_midway)
+    assert caller.retried == 1
+
+
+def test_abandoned_stream_gives_back_the_probe():
+    breaker = CircuitBreaker(min_calls=1, cooldown=0)
+    breaker.record(False)
+    caller = ResilientCaller(breaker=breaker)
+
+    async def main():
+        chunks = caller.stream(lambda: iter(["a", "b"]))
+        assert await chunks.__anext__() == "a"
+        await chunks.aclose()
+
+    asyncio.run(main())
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+
+
+def test_breaker_opens_on_failure_ratio():
+    breaker = CircuitBreaker(window=4, min_calls=4, failure_ratio=0.5, cooldown=60)
+    for ok in (True, False, True):
+        breaker.record(ok)
+    # Too few calls to judge yet
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.is_open()
+    assert breaker.stats()["short_circuited"] == 1
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(min_calls=1, cooldown=0)
+    breaker.record(False)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # The probe is out; everyone else waits for its verdict
+    assert not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.opens == 2
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["recent_calls"] == 0
+
+
+def test_cancelled_call_gives_back_the_probe():
+    breaker = CircuitBreaker(min_calls=1, cooldown=0)
+    breaker.record(False)
+    caller = ResilientCaller(breaker=breaker)
+
+    async def main():
+        task = asyncio.ensure_future(caller.call(time.sleep, 0.2))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_bad_requests_do_not_trip_the_breaker():
+    caller = ResilientCaller(breaker=CircuitBreaker(min_calls=2, cooldown=60))
+
+    def bad_request():
+        raise ValueError("invalid argument")
+
+    async def main():
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                await caller.call(bad_request)
+
+    asyncio.run(main())
+    assert caller.breaker.state == CLOSED
+    assert caller.retried == 0
+
+
+def test_transient_errors_are_retried_then_open_the_breaker():
+    caller = ResilientCaller(retries=2, backoff_base=0.001, breaker=CircuitBreaker(min_calls=3, cooldown=60))
+
+    def unavailable():
+        raise ConnectionError("reset")
+
+    async def main():
+        with pytest.raises(ConnectionError):
+            await caller.call(unavailable)
+        with pytest.raises(CircuitOpen):
+            await caller.call(unavailable)
+
+    asyncio.run(main())
+    assert (caller.retried, caller.gave_up) == (2, 1)
+    assert caller.breaker.state == OPEN
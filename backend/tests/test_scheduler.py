@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from services.scheduler import DeadlineExceeded, Overloaded, Scheduler, Ticket, run_with_deadline
+
+
+def test_waiters_are_served_by_priority():
+    async def main():
+        sched = Scheduler(max_active=1, max_queue=4, degrade_at=10)
+        running = await sched.acquire()
+        order = []
+
+        async def wait(priority, name):
+            ticket = await sched.acquire(priority=priority)
+            order.append(name)
+            sched.release(ticket)
+
+        waiters = [asyncio.ensure_future(wait("batch", "batch")), asyncio.ensure_future(wait("interactive", "interactive"))]
+        await asyncio.sleep(0.01)
+        sched.release(running)
+        # Releasing twice is a no-op, not a second free slot
+        sched.release(running)
+        await asyncio.gather(*waiters)
+        return order, sched.active
+
+    assert asyncio.run(main()) == (["interactive", "batch"], 0)
+
+
+def test_full_queue_sheds_lower_priority_or_rejects():
+    async def main():
+        sched = Scheduler(max_active=1, max_queue=1, degrade_at=10)
+        await sched.acquire()
+        batch = asyncio.ensure_future(sched.acquire(priority="batch"))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.ensure_future(sched.acquire(priority="interactive"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(Overloaded):
+            await batch
+        with pytest.raises(Overloaded) as rejected:
+            await sched.acquire(priority="interactive")
+        interactive.cancel()
+        return sched.counters, rejected.value.retry_after
+
+    counters, retry_after = asyncio.run(main())
+    assert (counters["shed"], counters["rejected"]) == (1, 1)
+    assert retry_after >= 1
+
+
+def test_deadline_passes_while_queued():
+    async def main():
+        sched = Scheduler(max_active=1, max_queue=4)
+        await sched.acquire()
+        with pytest.raises(DeadlineExceeded):
+            await sched.acquire(deadline=0.05)
+        return sched.counters["expired"]
+
+    assert asyncio.run(main()) == 1
+
+
+def test_deep_queue_degrades_new_admissions():
+    async def main():
+        sched = Scheduler(max_active=1, max_queue=4, degrade_at=1)
+        first = await sched.acquire()
+        waiters = [asyncio.ensure_future(sched.acquire()) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        sched.release(first)
+        second = await waiters[0]
+        waiters[1].cancel()
+        return first.degraded, second.degraded
+
+    assert asyncio.run(main()) == (False, True)
+
+
+def test_run_with_deadline_cancels_the_work():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        ticket = Ticket(0, time.monotonic() + 0.05, False)
+        with pytest.raises(DeadlineExceeded):
+            await run_with_deadline(slow(), ticket)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert cancelled == [True]
@@ -0,0 +1,53 @@
+"""
+Standalone job worker: processes scans queued through POST /jobs/... without serving HTTP.
+
+Point it at the same queue file as the API (JOBS_DB) and run as many as the machine's cores
+and the Gemini quota allow; set JOBS_WORKERS=0 on the API processes so they only ingest.
+
+    cd backend
+    JOBS_DB=/var/lib/nutrilens/jobs.sqlite3 python worker.py --concurrency 4
+"""
+import argparse
+import asyncio
+import signal
+
+from services import startup
+from services.cache import ResultCache
+from services.executor import shutdown_pools
+from services.jobs import JobRunner, JobStore, default_handlers
+from services.ocr import get_engine
+
+
+async def run(concurrency: int, poll_interval: float):
+    store = JobStore.from_env()
+    runner = JobRunner(store, default_handlers(ResultCache.from_env()), concurrency=concurrency, poll_interval=poll_interval)
+    loop = asyncio.get_running_loop()
+    # Heavy imports, SDK setup and OCR workers up front, so the first job doesn't pay for them
+    await startup.warm_up()
+    startup.profile.ready()
+    warm = startup.profile.stats()
+    print(f"warmed up in {warm['ready_ms']} ms (slowest step: {warm['slowest']})")
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    runner.start()
+    print(f"job worker {runner.name} processing {store.path} with concurrency {concurrency}")
+    await stop.wait()
+    # Unfinished jobs are retried by another worker once their lease runs out
+    await runner.stop()
+    get_engine().shutdown()
+    shutdown_pools()
+    store.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", type=int, default=4, help="jobs processed at once")
+    ap.add_argument("--poll-interval", type=float, default=0.5, help="seconds between queue polls when idle")
+    args = ap.parse_args()
+    asyncio.run(run(args.concurrency, args.poll_interval))
+
+
+if __name__ == "__main__":
+    main()